@@ -0,0 +1,122 @@
+"""
+Cache Codec - Mã hóa giá trị cache thành bytes: 1 byte tag kiểu + payload
+"""
+import json
+import os
+from datetime import date, datetime
+from typing import Any
+
+try:
+    import msgpack
+except ImportError:  # msgpack là tùy chọn
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:  # orjson là tùy chọn
+    orjson = None
+
+TAG_MSGPACK = 0x01
+TAG_ORJSON = 0x02
+TAG_STR = 0x03
+TAG_BYTES = 0x04
+TAG_NDARRAY = 0x05
+TAG_JSON = 0x06
+
+_TAGS = {TAG_MSGPACK, TAG_ORJSON, TAG_STR, TAG_BYTES, TAG_NDARRAY, TAG_JSON}
+
+
+def _default(value: Any):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if hasattr(value, "tolist"):  # numpy scalar / array lồng trong dict
+        return value.tolist()
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def _pick_codec() -> int:
+    name = os.getenv("CACHE_CODEC", "").lower()
+    if name == "json":
+        return TAG_JSON
+    if name == "orjson" and orjson:
+        return TAG_ORJSON
+    if name in ("", "msgpack") and msgpack:
+        return TAG_MSGPACK
+    if orjson:
+        return TAG_ORJSON
+    return TAG_JSON
+
+
+class CacheCodec:
+    """
+    - dict/list/số: msgpack (mặc định) hoặc orjson, thiếu cả hai thì json.
+    - str / bytes: lưu nguyên, không serialize.
+    - numpy array (embedding): raw bytes + dtype, đọc lại bằng np.frombuffer.
+    - Giá trị cũ (JSON hoặc chuỗi thường, không có tag) vẫn đọc được.
+    """
+
+    def __init__(self, structured_tag: int = None):
+        self.structured_tag = structured_tag or _pick_codec()
+
+    def encode(self, value: Any) -> bytes:
+        if isinstance(value, str):
+            return bytes([TAG_STR]) + value.encode("utf-8")
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return bytes([TAG_BYTES]) + bytes(value)
+        if type(value).__module__ == "numpy" and hasattr(value, "tobytes") and getattr(value, "ndim", 0) == 1:
+            dtype = value.dtype.str.encode("ascii")
+            return bytes([TAG_NDARRAY, len(dtype)]) + dtype + value.tobytes()
+
+        if self.structured_tag == TAG_MSGPACK:
+            return bytes([TAG_MSGPACK]) + msgpack.packb(value, default=_default, use_bin_type=True)
+        if self.structured_tag == TAG_ORJSON:
+            return bytes([TAG_ORJSON]) + orjson.dumps(
+                value, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+            )
+        return bytes([TAG_JSON]) + json.dumps(value, ensure_ascii=False, default=_default).encode("utf-8")
+
+    def decode(self, data: Any) -> Any:
+        if data is None:
+            return None
+        if isinstance(data, str):
+            return _decode_legacy(data)
+        if not data:
+            return ""
+
+        tag, payload = data[0], data[1:]
+        if tag not in _TAGS:
+            return _decode_legacy(data.decode("utf-8", errors="replace"))
+        if tag == TAG_STR:
+            return payload.decode("utf-8")
+        if tag == TAG_BYTES:
+            return bytes(payload)
+        if tag == TAG_MSGPACK:
+            # Key int (vd {session_id: ...}) vẫn đọc được như khi còn lưu JSON
+            return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+        if tag == TAG_ORJSON:
+            return orjson.loads(payload)
+        if tag == TAG_JSON:
+            return json.loads(payload)
+        # TAG_NDARRAY
+        import numpy as np
+        size = payload[0]
+        dtype = payload[1:1 + size].decode("ascii")
+        return np.frombuffer(payload[1 + size:], dtype=dtype)
+
+
+def _decode_legacy(text: str) -> Any:
+    """Entry ghi trước khi có codec: JSON, hoặc chuỗi thường"""
+    try:
+        return json.loads(text)
+    except (json.JSONDecodeError, ValueError):
+        return text
+
+
+def to_text(value: Any) -> str:
+    """Field của Redis hash / kết quả Lua (bytes) -> str"""
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8")
+    return value
+
+
+codec = CacheCodec()
@@ -1,23 +1,98 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 
 from dotenv import load_dotenv
 import os
 
+from config.pool_monitor import PoolMonitor
+
 load_dotenv()  
 
 DATABASE_URL = os.getenv("DATABASE")
+
+# Số caller đồng thời thật sự của từng pool trong MỘT worker:
+# - request: threadpool của anyio (40 thread: route sync, Depends(get_db)) + ~24 thread khác dùng SessionLocal
+#   (campaign 16, worker JobQueue, HandoverScheduler, send_* chạy qua to_thread)
+# - background: executor mặc định của asyncio.to_thread, nơi task nền dùng session sync
+# - async: coroutine hot path (asyncpg), chờ DB không giữ thread nên cần ít connection hơn
+_POOL_CALLERS = {
+    "request": 40 + 24,
+    "background": min(32, (os.cpu_count() or 1) + 4),
+    "async": 20,
+}
+
+# Ngân sách connection cho MỘT worker, mặc định = tổng số caller ở trên (không caller nào phải chờ pool).
+# Tổng số connection tối đa = DB_CONNECTIONS_PER_WORKER x số worker, phải nhỏ hơn max_connections
+# của Postgres (Postgres mặc định max_connections=100) trừ phần cho migration / psql / job ngoài.
+# Đặt nhỏ hơn thì mỗi pool bị thu nhỏ theo tỉ lệ caller.
+# VD: 4 worker, max_connections=400 -> DB_CONNECTIONS_PER_WORKER=90.
+DB_CONNECTIONS_PER_WORKER = int(os.getenv("DB_CONNECTIONS_PER_WORKER", sum(_POOL_CALLERS.values())))
+
+
+def _split_budget(pool: str, size_env: str, overflow_env: str):
+    """Phần của `pool` trong ngân sách (theo tỉ lệ caller): một nửa thường trực, nửa còn lại cho burst; biến môi trường riêng thì ưu tiên"""
+    share = _POOL_CALLERS[pool] / sum(_POOL_CALLERS.values())
+    total = max(2, int(DB_CONNECTIONS_PER_WORKER * share))
+    pool_size = int(os.getenv(size_env, total // 2))
+    max_overflow = int(os.getenv(overflow_env, total - total // 2))
+    return pool_size, max_overflow
+
+
+POOL_SIZE, MAX_OVERFLOW = _split_budget("request", "POOL_SIZE", "MAX_OVERFLOW")
 engine = create_engine(
     url = DATABASE_URL,
-    pool_size=100,        # mạnh hơn
-    max_overflow=100,      # cho burst
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
     pool_timeout=30,
     pool_recycle=1800,
     pool_pre_ping=True 
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Pool riêng cho background task -> task nền không tranh connection với request
+BACKGROUND_POOL_SIZE, BACKGROUND_MAX_OVERFLOW = _split_budget("background", "BACKGROUND_POOL_SIZE", "BACKGROUND_MAX_OVERFLOW")
+background_engine = create_engine(
+    url = DATABASE_URL,
+    pool_size=BACKGROUND_POOL_SIZE,
+    max_overflow=BACKGROUND_MAX_OVERFLOW,
+    pool_timeout=10,
+    pool_recycle=1800,
+    pool_pre_ping=True
+)
+BackgroundSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=background_engine)
+
+
+
+def _async_url(url: str) -> str:
+    """postgresql:// hoặc postgresql+psycopg2:// -> postgresql+asyncpg://"""
+    if not url:
+        return url
+    scheme, rest = url.split("://", 1)
+    return f"postgresql+asyncpg://{rest}" if scheme.startswith("postgres") else url
+
+
+# Engine async (asyncpg) cho hot path chạy trên event loop: chờ DB không chặn các coroutine khác
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE") or _async_url(DATABASE_URL)
+ASYNC_POOL_SIZE, ASYNC_MAX_OVERFLOW = _split_budget("async", "ASYNC_POOL_SIZE", "ASYNC_MAX_OVERFLOW")
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=ASYNC_POOL_SIZE,
+    max_overflow=ASYNC_MAX_OVERFLOW,
+    pool_timeout=30,
+    pool_recycle=1800,
+    pool_pre_ping=True
+)
+# expire_on_commit=False: object vẫn đọc được sau commit mà không phải query lại (lazy load không dùng được với async)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+pool_monitors = {
+    "request": PoolMonitor(engine, "request"),
+    "background": PoolMonitor(background_engine, "background"),
+    "async": PoolMonitor(async_engine.sync_engine, "async"),
+}
+
 Base = declarative_base()
 
 
@@ -29,5 +104,15 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def get_pool_stats():
+    return {name: monitor.stats() for name, monitor in pool_monitors.items()}
+
+
 def create_tables():
+    """Giữ cho script cũ; app dùng config.migrations.run_migrations() lúc startup"""
     Base.metadata.create_all(bind=engine)
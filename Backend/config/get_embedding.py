@@ -1,25 +1,46 @@
 import os
+import hashlib
 import numpy as np
 import google.generativeai as genai
 from dotenv import load_dotenv
 from openai import OpenAI
 import numpy as np
+from config.redis_cache import cache_get, cache_set
 
 # Load biến môi trường
 load_dotenv()
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
+# Embedding của câu hỏi được cache (lưu raw bytes float32 qua cache codec)
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", 7 * 86400))
+
+
+def _embedding_cache_key(model: str, text: str) -> str:
+    return f"embedding:{model}:{hashlib.sha1(text.encode('utf-8')).hexdigest()}"
+
+
+def _cached_embedding(model: str, text: str, compute) -> np.ndarray | None:
+    key = _embedding_cache_key(model, text)
+    cached = cache_get(key)
+    if isinstance(cached, np.ndarray):
+        return cached
+    embed = compute()
+    if embed is not None:
+        cache_set(key, embed, ttl=EMBEDDING_CACHE_TTL)
+    return embed
+
 def get_embedding_gemini(text: str) -> np.ndarray | None:
     if not text or not text.strip():
         return None
-    
-    response = genai.embed_content(
-        model="gemini-embedding-001",
-        content=text
-    )
 
-    embed = response["embedding"]
-    return np.array(embed, dtype=np.float32)
+    def compute():
+        response = genai.embed_content(
+            model="gemini-embedding-001",
+            content=text
+        )
+        return np.array(response["embedding"], dtype=np.float32)
+
+    return _cached_embedding("gemini-embedding-001", text, compute)
 
 
 
@@ -30,11 +51,28 @@ def get_embedding_chatgpt(text: str) -> np.ndarray | None:
     if not text or not text.strip():
         return None
     
-    client = OpenAI(api_key=os.getenv("GPT_KEY"))
-    
-    response = client.embeddings.create(
-        model="text-embedding-3-large",
-        input=text
+    def compute():
+        client = OpenAI(api_key=os.getenv("GPT_KEY"))
+        response = client.embeddings.create(
+            model="text-embedding-3-large",
+            input=text
+        )
+        return np.array(response.data[0].embedding)
+
+    return _cached_embedding("text-embedding-3-large", text, compute)
+
+def get_embeddings_gemini(texts: list[str]) -> list[np.ndarray | None]:
+    """Tạo embedding cho nhiều đoạn text trong một request (batch)"""
+    valid = [(i, t) for i, t in enumerate(texts) if t and t.strip()]
+    results: list[np.ndarray | None] = [None] * len(texts)
+    if not valid:
+        return results
+
+    response = genai.embed_content(
+        model="gemini-embedding-001",
+        content=[t for _, t in valid]
     )
 
-    return np.array(response.data[0].embedding)
\ No newline at end of file
+    for (i, _), embed in zip(valid, response["embedding"]):
+        results[i] = np.array(embed, dtype=np.float32)
+    return results
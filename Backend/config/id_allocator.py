@@ -0,0 +1,61 @@
+"""
+ID Allocator - Cấp trước id thật từ sequence Postgres, mỗi worker giữ sẵn một block
+"""
+import asyncio
+import os
+from collections import deque
+from typing import Deque, Optional
+
+from sqlalchemy import text
+
+from config.database import AsyncSessionLocal
+
+ID_BLOCK_SIZE = int(os.getenv("ID_BLOCK_SIZE", 100))
+
+_RESERVE_SQL = text("SELECT nextval(pg_get_serial_sequence(:table, :column)) FROM generate_series(1, :size)")
+
+
+class SequenceAllocator:
+    """
+    Lấy một lúc `block_size` giá trị nextval() của cột serial rồi phát dần trong process.
+
+    - Id được cấp trước khi INSERT -> tin nhắn broadcast ngay đã mang id cuối cùng,
+      việc lưu DB vẫn chạy nền.
+    - Sequence không bao giờ trả trùng nên nhiều worker dùng chung an toàn;
+      id còn thừa khi worker tắt chỉ tạo khoảng trống, không ảnh hưởng thứ tự theo created_at.
+    """
+
+    def __init__(self, table: str, column: str = "id", block_size: int = ID_BLOCK_SIZE):
+        self.table = table
+        self.column = column
+        self.block_size = block_size
+        self._ids: Deque[int] = deque()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def _reserve(self):
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                _RESERVE_SQL, {"table": self.table, "column": self.column, "size": self.block_size}
+            )
+            self._ids.extend(sorted(row[0] for row in result))
+
+    async def next_id(self) -> int:
+        if not self._ids:
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                if not self._ids:
+                    await self._reserve()
+        return self._ids.popleft()
+
+
+message_ids = SequenceAllocator("messages")
+
+
+async def allocate_message_id() -> Optional[int]:
+    """Id cho tin nhắn sắp lưu; None nếu không cấp được (tin vẫn được lưu, id gán lúc ghi)"""
+    try:
+        return await message_ids.next_id()
+    except Exception as e:
+        print(f"❌ Lỗi cấp id tin nhắn: {e}")
+        return None
@@ -0,0 +1,235 @@
+"""
+Ingestion Pipeline - fetch sheet -> chunk -> embed (batch) -> ghi DB, các stage chạy chồng lên nhau
+"""
+import os
+import queue
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from config.database import SessionLocal
+from config.get_embedding import get_embeddings_gemini
+from config.sheet_chunker import TableChunker
+from models.knowledge_base import DocumentChunk
+
+SHEET_FETCH_CONCURRENCY = int(os.getenv("SHEET_FETCH_CONCURRENCY", 4))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 32))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 256))
+
+# Một nguồn dữ liệu: hàm trả về (tên bảng, header, iterator các hàng)
+TableSource = Callable[[], Tuple[str, List[str], Iterable[Dict[str, Any]]]]
+
+_DONE = object()
+
+
+class ChunkWriter:
+    """
+    Ghi chunk của MỘT knowledge base vào document_chunks, commit theo từng batch
+    (không giữ một transaction dài suốt pipeline).
+    Chunk cũ (id <= mốc lấy lúc khởi tạo) chỉ bị xóa khi commit; nếu pipeline bị hủy/lỗi
+    thì rollback xóa các chunk mới đã ghi, dữ liệu cũ vẫn còn nguyên.
+    """
+
+    def __init__(self, kb_id: int):
+        self.kb_id = kb_id
+        self.session: Session = SessionLocal()
+        self.old_max_id = self.session.query(func.max(DocumentChunk.id)).filter(
+            DocumentChunk.knowledge_base_id == kb_id
+        ).scalar() or 0
+        self.session.commit()
+
+    def write(self, batch: List[Tuple[str, Any]]):
+        rows = [
+            {
+                "chunk_text": text,
+                "search_vector": vector.tolist(),
+                "knowledge_base_id": self.kb_id
+            }
+            for text, vector in batch if vector is not None
+        ]
+        if rows:
+            self.session.execute(insert(DocumentChunk), rows)
+            self.session.commit()
+
+    def _delete(self, *criteria):
+        self.session.query(DocumentChunk).filter(
+            DocumentChunk.knowledge_base_id == self.kb_id, *criteria
+        ).delete(synchronize_session=False)
+        self.session.commit()
+
+    def commit(self):
+        try:
+            self._delete(DocumentChunk.id <= self.old_max_id)
+        finally:
+            self.session.close()
+
+    def rollback(self):
+        try:
+            self.session.rollback()
+            self._delete(DocumentChunk.id > self.old_max_id)
+        finally:
+            self.session.close()
+
+
+def sheet_source(worksheet) -> TableSource:
+    """Nguồn dữ liệu từ một worksheet gspread (hoặc fake client có cùng interface)"""
+    def fetch():
+        records = worksheet.get_all_records()
+        headers = list(records[0].keys()) if records else []
+        return worksheet.title, headers, records
+    return fetch
+
+
+class IngestionPipeline:
+    """
+    Producer/consumer:
+    - N thread fetch nguồn (giới hạn bởi `fetch_concurrency`) và chunk từng hàng,
+    - 1 thread gom chunk thành batch và gọi embedder,
+    - 1 thread ghi batch vào DB.
+    Thời gian tổng xấp xỉ stage chậm nhất thay vì tổng các stage.
+    """
+
+    def __init__(self, kb_id: int, job=None,
+                 fetch_concurrency: int = SHEET_FETCH_CONCURRENCY,
+                 embed_batch_size: int = EMBED_BATCH_SIZE,
+                 embedder: Callable[[List[str]], List[Any]] = get_embeddings_gemini,
+                 writer_factory: Callable[[int], Any] = ChunkWriter,
+                 chunker: Optional[TableChunker] = None):
+        self.kb_id = kb_id
+        self.job = job
+        self.fetch_concurrency = max(1, fetch_concurrency)
+        self.embed_batch_size = max(1, embed_batch_size)
+        self.embedder = embedder
+        self.writer_factory = writer_factory
+        self.chunker = chunker or TableChunker()
+        self._stop = threading.Event()
+        self._errors: List[BaseException] = []
+        self.stats = {"sources": 0, "rows": 0, "chunks": 0, "embeddings": 0}
+        self._stats_lock = threading.Lock()
+
+    # ---------- Điều phối ----------
+    def run(self, sources: List[TableSource]) -> Dict[str, int]:
+        chunk_q: queue.Queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        write_q: queue.Queue = queue.Queue(maxsize=4)
+
+        embed_thread = threading.Thread(target=self._guard, args=(self._embed_stage, chunk_q, write_q),
+                                        name="ingest-embed", daemon=True)
+        write_thread = threading.Thread(target=self._guard, args=(self._write_stage, write_q),
+                                        name="ingest-write", daemon=True)
+        embed_thread.start()
+        write_thread.start()
+
+        with ThreadPoolExecutor(max_workers=self.fetch_concurrency, thread_name_prefix="ingest-fetch") as pool:
+            futures = [pool.submit(self._guard, self._fetch_stage, source, chunk_q) for source in sources]
+            for future in as_completed(futures):
+                future.result()
+
+        self._put(chunk_q, _DONE, force=True)
+        embed_thread.join()
+        # Stage embed có thể đã chết giữa chừng -> luôn báo kết thúc cho stage ghi
+        self._put(write_q, _DONE, force=True)
+        write_thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+        if self.job:
+            self.job.check_cancelled()
+        return dict(self.stats)
+
+    def run_rows(self, title: str, headers: List[str], rows: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        """Chạy pipeline cho một nguồn dạng stream (file upload, ...)"""
+        return self.run([lambda: (title, headers, rows)])
+
+    def _guard(self, stage, *args):
+        try:
+            stage(*args)
+        except BaseException as e:
+            self._errors.append(e)
+            traceback.print_exc()
+            self._stop.set()
+
+    def _stopped(self) -> bool:
+        return self._stop.is_set() or self._is_cancelled()
+
+    def _is_cancelled(self) -> bool:
+        return bool(self.job and self.job.cancelled)
+
+    def _put(self, q: queue.Queue, item, force: bool = False):
+        # put có timeout để không kẹt khi stage phía sau đã dừng
+        while True:
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                if self._stopped() and not force:
+                    return
+                if self._stopped():
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def _count(self, name: str, n: int = 1):
+        with self._stats_lock:
+            self.stats[name] += n
+        if self.job:
+            self.job.advance(name, n)
+
+    # ---------- Stage ----------
+    def _fetch_stage(self, source: TableSource, chunk_q: queue.Queue):
+        if self._stopped():
+            return
+        title, headers, rows = source()
+        if isinstance(rows, list) and self.job:
+            self.job.add_total("rows", len(rows))
+
+        for chunk in self.chunker.chunk_rows(title, headers, self._count_rows(rows)):
+            if self._stopped():
+                return
+            if self.job:
+                self.job.add_total("embeddings")
+            self._count("chunks")
+            self._put(chunk_q, chunk)
+        self._count("sources")
+
+    def _count_rows(self, rows: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        for row in rows:
+            self._count("rows")
+            yield row
+
+    def _embed_stage(self, chunk_q: queue.Queue, write_q: queue.Queue):
+        batch: List[str] = []
+        while True:
+            item = chunk_q.get()
+            if self._stopped():
+                batch = []
+            elif item is not _DONE:
+                batch.append(item)
+            if batch and (len(batch) >= self.embed_batch_size or item is _DONE):
+                vectors = self.embedder(batch)
+                self._count("embeddings", len(batch))
+                self._put(write_q, list(zip(batch, vectors)))
+                batch = []
+            if item is _DONE:
+                return
+
+    def _write_stage(self, write_q: queue.Queue):
+        writer = self.writer_factory(self.kb_id)
+        try:
+            while True:
+                item = write_q.get()
+                if item is _DONE:
+                    break
+                if not self._stopped():
+                    writer.write(item)
+        except BaseException:
+            writer.rollback()
+            raise
+        if self._stopped():
+            writer.rollback()
+        else:
+            writer.commit()
@@ -0,0 +1,210 @@
+"""
+Migrations - Chạy các migration đánh số trong package `migrations/` đúng một lần, theo thứ tự
+
+    python -m config.migrations            # chạy các migration chưa áp dụng
+    python -m config.migrations status     # xem trạng thái
+    python -m config.migrations check      # EXPLAIN các query nóng, báo lỗi nếu không dùng index
+"""
+import importlib
+import pkgutil
+import sys
+from typing import List
+
+from sqlalchemy import text
+
+from config.database import engine
+
+# Khóa advisory: nhiều worker khởi động cùng lúc chỉ một worker chạy migration
+MIGRATION_LOCK_ID = 72_0431
+
+_CREATE_TABLE = text("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT now()
+    )
+""")
+
+
+def discover():
+    """
+    Mỗi module `migrations/mNNNN_*.py` khai báo:
+    - VERSION (int), DESCRIPTION (str), upgrade(conn)
+    - TRANSACTIONAL = False nếu chạy ngoài transaction (CREATE INDEX CONCURRENTLY)
+    """
+    import migrations
+    modules = []
+    for info in pkgutil.iter_modules(migrations.__path__):
+        if info.name.startswith("m"):
+            modules.append(importlib.import_module(f"migrations.{info.name}"))
+    modules.sort(key=lambda m: m.VERSION)
+    versions = [m.VERSION for m in modules]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Trùng VERSION migration: {versions}")
+    return modules
+
+
+def applied_versions(conn) -> set:
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def _record(conn, module):
+    conn.execute(
+        text("INSERT INTO schema_migrations (version, description) VALUES (:v, :d)"),
+        {"v": module.VERSION, "d": module.DESCRIPTION},
+    )
+
+
+def run_migrations(target_engine=engine) -> List[int]:
+    """Áp dụng các migration còn thiếu, trả về các version vừa chạy"""
+    ran = []
+    with target_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+        lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            lock_conn.execute(_CREATE_TABLE)
+            done = applied_versions(lock_conn)
+            for module in discover():
+                if module.VERSION in done:
+                    continue
+                print(f"🔧 Migration {module.VERSION}: {module.DESCRIPTION}")
+                if getattr(module, "TRANSACTIONAL", True):
+                    with target_engine.begin() as conn:
+                        module.upgrade(conn)
+                        _record(conn, module)
+                else:
+                    # Bước ngoài transaction phải idempotent (IF NOT EXISTS) vì có thể chạy lại khi lỗi giữa chừng
+                    module.upgrade(lock_conn)
+                    _record(lock_conn, module)
+                ran.append(module.VERSION)
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+    return ran
+
+
+def create_index_concurrently(conn, name: str, table: str, columns: str, using: str = None):
+    """
+    CREATE INDEX CONCURRENTLY không khóa ghi; lần build lỗi trước đó để lại index INVALID
+    thì xóa đi rồi build lại. `conn` phải ở chế độ AUTOCOMMIT.
+    """
+    invalid = conn.execute(text("""
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = :name AND NOT i.indisvalid
+    """), {"name": name}).first()
+    if invalid:
+        conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+    method = f"USING {using} " if using else ""
+    conn.execute(text(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON {table} {method}({columns})'))
+
+
+def create_partitioned_index_concurrently(conn, name: str, table: str, columns: str, using: str = None):
+    """
+    Bảng partition không cho CREATE INDEX CONCURRENTLY trên bảng cha: tạo index rỗng ON ONLY bảng cha,
+    build CONCURRENTLY trên từng partition rồi ATTACH. Partition tạo sau sẽ tự có index.
+    """
+    method = f"USING {using} " if using else ""
+    conn.execute(text(f'CREATE INDEX IF NOT EXISTS "{name}" ON ONLY {table} {method}({columns})'))
+    partitions = conn.execute(text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :table
+    """), {"table": table}).scalars().all()
+    for partition in partitions:
+        part_index = f"{name}_{partition}"[:63]
+        create_index_concurrently(conn, part_index, partition, columns, using)
+        attached = conn.execute(text("""
+            SELECT 1 FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE c.relname = :part_index AND p.relname = :name
+        """), {"part_index": part_index, "name": name}).first()
+        if not attached:
+            conn.execute(text(f'ALTER INDEX "{name}" ATTACH PARTITION "{part_index}"'))
+
+
+# ---------- Kiểm tra index cho các query nóng ----------
+# (tên, SQL, index mong đợi)
+HOT_QUERIES = [
+    ("history page",
+     "SELECT id FROM messages WHERE chat_session_id = 1 ORDER BY created_at DESC, id DESC LIMIT 20",
+     "ix_messages_session_created_id"),
+    ("latest messages (RAG)",
+     "SELECT id FROM messages WHERE chat_session_id = 1 ORDER BY created_at DESC LIMIT 10",
+     "ix_messages_session_created_id"),
+    ("messages by time",
+     "SELECT id FROM messages WHERE created_at >= now() - interval '1 day'",
+     "ix_messages_created_at"),
+    ("session by name",
+     "SELECT id FROM chat_sessions WHERE name = 'F-1'",
+     "ix_chat_sessions_name"),
+    ("customer info by session",
+     "SELECT id FROM customer_info WHERE chat_session_id = 1",
+     "ix_customer_info_chat_session_id"),
+    ("sessions by tag",
+     "SELECT chat_session_id FROM chat_session_tag WHERE tag_id = 1",
+     "ix_chat_session_tag_tag_id"),
+    ("message search",
+     "SELECT id FROM messages WHERE to_tsvector('vn_unaccent', COALESCE(content, '')) "
+     "@@ websearch_to_tsquery('vn_unaccent', 'ao khoac')",
+     "ix_messages_content_fts"),
+    ("customer search",
+     "SELECT id FROM customer_info WHERE to_tsvector('vn_unaccent', customer_search_text(customer_data)) "
+     "@@ websearch_to_tsquery('vn_unaccent', '0901')",
+     "ix_customer_info_fts"),
+]
+
+
+def _index_names(conn, index: str) -> List[str]:
+    """Tên index + tên các index con trên partition (plan của bảng partition chỉ hiện index con)"""
+    children = conn.execute(text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :index
+    """), {"index": index}).scalars().all()
+    return [index, *children]
+
+
+def check_index_usage(target_engine=engine) -> List[str]:
+    """
+    EXPLAIN từng query nóng, trả về danh sách lỗi (rỗng = tất cả dùng index mong đợi).
+    Tắt seq scan trong transaction để kết quả không phụ thuộc kích thước bảng lúc kiểm tra.
+    """
+    errors = []
+    with target_engine.connect() as conn:
+        conn.execute(text("SET LOCAL enable_seqscan = off"))
+        for name, sql, index in HOT_QUERIES:
+            plan = "\n".join(row[0] for row in conn.execute(text(f"EXPLAIN {sql}")))
+            if not any(candidate in plan for candidate in _index_names(conn, index)):
+                errors.append(f"{name}: không dùng {index}\n{plan}")
+        conn.rollback()
+    return errors
+
+
+def _main(argv: List[str]) -> int:
+    command = argv[1] if len(argv) > 1 else "upgrade"
+    if command == "upgrade":
+        print(f"✅ Đã chạy: {run_migrations() or 'không có migration mới'}")
+        return 0
+    if command == "status":
+        with engine.connect() as conn:
+            conn.execute(_CREATE_TABLE)
+            done = applied_versions(conn)
+            conn.commit()
+        for module in discover():
+            mark = "x" if module.VERSION in done else " "
+            print(f"[{mark}] {module.VERSION:04d} {module.DESCRIPTION}")
+        return 0
+    if command == "check":
+        errors = check_index_usage()
+        for error in errors:
+            print(f"❌ {error}")
+        if not errors:
+            print(f"✅ {len(HOT_QUERIES)} query nóng đều dùng index")
+        return 1 if errors else 0
+    print(__doc__)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv))
@@ -0,0 +1,85 @@
+"""
+Near Cache - LRU trong process đặt trước Redis, TTL ngắn, có thống kê hit/miss theo prefix
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Tuple
+
+MISS = object()
+
+
+def key_prefix(key: str) -> str:
+    return key.split(":", 1)[0]
+
+
+class NearCache:
+    """
+    LRU giới hạn số phần tử, mỗi phần tử sống tối đa `ttl` giây.
+
+    Giá trị trả ra là bản sao nông (dict/list) để caller sửa không làm bẩn cache.
+    `generation` tăng mỗi lần invalidate: giá trị đọc từ Redis trước một lần invalidate
+    sẽ không được ghi vào near cache (tránh giữ lại bản cũ).
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 5.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self._stats: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"near_hits": 0, "redis_hits": 0, "misses": 0}
+        )
+
+    def get(self, key: str) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISS
+            expires_at, value = entry
+            if expires_at < now:
+                del self._data[key]
+                return MISS
+            self._data.move_to_end(key)
+        return copy.copy(value) if isinstance(value, (dict, list)) else value
+
+    def set(self, key: str, value: Any, generation: int = None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys: str):
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    # ---------- Thống kê ----------
+    def record(self, key: str, outcome: str):
+        """outcome: near_hits | redis_hits | misses"""
+        self._stats[key_prefix(key)][outcome] += 1
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for prefix, counts in list(self._stats.items()):
+            total = sum(counts.values())
+            result[prefix] = {
+                **counts,
+                "near_hit_ratio": round(counts["near_hits"] / total, 4) if total else 0.0,
+            }
+        return result
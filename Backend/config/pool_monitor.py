@@ -0,0 +1,100 @@
+"""
+Pool Monitor - Đo thời gian giữ connection của pool SQLAlchemy và phát hiện connection bị rò rỉ
+"""
+import os
+import threading
+import time
+import traceback
+from typing import Any, Dict, List
+
+from sqlalchemy import event
+
+POOL_LEAK_SECONDS = float(os.getenv("POOL_LEAK_SECONDS", 30))
+# Lưu stack lúc checkout để biết ai giữ connection (tốn chi phí, chỉ bật khi điều tra)
+POOL_TRACE_CHECKOUT = os.getenv("POOL_TRACE_CHECKOUT", "false").lower() == "true"
+
+
+class PoolMonitor:
+    """
+    Gắn vào engine qua pool events:
+    - `checkout` / `checkin`: thời gian mỗi connection bị giữ (count, tổng, max).
+    - `acquire_wait`: thời gian chờ lấy connection, do caller ghi qua `record_wait()`.
+    - `find_leaks()`: connection đang bị giữ quá `leak_seconds`.
+    """
+
+    def __init__(self, engine, name: str, leak_seconds: float = POOL_LEAK_SECONDS):
+        self.engine = engine
+        self.name = name
+        self.leak_seconds = leak_seconds
+        self._lock = threading.Lock()
+        self._active: Dict[int, Dict[str, Any]] = {}
+        self._held = {"count": 0, "total": 0.0, "max": 0.0}
+        self._wait = {"count": 0, "total": 0.0, "max": 0.0}
+        self._leaks_reported = 0
+
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+
+    def _on_checkout(self, dbapi_conn, record, proxy):
+        entry = {
+            "since": time.monotonic(),
+            "thread": threading.current_thread().name,
+            "stack": "".join(traceback.format_stack(limit=12)) if POOL_TRACE_CHECKOUT else None,
+        }
+        with self._lock:
+            self._active[id(record)] = entry
+
+    def _on_checkin(self, dbapi_conn, record):
+        with self._lock:
+            entry = self._active.pop(id(record), None)
+            if entry:
+                _observe(self._held, time.monotonic() - entry["since"])
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            _observe(self._wait, seconds)
+
+    def find_leaks(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {"held_seconds": round(now - entry["since"], 3), "thread": entry["thread"], "stack": entry["stack"]}
+                for entry in self._active.values()
+                if now - entry["since"] > self.leak_seconds
+            ]
+
+    def report_leaks(self) -> int:
+        leaks = self.find_leaks()
+        for leak in leaks:
+            print(f"⚠️ [{self.name}] Connection bị giữ {leak['held_seconds']}s (thread {leak['thread']})")
+            if leak["stack"]:
+                print(leak["stack"])
+        self._leaks_reported += len(leaks)
+        return len(leaks)
+
+    def stats(self) -> Dict[str, Any]:
+        pool = self.engine.pool
+        with self._lock:
+            return {
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+                "held": _summary(self._held),
+                "acquire_wait": _summary(self._wait),
+                "leaks_reported": self._leaks_reported,
+            }
+
+
+def _observe(bucket: dict, seconds: float):
+    bucket["count"] += 1
+    bucket["total"] += seconds
+    bucket["max"] = max(bucket["max"], seconds)
+
+
+def _summary(bucket: dict) -> dict:
+    count = bucket["count"]
+    return {
+        "count": count,
+        "avg_ms": round(bucket["total"] / count * 1000, 2) if count else 0.0,
+        "max_ms": round(bucket["max"] * 1000, 2),
+    }
@@ -1,16 +1,93 @@
 import redis
 import json
+import copy
+import functools
+import hashlib
+import inspect
+import math
+import random
+import time
+import uuid
 import asyncio
+import sys
+import threading
+from concurrent.futures import Future
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
 from redis import asyncio as aioredis
-from typing import Any, Optional
+from typing import Any, Awaitable, Callable, Optional
 from dotenv import load_dotenv
 import os
 import logging
 
+from config.cache_codec import codec, to_text
+from config.near_cache import MISS, NearCache
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Near cache: chỉ áp dụng cho các prefix nóng trên đường xử lý tin nhắn
+NEAR_CACHE_SIZE = int(os.getenv("NEAR_CACHE_SIZE", 10000))
+NEAR_CACHE_TTL = float(os.getenv("NEAR_CACHE_TTL", 5))
+NEAR_CACHE_PREFIXES = set(
+    p.strip() for p in os.getenv(
+        "NEAR_CACHE_PREFIXES", "session,check_repply,session_by_name,field_configs"
+    ).split(",") if p.strip()
+)
+INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "cache:invalidate")
+
+# Pool kết nối cho client async (dùng chung cho mọi request trên event loop)
+REDIS_POOL_SIZE = int(os.getenv("REDIS_POOL_SIZE", 50))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 2))
+# Dùng client sync bên trong event loop: "warn" (mặc định) | "raise" | "ignore"
+REDIS_SYNC_ON_LOOP = os.getenv("REDIS_SYNC_ON_LOOP", "warn").lower()
+
+# Chống stampede khi key hết hạn (get_or_set)
+FILL_LOCK_TTL_MS = int(os.getenv("CACHE_FILL_LOCK_TTL_MS", 10000))
+FILL_WAIT_SECONDS = float(os.getenv("CACHE_FILL_WAIT_SECONDS", 5))
+FILL_POLL_SECONDS = 0.05
+# XFetch: beta > 1 làm mới sớm hơn, 0 = tắt làm mới sớm
+EARLY_REFRESH_BETA = float(os.getenv("CACHE_EARLY_REFRESH_BETA", 1.0))
+
+# Tag set (tag:{tag} -> các key) sống ít nhất bao lâu
+TAG_SET_TTL = int(os.getenv("CACHE_TAG_SET_TTL", 86400))
+
+# Xóa mọi key thuộc các tag + chính tag set, trả về danh sách key đã xóa
+_INVALIDATE_TAGS_SCRIPT = """
+local deleted = {}
+for _, tag in ipairs(KEYS) do
+    local members = redis.call('SMEMBERS', tag)
+    for i = 1, #members, 500 do
+        redis.call('DEL', unpack(members, i, math.min(i + 499, #members)))
+    end
+    for _, member in ipairs(members) do
+        deleted[#deleted + 1] = member
+    end
+    redis.call('DEL', tag)
+end
+return deleted
+"""
+
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _hash_text(data: dict) -> Optional[dict]:
+    """Field của hash lưu dạng text thường (không qua codec)"""
+    if not data:
+        return None
+    return {to_text(k): to_text(v) for k, v in data.items()}
+
+
+class SyncRedisOnEventLoop(RuntimeError):
+    """Client Redis sync bị gọi trong coroutine (chặn event loop)"""
+
 
 class RedisCache:
     def __init__(self):
@@ -28,8 +105,27 @@ class RedisCache:
         # Default TTL (Time To Live) - 1 hour
         self.default_ttl = int(os.getenv("REDIS_DEFAULT_TTL", 3600))
 
+        # Lua script đã đăng ký (theo nội dung script)
+        self._scripts = {}
+        self._async_scripts = {}
+        self._async_pool = None
+        self._sync_on_loop_sites = set()
+
+        # Request đang nạp cache trong process này (key -> Future)
+        self._flights = {}
+        self._async_flights = {}
+        self._flight_lock = threading.Lock()
+
+        # Near cache + kênh pub/sub để các worker invalidate lẫn nhau
+        self.near = NearCache(max_entries=NEAR_CACHE_SIZE, ttl=NEAR_CACHE_TTL)
+        self.instance_id = uuid.uuid4().hex
+        self._listening = False
+        self._listener: Optional[threading.Thread] = None
+        self._listener_lock = threading.Lock()
+
     # ================== SYNC CLIENT ==================
     def get_sync_client(self) -> redis.Redis:
+        self._check_event_loop()
         if self._sync_client is None:
             try:
                 self._sync_client = redis.Redis(
@@ -37,7 +133,7 @@ class RedisCache:
                     port=self.redis_port,
                     db=self.redis_db,
                     password=self.redis_password,
-                    decode_responses=True,
+                    decode_responses=False,
                     socket_connect_timeout=5,
                     socket_timeout=5,
                     retry_on_timeout=True,
@@ -51,19 +147,42 @@ class RedisCache:
                 self._sync_client = None
         return self._sync_client
 
+    def _check_event_loop(self):
+        """Phát hiện client sync bị gọi trên thread đang chạy event loop"""
+        if REDIS_SYNC_ON_LOOP == "ignore":
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if REDIS_SYNC_ON_LOOP == "raise":
+            raise SyncRedisOnEventLoop("Sync Redis client used inside a running event loop")
+
+        # Chỉ cảnh báo một lần cho mỗi vị trí gọi
+        frame = sys._getframe(2)
+        while frame and frame.f_code.co_filename == __file__:
+            frame = frame.f_back
+        site = f"{frame.f_code.co_filename}:{frame.f_lineno}" if frame else "?"
+        if site not in self._sync_on_loop_sites:
+            self._sync_on_loop_sites.add(site)
+            logger.warning(f"Sync Redis client used inside event loop at {site}")
+
     # ================== ASYNC CLIENT ==================
     async def get_async_client(self) -> aioredis.Redis:
         if self._async_client is None:
             try:
-                self._async_client = aioredis.from_url(
+                self._async_pool = aioredis.BlockingConnectionPool.from_url(
                     self.redis_url,
                     password=self.redis_password,
-                    decode_responses=True,
+                    decode_responses=False,
+                    max_connections=REDIS_POOL_SIZE,
+                    timeout=REDIS_POOL_TIMEOUT,
                     socket_connect_timeout=5,
                     socket_timeout=5,
                     retry_on_timeout=True,
                     health_check_interval=30,
                 )
+                self._async_client = aioredis.Redis(connection_pool=self._async_pool)
                 # Test connection
                 await self._async_client.ping()
                 logger.info("Redis async connection established successfully")
@@ -72,6 +191,121 @@ class RedisCache:
                 self._async_client = None
         return self._async_client
 
+    # ================== NEAR CACHE ==================
+    def _near_enabled(self, key: str) -> bool:
+        """
+        Chỉ dùng near cache khi đang nghe được kênh invalidate,
+        nếu mất kết nối pub/sub thì mọi lần đọc đều đi thẳng tới Redis.
+        """
+        if NEAR_CACHE_SIZE <= 0 or key.split(":", 1)[0] not in NEAR_CACHE_PREFIXES:
+            return False
+        if self._listener is None:
+            self._start_listener()
+        return self._listening
+
+    def _start_listener(self):
+        with self._listener_lock:
+            if self._listener is not None:
+                return
+            self._listener = threading.Thread(target=self._listen, name="cache-invalidation", daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        while True:
+            pubsub = None
+            try:
+                client = self.get_sync_client()
+                if client is None:
+                    raise ConnectionError("Redis unavailable")
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                self._listening = True
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message:
+                        self._on_invalidation(message.get("data"))
+            except Exception as e:
+                if self._listening:
+                    logger.error(f"Cache invalidation listener stopped: {e}")
+                self._listening = False
+                self.near.clear()
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+                time.sleep(1)
+
+    def _on_invalidation(self, data):
+        try:
+            payload = json.loads(data)
+        except (TypeError, ValueError):
+            return
+        if payload.get("origin") == self.instance_id:
+            return
+        keys = payload.get("keys") or []
+        if "*" in keys:
+            self.near.clear()
+        else:
+            self.near.delete(*keys)
+
+    def _invalidation_message(self, keys) -> str:
+        return json.dumps({"origin": self.instance_id, "keys": list(keys)})
+
+    def _invalidate(self, *keys: str):
+        """Xóa key khỏi near cache ở process này và báo cho các worker khác"""
+        keys = [k for k in keys if k == "*" or k.split(":", 1)[0] in NEAR_CACHE_PREFIXES]
+        if not keys:
+            return
+        if "*" in keys:
+            self.near.clear()
+        else:
+            self.near.delete(*keys)
+        try:
+            client = self.get_sync_client()
+            if client is not None:
+                client.publish(INVALIDATION_CHANNEL, self._invalidation_message(keys))
+        except Exception as e:
+            logger.error(f"Error publishing cache invalidation for {keys}: {e}")
+
+    async def _async_invalidate(self, *keys: str):
+        keys = [k for k in keys if k.split(":", 1)[0] in NEAR_CACHE_PREFIXES]
+        if not keys:
+            return
+        self.near.delete(*keys)
+        try:
+            client = await self.get_async_client()
+            if client is not None:
+                await client.publish(INVALIDATION_CHANNEL, self._invalidation_message(keys))
+        except Exception as e:
+            logger.error(f"Error async publishing cache invalidation for {keys}: {e}")
+
+    def _near_get(self, key: str) -> Any:
+        if not self._near_enabled(key):
+            return MISS
+        value = self.near.get(key)
+        if value is not MISS:
+            self.near.record(key, "near_hits")
+        return value
+
+    def _near_store(self, key: str, value: Any, generation: int):
+        self.near.record(key, "redis_hits" if value is not None else "misses")
+        if value is not None and self._near_enabled(key):
+            self.near.set(key, copy.copy(value) if isinstance(value, (dict, list)) else value, generation)
+
+    def get_stats(self) -> dict:
+        """Thống kê near cache + hit/miss theo prefix key"""
+        return {
+            "near_cache": {
+                "entries": len(self.near),
+                "max_entries": self.near.max_entries,
+                "ttl": self.near.ttl,
+                "listening": self._listening,
+            },
+            "prefixes": self.near.stats(),
+            "functions": memoize_stats(),
+        }
+
     # ================== SYNC OPERATIONS ==================
     def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
         try:
@@ -81,28 +315,29 @@ class RedisCache:
 
             ttl = ttl or self.default_ttl
 
-            if not isinstance(value, str):
-                value = json.dumps(value, ensure_ascii=False)
+            value = codec.encode(value)
 
-            return client.setex(key, ttl, value)
+            result = client.setex(key, ttl, value)
+            self._invalidate(key)
+            return result
         except Exception as e:
             logger.error(f"Error setting cache key {key}: {e}")
             return False
 
     def get(self, key: str) -> Optional[Any]:
         try:
+            cached = self._near_get(key)
+            if cached is not MISS:
+                return cached
+
             client = self.get_sync_client()
             if client is None:
                 return None
 
-            value = client.get(key)
-            if value is None:
-                return None
-
-            try:
-                return json.loads(value)
-            except json.JSONDecodeError:
-                return value
+            generation = self.near.generation
+            value = codec.decode(client.get(key))
+            self._near_store(key, value, generation)
+            return value
         except Exception as e:
             logger.error(f"Error getting cache key {key}: {e}")
             return None
@@ -112,7 +347,9 @@ class RedisCache:
             client = self.get_sync_client()
             if client is None:
                 return False
-            return bool(client.delete(key))
+            result = bool(client.delete(key))
+            self._invalidate(key)
+            return result
         except Exception as e:
             logger.error(f"Error deleting cache key {key}: {e}")
             return False
@@ -137,6 +374,109 @@ class RedisCache:
             logger.error(f"Error setting expire for key {key}: {e}")
             return False
 
+    def hgetall(self, key: str) -> Optional[dict]:
+        try:
+            cached = self._near_get(key)
+            if cached is not MISS:
+                return cached
+
+            client = self.get_sync_client()
+            if client is None:
+                return None
+            generation = self.near.generation
+            value = _hash_text(client.hgetall(key))
+            self._near_store(key, value, generation)
+            return value
+        except Exception as e:
+            logger.error(f"Error getting hash key {key}: {e}")
+            return None
+
+    def eval_script(self, script: str, keys: list, args: list, readonly: bool = False) -> Optional[Any]:
+        """Chạy Lua script (EVALSHA, tự nạp lại nếu Redis chưa có script)"""
+        try:
+            client = self.get_sync_client()
+            if client is None:
+                return None
+            if script not in self._scripts:
+                self._scripts[script] = client.register_script(script)
+            result = self._scripts[script](keys=keys, args=args, client=client)
+            if not readonly:
+                self._invalidate(*keys)
+            return result
+        except Exception as e:
+            logger.error(f"Error running script on keys {keys}: {e}")
+            return None
+
+    # ================== BATCH OPERATIONS ==================
+    def mget(self, keys: list) -> list:
+        """Đọc nhiều key trong một round trip (key đã có trong near cache thì không hỏi Redis)"""
+        results = [None] * len(keys)
+        missing = []
+        for i, key in enumerate(keys):
+            cached = self._near_get(key)
+            if cached is MISS:
+                missing.append(i)
+            else:
+                results[i] = cached
+        if not missing:
+            return results
+        try:
+            client = self.get_sync_client()
+            if client is None:
+                return results
+            generation = self.near.generation
+            values = client.mget([keys[i] for i in missing])
+            for i, value in zip(missing, values):
+                value = codec.decode(value)
+                results[i] = value
+                self._near_store(keys[i], value, generation)
+        except Exception as e:
+            logger.error(f"Error getting cache keys {keys}: {e}")
+        return results
+
+    def mset(self, mapping: dict, ttl: Optional[int] = None) -> bool:
+        """Ghi nhiều key (mỗi key có TTL) trong một round trip"""
+        try:
+            client = self.get_sync_client()
+            if client is None or not mapping:
+                return False
+            ttl = ttl or self.default_ttl
+            pipe = client.pipeline(transaction=False)
+            for key, value in mapping.items():
+                value = codec.encode(value)
+                pipe.setex(key, ttl, value)
+            pipe.execute()
+            self._invalidate(*mapping.keys())
+            return True
+        except Exception as e:
+            logger.error(f"Error setting cache keys {list(mapping)}: {e}")
+            return False
+
+    def delete_many(self, *keys: str) -> int:
+        try:
+            client = self.get_sync_client()
+            if client is None or not keys:
+                return 0
+            result = client.delete(*keys)
+            self._invalidate(*keys)
+            return result
+        except Exception as e:
+            logger.error(f"Error deleting cache keys {keys}: {e}")
+            return 0
+
+    def pipeline(self, transaction: bool = False):
+        """
+        Pipeline thô của redis-py, None nếu mất kết nối.
+        Lưu ý: ghi qua pipeline không tự invalidate near cache, gọi `invalidate_keys` sau khi execute.
+        """
+        client = self.get_sync_client()
+        if client is None:
+            return None
+        return client.pipeline(transaction=transaction)
+
+    def invalidate_keys(self, *keys: str):
+        self._invalidate(*keys)
+
     # ================== ASYNC OPERATIONS ==================
     async def async_set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
         try:
@@ -146,28 +486,29 @@ class RedisCache:
 
             ttl = ttl or self.default_ttl
 
-            if not isinstance(value, str):
-                value = json.dumps(value, ensure_ascii=False)
+            value = codec.encode(value)
 
-            return await client.setex(key, ttl, value)
+            result = await client.setex(key, ttl, value)
+            await self._async_invalidate(key)
+            return result
         except Exception as e:
             logger.error(f"Error async setting cache key {key}: {e}")
             return False
 
     async def async_get(self, key: str) -> Optional[Any]:
         try:
+            cached = self._near_get(key)
+            if cached is not MISS:
+                return cached
+
             client = await self.get_async_client()
             if client is None:
                 return None
 
-            value = await client.get(key)
-            if value is None:
-                return None
-
-            try:
-                return json.loads(value)
-            except json.JSONDecodeError:
-                return value
+            generation = self.near.generation
+            value = codec.decode(await client.get(key))
+            self._near_store(key, value, generation)
+            return value
         except Exception as e:
             logger.error(f"Error async getting cache key {key}: {e}")
             return None
@@ -177,11 +518,83 @@ class RedisCache:
             client = await self.get_async_client()
             if client is None:
                 return False
-            return bool(await client.delete(key))
+            result = bool(await client.delete(key))
+            await self._async_invalidate(key)
+            return result
         except Exception as e:
             logger.error(f"Error async deleting cache key {key}: {e}")
             return False
 
+    async def async_hgetall(self, key: str) -> Optional[dict]:
+        try:
+            cached = self._near_get(key)
+            if cached is not MISS:
+                return cached
+
+            client = await self.get_async_client()
+            if client is None:
+                return None
+            generation = self.near.generation
+            value = _hash_text(await client.hgetall(key))
+            self._near_store(key, value, generation)
+            return value
+        except Exception as e:
+            logger.error(f"Error async getting hash key {key}: {e}")
+            return None
+
+    async def async_eval_script(self, script: str, keys: list, args: list,
+                                readonly: bool = False) -> Optional[Any]:
+        try:
+            client = await self.get_async_client()
+            if client is None:
+                return None
+            if script not in self._async_scripts:
+                self._async_scripts[script] = client.register_script(script)
+            result = await self._async_scripts[script](keys=keys, args=args, client=client)
+            if not readonly:
+                await self._async_invalidate(*keys)
+            return result
+        except Exception as e:
+            logger.error(f"Error async running script on keys {keys}: {e}")
+            return None
+
+    async def async_mget(self, keys: list) -> list:
+        results = [None] * len(keys)
+        missing = []
+        for i, key in enumerate(keys):
+            cached = self._near_get(key)
+            if cached is MISS:
+                missing.append(i)
+            else:
+                results[i] = cached
+        if not missing:
+            return results
+        try:
+            client = await self.get_async_client()
+            if client is None:
+                return results
+            generation = self.near.generation
+            values = await client.mget([keys[i] for i in missing])
+            for i, value in zip(missing, values):
+                value = codec.decode(value)
+                results[i] = value
+                self._near_store(keys[i], value, generation)
+        except Exception as e:
+            logger.error(f"Error async getting cache keys {keys}: {e}")
+        return results
+
+    async def async_delete_many(self, *keys: str) -> int:
+        try:
+            client = await self.get_async_client()
+            if client is None or not keys:
+                return 0
+            result = await client.delete(*keys)
+            await self._async_invalidate(*keys)
+            return result
+        except Exception as e:
+            logger.error(f"Error async deleting cache keys {keys}: {e}")
+            return 0
+
     async def async_exists(self, key: str) -> bool:
         try:
             client = await self.get_async_client()
@@ -192,6 +605,248 @@ class RedisCache:
             logger.error(f"Error async checking cache key {key}: {e}")
             return False
 
+    # ================== SINGLE-FLIGHT FILL ==================
+    @staticmethod
+    def _envelope(value: Any, delta: float, ttl: int) -> dict:
+        return {"__xf__": 1, "v": value, "d": round(delta, 4), "e": time.time() + ttl}
+
+    @staticmethod
+    def _unwrap(cached: Any, beta: float):
+        """
+        Trả về (value, fresh). Entry bọc XFetch được coi là hết hạn sớm với xác suất
+        tăng dần khi gần tới hạn, tỉ lệ với thời gian tính lại (delta).
+        """
+        if isinstance(cached, dict) and cached.get("__xf__"):
+            value, delta, expiry = cached.get("v"), cached.get("d") or 0, cached.get("e") or 0
+            if beta > 0 and delta > 0:
+                if time.time() - delta * beta * math.log(1.0 - random.random()) >= expiry:
+                    return value, False
+            return value, True
+        return cached, True
+
+    @staticmethod
+    def _lock_key(key: str) -> str:
+        return f"lock:{key}"
+
+    def _acquire_fill_lock(self, key: str, token: str) -> bool:
+        try:
+            client = self.get_sync_client()
+            if client is None:
+                return True  # không có Redis -> không điều phối được, tự nạp
+            return bool(client.set(self._lock_key(key), token, nx=True, px=FILL_LOCK_TTL_MS))
+        except Exception as e:
+            logger.error(f"Error acquiring fill lock for {key}: {e}")
+            return True
+
+    def _release_fill_lock(self, key: str, token: str):
+        self.eval_script(_RELEASE_LOCK_SCRIPT, keys=[self._lock_key(key)], args=[token], readonly=True)
+
+    def single_flight(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Gộp các lời gọi đồng thời cùng key trong process: chỉ một thread chạy `fn`"""
+        with self._flight_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+        if not leader:
+            return flight.result(timeout=FILL_WAIT_SECONDS + FILL_LOCK_TTL_MS / 1000)
+
+        try:
+            result = fn()
+            flight.set_result(result)
+            return result
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self._flight_lock:
+                self._flights.pop(key, None)
+
+    def get_or_set(self, key: str, loader: Callable[[], Any], ttl: Optional[int] = None,
+                   beta: float = EARLY_REFRESH_BETA, negative_ttl: Optional[int] = None,
+                   tags: Optional[list] = None) -> Any:
+        """
+        Chỉ dùng ngoài event loop: khi chờ process khác nạp, bản này sleep chặn thread.
+        Coroutine dùng `async_get_or_set`.
+
+        Đọc cache, miss (hoặc sắp hết hạn) thì nạp bằng `loader` với single-flight:
+        - trong process: các request đồng thời chờ chung một lần nạp,
+        - giữa các process: lock `lock:{key}` (SET NX PX) có lease, process không giữ lock
+          dùng giá trị cũ nếu còn, hoặc chờ giá trị mới.
+        `loader` trả về None thì chỉ cache khi có `negative_ttl`; `tags` gắn key vào tag set
+        để xóa theo thực thể bằng `invalidate_tags`.
+        """
+        ttl = ttl or self.default_ttl
+        cached = self.get(key)
+        if cached is not None:
+            value, fresh = self._unwrap(cached, beta)
+            if fresh:
+                return value
+            stale = value
+        else:
+            stale = MISS
+        return self.single_flight(key, lambda: self._fill(key, loader, ttl, stale, negative_ttl, tags))
+
+    def _fill(self, key: str, loader: Callable[[], Any], ttl: int, stale: Any,
+              negative_ttl: Optional[int] = None, tags: Optional[list] = None) -> Any:
+        token = uuid.uuid4().hex
+        if not self._acquire_fill_lock(key, token):
+            if stale is not MISS:
+                return stale  # process khác đang làm mới
+            deadline = time.monotonic() + FILL_WAIT_SECONDS
+            while time.monotonic() < deadline:
+                time.sleep(FILL_POLL_SECONDS)
+                cached = self.get(key)
+                if cached is not None:
+                    return self._unwrap(cached, 0)[0]
+            logger.warning(f"Timed out waiting for cache fill of {key}, loading directly")
+            return loader()
+
+        try:
+            if stale is MISS:
+                # Process khác có thể vừa nạp xong trước khi ta lấy được lock
+                cached = self.get(key)
+                if cached is not None:
+                    return self._unwrap(cached, 0)[0]
+            started = time.monotonic()
+            value = loader()
+            store_ttl = ttl if value is not None else negative_ttl
+            if store_ttl:
+                self.set(key, self._envelope(value, time.monotonic() - started, store_ttl), store_ttl)
+                if tags:
+                    self.tag_keys(tags, key, store_ttl)
+            return value
+        finally:
+            self._release_fill_lock(key, token)
+
+    async def async_single_flight(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        flight = self._async_flights.get(key)
+        if flight is not None:
+            return await asyncio.shield(flight)
+
+        flight = self._async_flights[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+            flight.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except BaseException as e:
+            flight.set_exception(e)
+            flight.exception()  # đánh dấu đã đọc, tránh cảnh báo khi không ai chờ
+            raise
+        finally:
+            self._async_flights.pop(key, None)
+
+    async def async_get_or_set(self, key: str, loader: Callable[[], Awaitable[Any]],
+                               ttl: Optional[int] = None, beta: float = EARLY_REFRESH_BETA,
+                               negative_ttl: Optional[int] = None, tags: Optional[list] = None) -> Any:
+        """Bản async của get_or_set, `loader` là coroutine function"""
+        ttl = ttl or self.default_ttl
+        cached = await self.async_get(key)
+        if cached is not None:
+            value, fresh = self._unwrap(cached, beta)
+            if fresh:
+                return value
+            stale = value
+        else:
+            stale = MISS
+        return await self.async_single_flight(
+            key, lambda: self._async_fill(key, loader, ttl, stale, negative_ttl, tags)
+        )
+
+    async def _async_fill(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: int, stale: Any,
+                          negative_ttl: Optional[int] = None, tags: Optional[list] = None) -> Any:
+        token = uuid.uuid4().hex
+        client = await self.get_async_client()
+        acquired = True
+        if client is not None:
+            try:
+                acquired = bool(await client.set(self._lock_key(key), token, nx=True, px=FILL_LOCK_TTL_MS))
+            except Exception as e:
+                logger.error(f"Error acquiring fill lock for {key}: {e}")
+
+        if not acquired:
+            if stale is not MISS:
+                return stale
+            deadline = time.monotonic() + FILL_WAIT_SECONDS
+            while time.monotonic() < deadline:
+                await asyncio.sleep(FILL_POLL_SECONDS)
+                cached = await self.async_get(key)
+                if cached is not None:
+                    return self._unwrap(cached, 0)[0]
+            logger.warning(f"Timed out waiting for cache fill of {key}, loading directly")
+            return await loader()
+
+        try:
+            if stale is MISS:
+                cached = await self.async_get(key)
+                if cached is not None:
+                    return self._unwrap(cached, 0)[0]
+            started = time.monotonic()
+            value = await loader()
+            store_ttl = ttl if value is not None else negative_ttl
+            if store_ttl:
+                await self.async_set(key, self._envelope(value, time.monotonic() - started, store_ttl), store_ttl)
+                if tags:
+                    await self.async_tag_keys(tags, key, store_ttl)
+            return value
+        finally:
+            await self.async_eval_script(_RELEASE_LOCK_SCRIPT, keys=[self._lock_key(key)],
+                                         args=[token], readonly=True)
+
+    # ================== TAG ==================
+    @staticmethod
+    def _tag_key(tag: str) -> str:
+        return f"tag:{tag}"
+
+    def tag_keys(self, tags: list, key: str, ttl: int):
+        """Gắn `key` vào các tag set (tag set sống lâu hơn key)"""
+        try:
+            client = self.get_sync_client()
+            if client is None:
+                return
+            pipe = client.pipeline(transaction=False)
+            for tag in tags:
+                pipe.sadd(self._tag_key(tag), key)
+                pipe.expire(self._tag_key(tag), max(ttl, TAG_SET_TTL))
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error tagging cache key {key} with {tags}: {e}")
+
+    async def async_tag_keys(self, tags: list, key: str, ttl: int):
+        try:
+            client = await self.get_async_client()
+            if client is None:
+                return
+            pipe = client.pipeline(transaction=False)
+            for tag in tags:
+                pipe.sadd(self._tag_key(tag), key)
+                pipe.expire(self._tag_key(tag), max(ttl, TAG_SET_TTL))
+            await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error async tagging cache key {key} with {tags}: {e}")
+
+    def invalidate_tags(self, *tags: str) -> int:
+        """Xóa mọi key gắn với các tag, ví dụ invalidate_tags("session:42")"""
+        if not tags:
+            return 0
+        deleted = [to_text(k) for k in self.eval_script(
+            _INVALIDATE_TAGS_SCRIPT, keys=[self._tag_key(t) for t in tags], args=[], readonly=True
+        ) or []]
+        self._invalidate(*deleted)
+        return len(deleted)
+
+    async def async_invalidate_tags(self, *tags: str) -> int:
+        if not tags:
+            return 0
+        deleted = [to_text(k) for k in await self.async_eval_script(
+            _INVALIDATE_TAGS_SCRIPT, keys=[self._tag_key(t) for t in tags], args=[], readonly=True
+        ) or []]
+        await self._async_invalidate(*deleted)
+        return len(deleted)
+
     # ================== UTILITY ==================
     def flush_all(self) -> bool:
         try:
@@ -199,6 +854,7 @@ class RedisCache:
             if client is None:
                 return False
             client.flushdb()
+            self._invalidate("*")
             return True
         except Exception as e:
             logger.error(f"Error flushing cache: {e}")
@@ -225,6 +881,19 @@ class RedisCache:
         except Exception as e:
             logger.error(f"Error closing Redis connections: {e}")
 
+    async def async_close(self):
+        """Đóng client async + pool (gọi khi app shutdown)"""
+        try:
+            if self._async_client:
+                await self._async_client.close()
+                self._async_client = None
+            if self._async_pool:
+                await self._async_pool.disconnect()
+                self._async_pool = None
+            self._async_scripts.clear()
+        except Exception as e:
+            logger.error(f"Error closing async Redis pool: {e}")
+
 
 # ================== SINGLETON + HELPERS ==================
 redis_cache = RedisCache()
@@ -242,6 +911,18 @@ def cache_delete(key: str) -> bool:
     return redis_cache.delete(key)
 
 
+def cache_get_or_set(key: str, loader: Callable[[], Any], ttl: Optional[int] = None) -> Any:
+    return redis_cache.get_or_set(key, loader, ttl)
+
+
+def cache_mget(keys: list) -> list:
+    return redis_cache.mget(keys)
+
+
+def cache_mset(mapping: dict, ttl: Optional[int] = None) -> bool:
+    return redis_cache.mset(mapping, ttl)
+
+
 def cache_exists(key: str) -> bool:
     return redis_cache.exists(key)
 
@@ -262,42 +943,158 @@ async def async_cache_exists(key: str) -> bool:
     return await redis_cache.async_exists(key)
 
 
+async def async_cache_get_or_set(key: str, loader: Callable[[], Awaitable[Any]], ttl: Optional[int] = None) -> Any:
+    return await redis_cache.async_get_or_set(key, loader, ttl)
+
+
 # ================== DECORATORS ==================
-def cache_result(key_prefix: str, ttl: Optional[int] = None):
-    def decorator(func):
-        def wrapper(*args, **kwargs):
-            cache_key = f"{key_prefix}:{func.__name__}:{hash(str(args) + str(sorted(kwargs.items())))}"
+# Tham số không đưa vào key (instance, session DB, ...)
+DEFAULT_IGNORED_ARGS = ("self", "cls", "db", "db_session", "session")
 
-            cached_result = cache_get(cache_key)
-            if cached_result is not None:
-                return cached_result
+_memo_stats: dict = {}
+_memo_stats_lock = threading.Lock()
 
-            result = func(*args, **kwargs)
-            if result is not None:
-                cache_set(cache_key, result, ttl)
 
-            return result
+def _canonical(value: Any) -> Any:
+    """Chuẩn hóa tham số thành cấu trúc JSON ổn định giữa các process / lần khởi động"""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": hashlib.sha1(value).hexdigest()}
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, Enum):
+        return _canonical(value.value)
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in sorted(value.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted((_canonical(v) for v in value), key=lambda v: json.dumps(v, sort_keys=True))
+    table = getattr(value, "__table__", None)
+    if table is not None:
+        # Model SQLAlchemy: định danh bằng tên bảng + khóa chính
+        return {"__model__": table.name, "pk": [_canonical(getattr(value, c.key, None)) for c in table.primary_key]}
+    if hasattr(value, "model_dump"):
+        return _canonical(value.model_dump())
+    raise TypeError(f"Cannot build a stable cache key from {type(value).__name__}")
 
-        return wrapper
 
-    return decorator
+def _skip_arg(name: str, value: Any, ignore) -> bool:
+    if name in ignore:
+        return True
+    # Session / connection SQLAlchemy không bao giờ là một phần của key
+    return type(value).__module__.startswith("sqlalchemy.")
+
+
+def _bind_arguments(signature: inspect.Signature, args, kwargs, ignore) -> dict:
+    bound = signature.bind_partial(*args, **kwargs)
+    bound.apply_defaults()
+    return {k: v for k, v in bound.arguments.items() if not _skip_arg(k, v, ignore)}
+
+
+def stable_key(prefix: str, func_name: str, arguments: dict) -> str:
+    payload = json.dumps(_canonical(arguments), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return f"{prefix}:{func_name}:{hashlib.sha1(payload.encode('utf-8')).hexdigest()}"
+
+
+def _record_memo(name: str, hit: bool):
+    with _memo_stats_lock:
+        stats = _memo_stats.setdefault(name, {"hits": 0, "misses": 0})
+        stats["hits" if hit else "misses"] += 1
 
 
-def async_cache_result(key_prefix: str, ttl: Optional[int] = None):
+def memoize_stats() -> dict:
+    """Hit ratio theo từng hàm được decorate"""
+    with _memo_stats_lock:
+        return {
+            name: {**stats, "hit_ratio": round(stats["hits"] / max(stats["hits"] + stats["misses"], 1), 4)}
+            for name, stats in _memo_stats.items()
+        }
+
+
+def _memoize(key_prefix: str, ttl: Optional[int], tags, negative_ttl: Optional[int], ignore, is_async: bool):
     def decorator(func):
-        async def wrapper(*args, **kwargs):
-            cache_key = f"{key_prefix}:{func.__name__}:{hash(str(args) + str(sorted(kwargs.items())))}"
+        signature = inspect.signature(func)
+        name = f"{func.__module__}.{func.__qualname__}"
 
-            cached_result = await async_cache_get(cache_key)
-            if cached_result is not None:
-                return cached_result
+        def build(args, kwargs):
+            arguments = _bind_arguments(signature, args, kwargs, ignore)
+            key = stable_key(key_prefix, func.__qualname__, arguments)
+            if tags is None:
+                entity_tags = None
+            elif callable(tags):
+                entity_tags = list(tags(**arguments))
+            else:
+                entity_tags = [t.format(**arguments) for t in tags]
+            return key, entity_tags
 
-            result = await func(*args, **kwargs)
-            if result is not None:
-                await async_cache_set(cache_key, result, ttl)
+        if is_async:
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                key, entity_tags = build(args, kwargs)
+                called = []
 
-            return result
+                async def loader():
+                    called.append(True)
+                    return await func(*args, **kwargs)
+
+                result = await redis_cache.async_get_or_set(
+                    key, loader, ttl, negative_ttl=negative_ttl, tags=entity_tags
+                )
+                _record_memo(name, not called)
+                return result
+
+            async def invalidate(*args, **kwargs):
+                await redis_cache.async_delete(build(args, kwargs)[0])
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                key, entity_tags = build(args, kwargs)
+                called = []
 
+                def loader():
+                    called.append(True)
+                    return func(*args, **kwargs)
+
+                result = redis_cache.get_or_set(key, loader, ttl, negative_ttl=negative_ttl, tags=entity_tags)
+                _record_memo(name, not called)
+                return result
+
+            def invalidate(*args, **kwargs):
+                redis_cache.delete(build(args, kwargs)[0])
+
+        wrapper.cache_key = lambda *args, **kwargs: build(args, kwargs)[0]
+        wrapper.invalidate = invalidate
         return wrapper
 
     return decorator
+
+
+def cache_result(key_prefix: str, ttl: Optional[int] = None, tags=None,
+                 negative_ttl: Optional[int] = None, ignore=DEFAULT_IGNORED_ARGS):
+    """
+    Memoize kết quả hàm vào Redis.
+
+    - Key = prefix + tên hàm + sha1 của tham số đã chuẩn hóa (ổn định giữa các worker).
+    - `tags`: list format string theo tên tham số (vd. ["session:{session_id}"]) hoặc hàm
+      nhận các tham số và trả về list tag; xóa bằng `invalidate_tags("session:42")`.
+    - `negative_ttl`: cache cả kết quả None trong bấy nhiêu giây.
+    - `func.invalidate(*args)` xóa một entry, `memoize_stats()` cho hit ratio từng hàm.
+    """
+    return _memoize(key_prefix, ttl, tags, negative_ttl, ignore, is_async=False)
+
+
+def async_cache_result(key_prefix: str, ttl: Optional[int] = None, tags=None,
+                       negative_ttl: Optional[int] = None, ignore=DEFAULT_IGNORED_ARGS):
+    return _memoize(key_prefix, ttl, tags, negative_ttl, ignore, is_async=True)
+
+
+def invalidate_tags(*tags: str) -> int:
+    return redis_cache.invalidate_tags(*tags)
+
+
+async def async_invalidate_tags(*tags: str) -> int:
+    return await redis_cache.async_invalidate_tags(*tags)
@@ -0,0 +1,396 @@
+"""
+Session Cache - Trạng thái chat session trên Redis hash, ghi xuyên (write-through) mỗi khi thay đổi
+"""
+import os
+from dataclasses import dataclass, fields
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from config.cache_codec import to_text
+from config.redis_cache import redis_cache
+
+SESSION_CACHE_TTL = int(os.getenv("SESSION_CACHE_TTL", 300))
+# Số lần query lại khi bị ghi xuyên chen ngang lúc nạp cache
+FILL_ATTEMPTS = 3
+
+_GET_SCRIPT = "return redis.call('GET', KEYS[1])"
+
+# Xóa cache sau khi DB đổi: cũng tăng session_gen để lần nạp đang dở không ghi lại bản cũ
+_INVALIDATE_SCRIPT = """
+redis.call('DEL', KEYS[1], KEYS[2])
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], ARGV[1])
+return 1
+"""
+
+# Ghi đè toàn bộ hash (xóa cả key kiểu string cũ), tăng version, cập nhật index theo tên.
+# KEYS[4] (session_gen:{id}) tăng ở mọi lần ghi xuyên để lần nạp từ DB đang dở biết mình đã cũ.
+_PUT_SCRIPT = """
+local version = 0
+if redis.call('TYPE', KEYS[1]).ok == 'hash' then
+    version = tonumber(redis.call('HGET', KEYS[1], 'version') or '0')
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+redis.call('HSET', KEYS[1], 'version', version + 1)
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('DEL', KEYS[2])
+redis.call('SET', KEYS[3], ARGV[2], 'EX', ARGV[1])
+redis.call('INCR', KEYS[4])
+redis.call('EXPIRE', KEYS[4], ARGV[1])
+return version + 1
+"""
+
+# Ghi kết quả nạp từ DB khi cache miss, chỉ khi không có lần ghi xuyên nào xen vào:
+# session_gen khác giá trị đọc trước khi query (ARGV[1]) -> -1 (bỏ qua, dữ liệu vừa đọc đã cũ);
+# hash đã có (ghi xuyên vừa đặt) -> giữ nguyên, trả version hiện tại.
+_FILL_SCRIPT = """
+local gen = redis.call('GET', KEYS[4]) or ''
+if gen ~= ARGV[1] then
+    return -1
+end
+if redis.call('TYPE', KEYS[1]).ok == 'hash' then
+    return tonumber(redis.call('HGET', KEYS[1], 'version') or '0')
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], unpack(ARGV, 4))
+redis.call('HSET', KEYS[1], 'version', 1)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('DEL', KEYS[2])
+redis.call('SET', KEYS[3], ARGV[3], 'EX', ARGV[2])
+return 1
+"""
+
+# Cập nhật một vài field nếu hash đang tồn tại, tăng version (session_gen luôn tăng)
+_UPDATE_SCRIPT = """
+redis.call('DEL', KEYS[2])
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], ARGV[1])
+if redis.call('TYPE', KEYS[1]).ok ~= 'hash' then
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+local version = redis.call('HINCRBY', KEYS[1], 'version', 1)
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return version
+"""
+
+# Một round trip: id -> hash session. KEYS[1] = session:{id}, ARGV[1] = id
+# (tra theo tên thì đọc session_by_name:{name} trước, script chỉ chạm key đã khai báo trong KEYS)
+_LOOKUP_SCRIPT = """
+local hash = {}
+if redis.call('TYPE', KEYS[1]).ok == 'hash' then
+    hash = redis.call('HGETALL', KEYS[1])
+end
+return {ARGV[1], hash}
+"""
+
+
+def session_key(session_id: int) -> str:
+    return f"session:{session_id}"
+
+
+def reply_key(session_id: int) -> str:
+    return f"check_repply:{session_id}"
+
+
+def session_name_key(name: str) -> str:
+    return f"session_by_name:{name}"
+
+
+def session_gen_key(session_id: int) -> str:
+    return f"session_gen:{session_id}"
+
+
+@dataclass
+class SessionState:
+    """Bản cache của ChatSession dùng trên hot path"""
+    id: int
+    name: str
+    status: str
+    channel: str
+    page_id: Optional[str] = None
+    current_receiver: Optional[str] = None
+    previous_receiver: Optional[str] = None
+    time: Optional[datetime] = None
+    version: int = 0
+
+    @classmethod
+    def from_model(cls, session) -> "SessionState":
+        return cls(
+            id=session.id,
+            name=session.name,
+            status=session.status,
+            channel=session.channel,
+            page_id=session.page_id,
+            current_receiver=session.current_receiver,
+            previous_receiver=session.previous_receiver,
+            time=session.time,
+        )
+
+    @classmethod
+    def from_hash(cls, data: Dict[str, str]) -> "SessionState":
+        return cls(
+            id=int(data["id"]),
+            name=data.get("name") or "",
+            status=data.get("status") or "true",
+            channel=data.get("channel") or "web",
+            page_id=data.get("page_id") or None,
+            current_receiver=data.get("current_receiver") or None,
+            previous_receiver=data.get("previous_receiver") or None,
+            time=datetime.fromisoformat(data["time"]) if data.get("time") else None,
+            version=int(data.get("version") or 0),
+        )
+
+    def to_hash(self) -> Dict[str, str]:
+        return {f.name: _encode(getattr(self, f.name)) for f in fields(self) if f.name != "version"}
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Dạng dict cũ (time ISO string) cho websocket / response"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "channel": self.channel,
+            "page_id": self.page_id,
+            "current_receiver": self.current_receiver,
+            "previous_receiver": self.previous_receiver,
+            "time": self.time.isoformat() if self.time else None,
+        }
+
+
+@dataclass
+class SessionLookup:
+    """Kết quả tra cứu gộp: id, trạng thái session và quyền trả lời (None = session chưa có trong cache)"""
+    session_id: Optional[int]
+    state: Optional[SessionState]
+    can_reply: Optional[bool]
+
+
+def _encode(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _flatten(mapping: Dict[str, str]) -> list:
+    args = []
+    for k, v in mapping.items():
+        args.extend([k, v])
+    return args
+
+
+class SessionCache:
+    """
+    Accessor duy nhất cho trạng thái session trên Redis.
+
+    - Lưu dạng hash `session:{id}` -> cập nhật được từng field, không serialize cả dict.
+    - Mọi thay đổi đều ghi xuyên và tăng `version`; quyết định trả lời chỉ dựa vào `status`
+      (key `check_repply:{id}` cũ bị xóa cùng lúc).
+    - Nạp từ DB khi miss chỉ ghi vào cache nếu không có lần ghi xuyên / invalidate nào xen giữa
+      (so `session_gen:{id}` trước và sau khi query), tránh hồi sinh trạng thái cũ.
+    """
+
+    def __init__(self, ttl: int = SESSION_CACHE_TTL):
+        self.ttl = ttl
+
+    # ---------- Tham số script (dùng chung cho bản sync / async) ----------
+    @staticmethod
+    def _state_keys(state: SessionState) -> list:
+        return [session_key(state.id), reply_key(state.id), session_name_key(state.name), session_gen_key(state.id)]
+
+    def _put_call(self, state: SessionState) -> dict:
+        return {
+            "keys": self._state_keys(state),
+            "args": [self.ttl, state.id, *_flatten(state.to_hash())],
+        }
+
+    def _fill_call(self, state: SessionState, generation) -> dict:
+        return {
+            "keys": self._state_keys(state),
+            "args": [to_text(generation) or "", self.ttl, state.id, *_flatten(state.to_hash())],
+        }
+
+    def _update_call(self, session_id: int, changes: Dict[str, Any]) -> dict:
+        mapping = {k: _encode(v) for k, v in changes.items()}
+        return {
+            "keys": [session_key(session_id), reply_key(session_id), session_gen_key(session_id)],
+            "args": [self.ttl, *_flatten(mapping)],
+        }
+
+    @staticmethod
+    def _lookup_call(session_id: int) -> dict:
+        return {"keys": [session_key(session_id)], "args": [session_id], "readonly": True}
+
+    @staticmethod
+    def _name_call(name: str) -> dict:
+        return {"keys": [session_name_key(name)], "args": [], "readonly": True}
+
+    @staticmethod
+    def _parse_lookup(session_id: Optional[int], result) -> SessionLookup:
+        if not result or not result[0]:
+            return SessionLookup(session_id, None, None)
+
+        found_id, flat = result[0], result[1]
+        flat = [to_text(v) for v in flat]
+        data = dict(zip(flat[::2], flat[1::2]))
+        state = SessionState.from_hash(data) if data.get("id") else None
+        can_reply = state.status == "true" if state else None
+        return SessionLookup(int(to_text(found_id)), state, can_reply)
+
+    @staticmethod
+    def _query(session_id: int, db, refresh: bool = False):
+        from models.chat import ChatSession
+        query = db.query(ChatSession).filter(ChatSession.id == session_id)
+        # Query lại sau khi bị chen ngang: lấy giá trị mới từ DB thay vì object đã có trong session
+        return (query.populate_existing() if refresh else query).first()
+
+    @staticmethod
+    async def _async_query(session_id: int, db=None, refresh: bool = False):
+        """Query bằng AsyncSession; không truyền `db` thì mở session ngắn hạn từ pool async"""
+        from sqlalchemy import select
+        from config.database import AsyncSessionLocal
+        from models.chat import ChatSession
+        stmt = select(ChatSession).where(ChatSession.id == session_id)
+        if refresh:
+            stmt = stmt.execution_options(populate_existing=True)
+        if db is not None:
+            return (await db.execute(stmt)).scalars().first()
+        async with AsyncSessionLocal() as own_db:
+            return (await own_db.execute(stmt)).scalars().first()
+
+    @staticmethod
+    def _state(session) -> SessionState:
+        return session if isinstance(session, SessionState) else SessionState.from_model(session)
+
+    # ---------- Sync (script, service sync) ----------
+    def get(self, session_id: int, db=None) -> Optional[SessionState]:
+        """Đọc từ cache; nếu miss và có `db` thì nạp từ database rồi cache lại"""
+        data = redis_cache.hgetall(session_key(session_id))
+        if data and data.get("id"):
+            return SessionState.from_hash(data)
+        if db is None:
+            return None
+        return self.load(session_id, db)
+
+    def load(self, session_id: int, db) -> Optional[SessionState]:
+        """
+        Nạp từ database và ghi vào cache (request đồng thời cùng session chỉ query một lần).
+        Có lần ghi xuyên xen giữa lúc query và lúc ghi cache thì query lại, không ghi đè bằng bản cũ.
+        """
+        def fill():
+            for attempt in range(FILL_ATTEMPTS):
+                generation = redis_cache.eval_script(_GET_SCRIPT, keys=[session_gen_key(session_id)], args=[],
+                                                     readonly=True)
+                session = self._query(session_id, db, refresh=attempt > 0)
+                if not session:
+                    return None
+                state = self._state(session)
+                version = redis_cache.eval_script(_FILL_SCRIPT, **self._fill_call(state, generation))
+                if version is None or int(version) >= 0:
+                    state.version = int(version or 0)
+                    return state
+            return state
+        return redis_cache.single_flight(f"load:{session_key(session_id)}", fill)
+
+    def put(self, session) -> SessionState:
+        """Ghi toàn bộ trạng thái từ ChatSession (hoặc SessionState) vào cache"""
+        state = self._state(session)
+        version = redis_cache.eval_script(_PUT_SCRIPT, **self._put_call(state))
+        state.version = int(version or 0)
+        return state
+
+    def update(self, session_id: int, **changes) -> int:
+        """Cập nhật một số field (sau khi DB đã commit). Trả về version mới, 0 nếu chưa có cache"""
+        if not changes:
+            return 0
+        version = redis_cache.eval_script(_UPDATE_SCRIPT, **self._update_call(session_id, changes))
+        return int(version or 0)
+
+    def _invalidate_call(self, session_id: int) -> dict:
+        return {
+            "keys": [session_key(session_id), reply_key(session_id), session_gen_key(session_id)],
+            "args": [self.ttl],
+        }
+
+    def invalidate(self, session_id: int):
+        redis_cache.eval_script(_INVALIDATE_SCRIPT, **self._invalidate_call(session_id))
+
+    def invalidate_many(self, session_ids, names=()):
+        """Xóa cache của nhiều session bằng một lệnh DEL (kèm key tra theo tên nếu biết)"""
+        keys = [key for sid in session_ids for key in (session_key(sid), reply_key(sid))]
+        keys += [session_name_key(name) for name in names if name]
+        if keys:
+            redis_cache.delete_many(*keys)
+
+    def lookup(self, session_id: Optional[int] = None, name: Optional[str] = None) -> SessionLookup:
+        """Lấy session + quyền trả lời trong một round trip (tra theo tên: thêm một round trip lấy id)"""
+        if session_id is None:
+            found = redis_cache.eval_script(_GET_SCRIPT, **self._name_call(name))
+            if not found:
+                return SessionLookup(None, None, None)
+            session_id = int(to_text(found))
+        result = redis_cache.eval_script(_LOOKUP_SCRIPT, **self._lookup_call(session_id))
+        return self._parse_lookup(session_id, result)
+
+    # ---------- Async (request handler trên event loop) ----------
+    async def async_get(self, session_id: int, load: bool = False, db=None) -> Optional[SessionState]:
+        data = await redis_cache.async_hgetall(session_key(session_id))
+        if data and data.get("id"):
+            return SessionState.from_hash(data)
+        if not load:
+            return None
+        return await self.async_load(session_id, db)
+
+    async def async_load(self, session_id: int, db=None) -> Optional[SessionState]:
+        """`db` (nếu có) là AsyncSession; ghi cache có điều kiện như `load`"""
+        async def fill():
+            for attempt in range(FILL_ATTEMPTS):
+                generation = await redis_cache.async_eval_script(
+                    _GET_SCRIPT, keys=[session_gen_key(session_id)], args=[], readonly=True
+                )
+                session = await self._async_query(session_id, db, refresh=attempt > 0)
+                if not session:
+                    return None
+                state = self._state(session)
+                version = await redis_cache.async_eval_script(_FILL_SCRIPT, **self._fill_call(state, generation))
+                if version is None or int(version) >= 0:
+                    state.version = int(version or 0)
+                    return state
+            return state
+        return await redis_cache.async_single_flight(f"load:{session_key(session_id)}", fill)
+
+    async def async_put(self, session) -> SessionState:
+        state = self._state(session)
+        version = await redis_cache.async_eval_script(_PUT_SCRIPT, **self._put_call(state))
+        state.version = int(version or 0)
+        return state
+
+    async def async_update(self, session_id: int, **changes) -> int:
+        if not changes:
+            return 0
+        version = await redis_cache.async_eval_script(_UPDATE_SCRIPT, **self._update_call(session_id, changes))
+        return int(version or 0)
+
+    async def async_invalidate(self, session_id: int):
+        await redis_cache.async_eval_script(_INVALIDATE_SCRIPT, **self._invalidate_call(session_id))
+
+    async def async_lookup(self, session_id: Optional[int] = None, name: Optional[str] = None) -> SessionLookup:
+        if session_id is None:
+            found = await redis_cache.async_eval_script(_GET_SCRIPT, **self._name_call(name))
+            if not found:
+                return SessionLookup(None, None, None)
+            session_id = int(to_text(found))
+        result = await redis_cache.async_eval_script(_LOOKUP_SCRIPT, **self._lookup_call(session_id))
+        return self._parse_lookup(session_id, result)
+
+    # ---------- Tra cứu theo tên (F-xxx, T-xxx, Z-xxx) ----------
+    def get_id_by_name(self, name: str) -> Optional[int]:
+        value = redis_cache.get(session_name_key(name))
+        return int(value) if value else None
+
+
+session_cache = SessionCache()
@@ -1,25 +1,27 @@
 import gspread
 from google.oauth2.service_account import Credentials
-from config.get_embedding import get_embedding_gemini
 from models.knowledge_base import DocumentChunk
 from config.database import SessionLocal
+from config.ingestion_pipeline import IngestionPipeline, sheet_source
+from config.table_file import table_file_sources
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
-import json
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 def insert_chunks(chunks_data: list):
     session: Session = SessionLocal()
     try:
-       
-        # Chèn từng record một
-        for d in chunks_data:
-            chunk = DocumentChunk(
-                chunk_text=str(d['chunk_text']),
-                search_vector=d.get('search_vector'),
-                knowledge_base_id=d['knowledge_base_id']
-            )
-            session.add(chunk)
-            session.commit()  # commit ngay sau mỗi record
+        if not chunks_data:
+            return
+        # Chèn cả batch trong một câu INSERT nhiều hàng
+        session.execute(insert(DocumentChunk), [
+            {
+                "chunk_text": str(d['chunk_text']),
+                "search_vector": d.get('search_vector'),
+                "knowledge_base_id": d['knowledge_base_id']
+            }
+            for d in chunks_data
+        ])
+        session.commit()
     except Exception as e:
         print(e)
         session.rollback()
@@ -32,72 +34,46 @@ def insert_chunks(chunks_data: list):
    
 
 
-def get_sheet(sheet_id: str, id: int):
-    scopes = [
-        'https://www.googleapis.com/auth/spreadsheets'
-    ]
-    session: Session = SessionLocal()
-    # Xóa tất cả dữ liệu cũ
-    session.query(DocumentChunk).delete()
-    session.commit()  # commit để xác nhận bảng trống
-    creds = Credentials.from_service_account_file('/app/config_sheet.json', scopes=scopes)
-    client = gspread.authorize(creds)
-
+def get_sheet(sheet_id: str, id: int, job=None, client=None):
+    """
+    Đọc toàn bộ Google Sheet, chia chunk, tạo embedding và lưu vào document_chunks.
+    Các worksheet được fetch song song và chảy qua IngestionPipeline (chunk -> embed -> ghi).
+    `job` (helper.job_queue.Job, tùy chọn) nhận tiến độ: rows / embeddings và cờ hủy.
+    `client` cho phép truyền gspread client giả lập khi chạy thử cục bộ.
+    """
+    if client is None:
+        scopes = [
+            'https://www.googleapis.com/auth/spreadsheets'
+        ]
+        creds = Credentials.from_service_account_file('/app/config_sheet.json', scopes=scopes)
+        client = gspread.authorize(creds)
 
     workbook = client.open_by_key(sheet_id)
     worksheets = workbook.worksheets()
 
-
-    all_chunks = []
-
-
-    for sheet in worksheets:
-        records = sheet.get_all_records()
-
-        if sheet.title == "Bảng Size":
-            # Gộp tất cả các hàng lại thành 1 chuỗi JSON lớn
-            merged_data = []
-            for row in records:
-                merged_data.append(
-                    "{ " + ",".join(
-                        [f"\"{k}\":\"{v}\"" for k, v in row.items() if v not in ("", None)]
-                    ) + " }"
-                )
-            merged_text = "[" + ",".join(merged_data) + "]"
-
-            # Chia nhỏ nếu quá dài
-            splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1500,
-                chunk_overlap=0
-            )
-            row_chunks = splitter.split_text(merged_text)
-            all_chunks.extend(row_chunks)
-
-        else:
-            # Xử lý từng hàng riêng biệt (logic cũ)
-            for row in records:
-                row_str = "{ " + ",".join(
-                    [f"\"{k}\":\"{v}\"" for k, v in row.items() if v not in ("", None)]
-                ) + " }"
-
-                splitter = RecursiveCharacterTextSplitter(
-                    chunk_size=1500,
-                    chunk_overlap=0
-                )
-                row_chunks = splitter.split_text(row_str)
-                all_chunks.extend(row_chunks)
-
-
-
-    # Tạo vector và lưu
-    for chunk in all_chunks:
-        vector = get_embedding_gemini(chunk)
-        insert_chunks([{
-            "chunk_text": chunk,
-            "search_vector": vector.tolist(),
-            "knowledge_base_id": id
-        }])
-   
-       
-       
-   
\ No newline at end of file
+    pipeline = IngestionPipeline(id, job=job)
+    stats = pipeline.run([sheet_source(sheet) for sheet in worksheets])
+
+    return {
+        "success": True,
+        "message": f"Đã xử lý {stats['sources']} sheet, tạo {stats['chunks']} chunk",
+        "chunks_created": stats["chunks"],
+        "sheets_processed": stats["sources"]
+    }
+
+
+def get_table_file(path: str, filename: str, id: int, job=None):
+    """
+    Ingest file CSV/XLSX đã lưu trên đĩa qua cùng pipeline chunk -> embed -> ghi như get_sheet.
+    Các hàng được đọc dạng stream nên bộ nhớ không tăng theo kích thước file.
+    """
+    pipeline = IngestionPipeline(id, job=job)
+    stats = pipeline.run(table_file_sources(path, filename))
+
+    return {
+        "success": True,
+        "message": f"Đã xử lý {stats['sources']} bảng, {stats['rows']} hàng, tạo {stats['chunks']} chunk",
+        "chunks_created": stats["chunks"],
+        "rows_processed": stats["rows"],
+        "sheets_processed": stats["sources"]
+    }
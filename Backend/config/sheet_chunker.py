@@ -0,0 +1,115 @@
+"""
+Sheet Chunker - Chia dữ liệu dạng bảng thành chunk theo hàng, có kèm header cột
+"""
+import math
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+CHUNK_TOKEN_BUDGET = int(os.getenv("CHUNK_TOKEN_BUDGET", 400))
+
+# Sheet được chunk theo nhóm (sản phẩm / danh mục) thay vì gộp hàng liên tiếp
+GROUPED_SHEETS = {"Bảng Size"}
+GROUP_COLUMN_CANDIDATES = [
+    "Tên sản phẩm",
+    "Sản phẩm",
+    "Mã sản phẩm",
+    "Danh mục",
+    "Loại sản phẩm",
+    "Loại",
+]
+
+
+CHARS_PER_TOKEN = 3  # ước lượng cho tiếng Việt có dấu
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token của một đoạn text"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _cell(value: Any) -> str:
+    if value is None:
+        return ""
+    return str(value).replace("\n", " ").replace("|", "/").strip()
+
+
+class TableChunker:
+    """
+    Gom các hàng của một bảng thành chunk dưới ngân sách token.
+
+    - Mỗi chunk bắt đầu bằng tên sheet + dòng header cột.
+    - Không bao giờ cắt giữa một hàng; hàng quá dài đứng riêng một chunk.
+    - Sheet trong GROUPED_SHEETS được chia theo cột sản phẩm/danh mục,
+      các hàng liên tiếp cùng nhóm (ô trống = nhóm trước, như ô merge) đi chung chunk.
+    """
+
+    def __init__(self, token_budget: int = CHUNK_TOKEN_BUDGET):
+        self.token_budget = token_budget
+
+    def chunk_rows(self, title: str, headers: List[str], rows: Iterable[Dict[str, Any]],
+                   group_by: Optional[str] = None) -> Iterator[str]:
+        """Sinh chunk từ iterator các hàng (dict theo header), không giữ cả bảng trong bộ nhớ"""
+        headers = [h for h in headers if str(h).strip()]
+        if not headers:
+            return
+        if group_by is None and title in GROUPED_SHEETS:
+            group_by = self._find_group_column(headers)
+
+        buffer: List[str] = []
+        buffer_chars = 0
+        buffer_group: Optional[str] = None
+        current_group: Optional[str] = None
+
+        for row in rows:
+            line = self._format_row(headers, row)
+            if line is None:
+                continue
+
+            if group_by:
+                value = _cell(row.get(group_by))
+                if value:
+                    current_group = value
+                if buffer and current_group != buffer_group:
+                    yield self._render(title, headers, buffer, buffer_group)
+                    buffer, buffer_chars = [], 0
+                buffer_group = current_group
+
+            header_chars = len(self._header(title, headers, buffer_group))
+            projected = math.ceil((header_chars + buffer_chars + len(line) + 1) / CHARS_PER_TOKEN)
+            if buffer and projected > self.token_budget:
+                yield self._render(title, headers, buffer, buffer_group)
+                buffer, buffer_chars = [], 0
+            buffer.append(line)
+            buffer_chars += len(line) + 1
+
+        if buffer:
+            yield self._render(title, headers, buffer, buffer_group)
+
+    def chunk_records(self, title: str, records: List[Dict[str, Any]]) -> List[str]:
+        """Tiện ích cho kết quả `get_all_records()` của gspread"""
+        if not records:
+            return []
+        return list(self.chunk_rows(title, list(records[0].keys()), records))
+
+    @staticmethod
+    def _find_group_column(headers: List[str]) -> str:
+        lowered = {h.strip().lower(): h for h in headers}
+        for candidate in GROUP_COLUMN_CANDIDATES:
+            if candidate.lower() in lowered:
+                return lowered[candidate.lower()]
+        return headers[0]
+
+    @staticmethod
+    def _format_row(headers: List[str], row: Dict[str, Any]) -> Optional[str]:
+        cells = [_cell(row.get(h)) for h in headers]
+        if not any(cells):
+            return None
+        return " | ".join(cells)
+
+    @staticmethod
+    def _header(title: str, headers: List[str], group: Optional[str]) -> str:
+        label = f"{title} - {group}" if group else title
+        return f"[{label}]\n" + " | ".join(_cell(h) for h in headers)
+
+    def _render(self, title: str, headers: List[str], lines: List[str], group: Optional[str]) -> str:
+        return self._header(title, headers, group) + "\n" + "\n".join(lines)
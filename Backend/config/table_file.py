@@ -0,0 +1,85 @@
+"""
+Table File - Đọc file CSV/XLSX theo từng hàng (stream) để đưa vào IngestionPipeline
+"""
+import csv
+import os
+from typing import Any, Dict, Iterator, List
+
+from config.ingestion_pipeline import TableSource
+
+SUPPORTED_EXTENSIONS = {".csv", ".xlsx"}
+
+
+def file_extension(filename: str) -> str:
+    return os.path.splitext(filename or "")[1].lower()
+
+
+def csv_source(path: str, title: str) -> TableSource:
+    """Nguồn dữ liệu từ file CSV, đọc từng hàng, không nạp cả file vào bộ nhớ"""
+    def fetch():
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            headers = list(csv.DictReader(f).fieldnames or [])
+
+        def rows() -> Iterator[Dict[str, Any]]:
+            # Mở file ngay trong generator: pipeline dừng trước khi đọc hàng thì không có file nào bị giữ
+            with open(path, newline="", encoding="utf-8-sig") as f:
+                yield from csv.DictReader(f)
+
+        return title, headers, rows()
+    return fetch
+
+
+def _read_headers(row_iter) -> List[str]:
+    """Hàng không rỗng đầu tiên là header; `row_iter` dừng ngay sau hàng đó"""
+    for values in row_iter:
+        if any(v not in (None, "") for v in values):
+            return ["" if v is None else str(v).strip() for v in values]
+    return []
+
+
+def xlsx_sources(path: str) -> List[TableSource]:
+    """Mỗi worksheet trong file XLSX là một nguồn; đọc ở chế độ read-only (stream)"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError as e:
+        raise RuntimeError("Cần cài openpyxl để đọc file .xlsx") from e
+
+    workbook = load_workbook(path, read_only=True)
+    try:
+        titles = workbook.sheetnames
+    finally:
+        workbook.close()
+
+    def make_source(title: str) -> TableSource:
+        def fetch():
+            # Mỗi nguồn mở workbook riêng để có thể fetch song song an toàn
+            wb = load_workbook(path, read_only=True, data_only=True)
+            try:
+                headers = _read_headers(wb[title].iter_rows(values_only=True))
+            finally:
+                wb.close()
+
+            def rows() -> Iterator[Dict[str, Any]]:
+                # Giống csv_source: workbook chỉ mở khi generator thật sự được đọc
+                wb = load_workbook(path, read_only=True, data_only=True)
+                try:
+                    row_iter = wb[title].iter_rows(values_only=True)
+                    _read_headers(row_iter)
+                    for values in row_iter:
+                        yield dict(zip(headers, values))
+                finally:
+                    wb.close()
+
+            return title, headers, rows()
+        return fetch
+
+    return [make_source(title) for title in titles]
+
+
+def table_file_sources(path: str, filename: str) -> List[TableSource]:
+    ext = file_extension(filename)
+    if ext == ".csv":
+        return [csv_source(path, os.path.splitext(os.path.basename(filename))[0])]
+    if ext == ".xlsx":
+        return xlsx_sources(path)
+    raise ValueError(f"Định dạng file không được hỗ trợ: {ext}")
@@ -2,6 +2,7 @@ from services.chat_service import (
     create_session_service,
     send_message_service,
     get_history_chat_service,
+    count_history_chat_service,
     get_all_history_chat_service,
     send_message_page_service,
     update_chat_session,
@@ -10,13 +11,13 @@ from services.chat_service import (
     check_session_service,
     update_tag_chat_session,
     get_all_customer_service,
-    sendMessage,
+    export_customers_service,
     send_message_fast_service,
     get_dashboard_summary
 )
 from models.chat import ChatSession, CustomerInfo
 from services.llm_service import (get_all_llms_service)
-from fastapi import WebSocket
+from fastapi import HTTPException, WebSocket
 from datetime import datetime
 from models.chat import CustomerInfo
 from sqlalchemy.orm import Session
@@ -29,6 +30,11 @@ from llm.llm import RAGModel
 manager = ConnectionManager()
 from config.database import SessionLocal
 from helper.task import extract_customer_info_background
+from helper.background import background
+from services.message_archive_service import rehydrate_session
+from services.search_service import search_conversations
+from services.campaign_service import CAMPAIGN_NOTIFY_BATCH, campaign_dispatcher, cancel_campaign, create_campaign, get_campaign, list_campaigns
+from services.purge_service import PURGE_SYNC_LIMIT, enqueue_session_purge, get_purge_job, cancel_purge_job
 
 
 def create_session_controller(db):
@@ -52,15 +58,18 @@ def check_session_controller(sessionId, db):
 
 async def sendMessage_controller(data: dict, db):
     try:
-        message = sendMessage(data, data.get("content"), db)
-        for msg in message:
-            print(msg)
-            await manager.broadcast_to_admins(msg)
-            print("send1")
-            await manager.send_to_customer(msg["chat_session_id"], msg)
-            print("send2")
-
-        return {"status": "success", "data": message}
+        campaign, message = await asyncio.to_thread(create_campaign, data, data.get("content"))
+        # Admin nhận tin theo lô (mỗi sự kiện nhiều conversation), tiến độ gửi qua "campaign_progress"
+        for start in range(0, len(message), CAMPAIGN_NOTIFY_BATCH):
+            await manager.broadcast_to_admins({
+                "type": "campaign_messages",
+                "campaign_id": campaign["id"],
+                "messages": message[start:start + CAMPAIGN_NOTIFY_BATCH],
+            })
+        if campaign["total"] > campaign["skipped"]:
+            campaign_dispatcher.dispatch(campaign["id"])
+
+        return {"status": "success", "data": message, "campaign": campaign}
     except Exception as e:
         print(e)
 
@@ -81,7 +90,7 @@ async def customer_chat(websocket: WebSocket, session_id: int, db: Session):
                 await manager.send_to_customer(session_id, msg)
 
             # Thu thập thông tin khách hàng sau MỖI tin nhắn
-            asyncio.create_task(extract_customer_info_background(session_id, db, manager))
+            background.spawn_with_session(extract_customer_info_background, session_id, manager=manager)
 
     except Exception as e:
         print(f"Lỗi trong customer_chat: {e}")
@@ -119,19 +128,38 @@ async def handle_send_message(websocket: WebSocket, data : dict, user):
     # gửi realtime cho client
     return message
     
-def get_history_chat_controller(chat_session_id: int, page: int = 1, limit: int = 10, db=None):
-    messages = get_history_chat_service(chat_session_id, page, limit, db)
+async def get_history_chat_controller(chat_session_id: int, page: int = 1, limit: int = 10, db=None,
+                                      before_id: int = None, after_id: int = None):
+    messages = await get_history_chat_service(chat_session_id, page, limit, db, before_id, after_id)
     return messages
 
 
-def get_all_history_chat_controller(db):
-    messages = get_all_history_chat_service(db)
+async def count_history_chat_controller(chat_session_id: int, db):
+    return await count_history_chat_service(chat_session_id, db)
+
+
+async def rehydrate_history_controller(chat_session_id: int):
+    restored = await asyncio.to_thread(rehydrate_session, chat_session_id)
+    if restored is None:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return {"chat_session_id": chat_session_id, "restored": restored}
+
+
+def get_all_history_chat_controller(db, filters: dict = None):
+    messages = get_all_history_chat_service(db, **(filters or {}))
     return messages
     
+def search_conversations_controller(q: str, limit: int, cursor, db):
+    return search_conversations(db, q, limit, cursor)
+
+
 def get_all_customer_controller(data: dict, db):
     customers = get_all_customer_service(data, db)
     return customers
 
+def export_customers_controller(data: dict, fmt: str):
+    return export_customers_service(data, fmt)
+
 
 async def update_chat_session_controller(id: int, data: dict, user, db):
     chatSession = update_chat_session(id, data, user, db)
@@ -233,7 +261,7 @@ async def chat_platform(channel, body: dict, db):
         
         
      
-    message = send_message_page_service(data, db)   
+    message = await send_message_page_service(data, db)   
     
     for msg in message:
         await manager.broadcast_to_admins(msg)
@@ -241,9 +269,16 @@ async def chat_platform(channel, body: dict, db):
     # Thu thập thông tin khách hàng sau MỖI tin nhắn từ platform - chạy background task
     if message:
         session_id = message[0].get("chat_session_id")
-        asyncio.create_task(extract_customer_info_background(session_id, db, manager))
+        background.spawn_with_session(extract_customer_info_background, session_id, manager=manager)
 
 def delete_chat_session_controller(ids: list[int], db):
+    if len(ids) > PURGE_SYNC_LIMIT:
+        # Lượng lớn -> job nền theo chunk, theo dõi qua /chat/purge_jobs/{job_id}
+        return {
+            "deleted": 0,
+            "ids": ids,
+            "job": enqueue_session_purge(sorted({int(i) for i in ids}))
+        }
     deleted_count = delete_chat_session(ids, db)   # gọi xuống service
     return {
         "deleted": deleted_count,
@@ -256,6 +291,33 @@ def delete_message_controller(chatId: int, ids: list[int], db):
         "deleted": deleted_count,
         "ids": ids
     }
+def get_purge_job_controller(job_id: str):
+    job = get_purge_job(job_id)
+    if not job:
+        return {"error": "Job not found"}
+    return job
+
+def cancel_purge_job_controller(job_id: str):
+    return {
+        "job_id": job_id,
+        "cancelled": cancel_purge_job(job_id)
+    }
+
+async def get_campaign_controller(campaign_id: int):
+    campaign = await asyncio.to_thread(get_campaign, campaign_id)
+    if not campaign:
+        return {"error": "Campaign not found"}
+    return campaign
+
+async def list_campaigns_controller(limit: int):
+    return await asyncio.to_thread(list_campaigns, limit)
+
+async def cancel_campaign_controller(campaign_id: int):
+    return {
+        "campaign_id": campaign_id,
+        "cancelled": await asyncio.to_thread(cancel_campaign, campaign_id)
+    }
+
 def get_dashboard_summary_controller(db: Session):
     result = get_dashboard_summary(db)
     return result
\ No newline at end of file
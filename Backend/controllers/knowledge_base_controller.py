@@ -1,5 +1,10 @@
 from services import knowledge_base_service
-from config.sheet import get_sheet
+from services.ingestion_job_service import (
+    enqueue_sheet_ingestion,
+    enqueue_file_ingestion,
+    get_ingestion_job,
+    cancel_ingestion_job
+)
 import logging
 
 logger = logging.getLogger(__name__)
@@ -8,19 +13,21 @@ def get_all_kb_controller(db):
     return knowledge_base_service.get_all_kb_service(db)
 
 def create_kb_controller(data: dict, db):
-    kb = knowledge_base_service.create_kb_service(data, db)
+    kb, job = knowledge_base_service.create_kb_service(data, db)
     return {
         "message": "Knowledge Base created",
-        "knowledge_base": kb
+        "knowledge_base": kb,
+        "job": job
     }
 
 def update_kb_controller(kb_id: int, data: dict, db):
-    kb = knowledge_base_service.update_kb_service(kb_id, data, db)
+    kb, job = knowledge_base_service.update_kb_service(kb_id, data, db)
     if not kb:
         return {"error": "Knowledge Base not found"}
     return {
         "message": "Knowledge Base updated",
-        "knowledge_base": kb
+        "knowledge_base": kb,
+        "job": job
     }
 
 def search_kb_controller(query: str, db):
@@ -28,23 +35,45 @@ def search_kb_controller(query: str, db):
 
 def test_sheet_processing_controller(sheet_id: str, kb_id: int):
     """
-    Endpoint test để kiểm tra chức năng xử lý Google Sheet
+    Endpoint test để kiểm tra chức năng xử lý Google Sheet (chạy nền, trả về job)
     """
     try:
-        result = get_sheet(sheet_id, kb_id)
+        job = enqueue_sheet_ingestion(sheet_id, kb_id)
         return {
-            "success": result["success"],
-            "message": result["message"],
-            "details": {
-                "chunks_created": result.get("chunks_created", 0),
-                "sheets_processed": result.get("sheets_processed", 0)
-            }
+            "success": True,
+            "message": "Đã xếp hàng xử lý Google Sheet",
+            "job": job
         }
     except Exception as e:
         logger.error(f"Lỗi trong test_sheet_processing_controller: {str(e)}")
         return {
             "success": False,
             "message": f"Lỗi hệ thống: {str(e)}",
-            "details": {}
+            "job": None
         }
 
+def upload_kb_file_controller(fileobj, filename: str, kb_id: int):
+    try:
+        job = enqueue_file_ingestion(fileobj, filename, kb_id)
+        return {
+            "success": True,
+            "message": "Đã xếp hàng xử lý file",
+            "job": job
+        }
+    except ValueError as e:
+        return {"success": False, "message": str(e), "job": None}
+    except Exception as e:
+        logger.error(f"Lỗi trong upload_kb_file_controller: {str(e)}")
+        return {"success": False, "message": f"Lỗi hệ thống: {str(e)}", "job": None}
+
+def get_ingestion_job_controller(job_id: str):
+    job = get_ingestion_job(job_id)
+    if not job:
+        return {"error": "Job not found"}
+    return job
+
+def cancel_ingestion_job_controller(job_id: str):
+    return {
+        "job_id": job_id,
+        "cancelled": cancel_ingestion_job(job_id)
+    }
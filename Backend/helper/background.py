@@ -0,0 +1,120 @@
+"""
+Background Runtime - Chạy task nền tách khỏi request, mỗi task có DB session ngắn hạn của riêng nó
+"""
+import asyncio
+import os
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Optional, Set
+
+from sqlalchemy import event
+
+from config.database import BackgroundSessionLocal, pool_monitors
+
+BACKGROUND_LEAK_CHECK_SECONDS = float(os.getenv("BACKGROUND_LEAK_CHECK_SECONDS", 15))
+BACKGROUND_DRAIN_SECONDS = float(os.getenv("BACKGROUND_DRAIN_SECONDS", 10))
+
+
+def _record_checkout_wait(db):
+    """
+    Ghi thời gian chờ connection: từ lúc session mở transaction (lazy, ở query đầu tiên)
+    tới khi pool trả connection.
+    """
+    started = {}
+
+    def _on_transaction(session, transaction):
+        if transaction.parent is None:
+            started["at"] = time.monotonic()
+
+    def _on_begin(session, transaction, connection):
+        at = started.pop("at", None)
+        if at is not None:
+            pool_monitors["background"].record_wait(time.monotonic() - at)
+
+    event.listen(db, "after_transaction_create", _on_transaction)
+    event.listen(db, "after_begin", _on_begin)
+
+
+@contextmanager
+def background_session():
+    """
+    Session từ pool background: chỉ lấy connection khi query đầu tiên chạy (không giữ suốt task),
+    rollback nếu lỗi, luôn trả connection về pool khi ra khỏi block.
+    Task gọi dịch vụ ngoài (LLM, API platform) nên commit trước đó để trả connection sớm.
+    """
+    db = BackgroundSessionLocal()
+    _record_checkout_wait(db)
+    try:
+        yield db
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class BackgroundRuntime:
+    """
+    - `spawn(coro)`: chạy coroutine nền, giữ tham chiếu tới khi xong (task không bị GC giữa chừng)
+      và log lỗi thay vì nuốt im lặng.
+    - `spawn_with_session(fn, *args)`: như trên nhưng gọi `fn(*args, db=<session riêng>)`;
+      không bao giờ dùng lại `db` của request vì request đóng session trước khi task chạy xong.
+    - Watchdog định kỳ in ra connection bị giữ quá lâu ở cả hai pool.
+    """
+
+    def __init__(self, leak_check_seconds: float = BACKGROUND_LEAK_CHECK_SECONDS):
+        self.leak_check_seconds = leak_check_seconds
+        self._tasks: Set[asyncio.Task] = set()
+        self._watchdog: Optional[asyncio.Task] = None
+
+    def spawn(self, coro, name: str = None) -> asyncio.Task:
+        task = asyncio.create_task(coro, name=name)
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def spawn_with_session(self, fn, *args, **kwargs) -> asyncio.Task:
+        return self.spawn(self._with_session(fn, *args, **kwargs), name=getattr(fn, "__name__", None))
+
+    @staticmethod
+    async def _with_session(fn, *args, **kwargs):
+        with background_session() as db:
+            return await fn(*args, db=db, **kwargs)
+
+    def _done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error:
+            print(f"❌ Lỗi background task {task.get_name()}: {error}")
+            traceback.print_exception(type(error), error, error.__traceback__)
+
+    def start(self):
+        if self._watchdog is None:
+            self._watchdog = asyncio.create_task(self._watch())
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.leak_check_seconds)
+            for monitor in pool_monitors.values():
+                monitor.report_leaks()
+
+    async def stop(self, timeout: float = BACKGROUND_DRAIN_SECONDS):
+        """Chờ các task đang chạy xong (tối đa `timeout` giây) rồi hủy phần còn lại"""
+        if self._watchdog:
+            self._watchdog.cancel()
+            self._watchdog = None
+        if not self._tasks:
+            return
+        done, pending = await asyncio.wait(list(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"running_tasks": len(self._tasks)}
+
+
+background = BackgroundRuntime()
@@ -0,0 +1,168 @@
+"""
+Handover Scheduler - Trả session về cho bot khi hết thời gian admin giữ
+"""
+import asyncio
+import os
+import time
+import traceback
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import update
+
+from config.database import SessionLocal
+from config.redis_cache import redis_cache
+from config.session_cache import SessionState, session_cache
+from models.chat import ChatSession
+
+HANDOVER_KEY = "handover:expiry"
+HANDOVER_POLL_SECONDS = float(os.getenv("HANDOVER_POLL_SECONDS", 5))
+HANDOVER_BATCH_SIZE = int(os.getenv("HANDOVER_BATCH_SIZE", 500))
+# Quét DB định kỳ để bắt các session bị lỡ lịch (Redis mất dữ liệu, ghi lịch thất bại, ...)
+HANDOVER_RECONCILE_SECONDS = float(os.getenv("HANDOVER_RECONCILE_SECONDS", 60))
+
+# Lấy và xóa các session đến hạn trong một bước -> nhiều worker không xử lý trùng
+_CLAIM_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #ids > 0 then
+    redis.call('ZREM', KEYS[1], unpack(ids))
+end
+return ids
+"""
+
+
+def _handover_call(session_id: int, expires_at: Optional[datetime]):
+    if expires_at is None:
+        return "zrem", (HANDOVER_KEY, session_id)
+    return "zadd", (HANDOVER_KEY, {session_id: expires_at.timestamp()})
+
+
+def schedule_handover(session_id: int, expires_at: Optional[datetime]):
+    """Đặt lịch trả session cho bot lúc `expires_at` (None = hủy lịch)"""
+    try:
+        client = redis_cache.get_sync_client()
+        if client is None:
+            return
+        method, args = _handover_call(session_id, expires_at)
+        getattr(client, method)(*args)
+    except Exception as e:
+        print(f"❌ Lỗi đặt lịch handover session {session_id}: {e}")
+
+
+async def async_schedule_handover(session_id: int, expires_at: Optional[datetime]):
+    try:
+        client = await redis_cache.get_async_client()
+        if client is None:
+            return
+        method, args = _handover_call(session_id, expires_at)
+        await getattr(client, method)(*args)
+    except Exception as e:
+        print(f"❌ Lỗi đặt lịch handover session {session_id}: {e}")
+
+
+def sync_handover(session):
+    """Đồng bộ lịch theo trạng thái hiện tại của session (sau khi commit)"""
+    schedule_handover(session.id, session.time if session.status == "false" else None)
+
+
+async def async_sync_handover(session):
+    await async_schedule_handover(session.id, session.time if session.status == "false" else None)
+
+
+def release_due_sessions(ids: Optional[List[int]] = None) -> List[SessionState]:
+    """
+    Bulk UPDATE các session đã hết hạn admin giữ -> status "true".
+    `ids` = các session lấy từ lịch; None = quét toàn bộ DB.
+    Điều kiện status/time được kiểm tra lại để không nhả nhầm session vừa được gia hạn.
+    """
+    db = SessionLocal()
+    try:
+        stmt = (
+            update(ChatSession)
+            .where(ChatSession.status == "false", ChatSession.time <= datetime.now())
+            .values(status="true", time=None)
+            .returning(
+                ChatSession.id, ChatSession.name, ChatSession.status, ChatSession.channel,
+                ChatSession.page_id, ChatSession.current_receiver, ChatSession.previous_receiver,
+                ChatSession.time,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        if ids is not None:
+            stmt = stmt.where(ChatSession.id.in_(ids))
+        rows = db.execute(stmt).all()
+        db.commit()
+        return [SessionState(*row) for row in rows]
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class HandoverScheduler:
+    """
+    Vòng lặp nền trên event loop:
+    - claim các session đến hạn từ ZSET `handover:expiry`,
+    - nhả chúng trong DB bằng một câu UPDATE ... RETURNING,
+    - ghi xuyên cache session và báo cho admin qua websocket.
+    Khi không có Redis, mỗi vòng quét thẳng DB.
+    """
+
+    def __init__(self, manager=None, poll_seconds: float = HANDOVER_POLL_SECONDS,
+                 reconcile_seconds: float = HANDOVER_RECONCILE_SECONDS):
+        self.manager = manager
+        self.poll_seconds = poll_seconds
+        self.reconcile_seconds = reconcile_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._last_reconcile = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Lỗi handover scheduler: {e}")
+                traceback.print_exc()
+            await asyncio.sleep(self.poll_seconds)
+
+    async def tick(self) -> int:
+        released: List[SessionState] = []
+
+        ids = await redis_cache.async_eval_script(
+            _CLAIM_SCRIPT, keys=[HANDOVER_KEY], args=[time.time(), HANDOVER_BATCH_SIZE], readonly=True
+        )
+        if ids:
+            released += await asyncio.to_thread(release_due_sessions, [int(i) for i in ids])
+
+        now = time.monotonic()
+        if ids is None or now - self._last_reconcile >= self.reconcile_seconds:
+            self._last_reconcile = now
+            released += await asyncio.to_thread(release_due_sessions, None)
+
+        for state in released:
+            await session_cache.async_put(state)
+            if self.manager:
+                await self.manager.broadcast_to_admins({
+                    "chat_session_id": state.id,
+                    "session_status": state.status,
+                    "current_receiver": state.current_receiver,
+                    "previous_receiver": state.previous_receiver,
+                    "time": None,
+                })
+        return len(released)
@@ -0,0 +1,288 @@
+"""
+Job Queue - Hàng đợi job nền chạy trên worker pool (thread)
+"""
+import os
+import time
+import uuid
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from config.redis_cache import cache_get, cache_set
+
+JOB_STATUS_TTL = int(os.getenv("JOB_STATUS_TTL", 86400))
+# Job đã xong được giữ trong bộ nhớ bao lâu (sau đó chỉ còn bản trên Redis)
+JOB_KEEP_SECONDS = int(os.getenv("JOB_KEEP_SECONDS", 3600))
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+    """Raise bên trong job khi job đã bị hủy"""
+
+
+class Job:
+    """Trạng thái + tiến độ của một job"""
+
+    def __init__(self, kind: str, key: Optional[str], params: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.params = params
+        self.status = PENDING
+        self.progress: Dict[str, int] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._on_change: Optional[Callable[["Job"], None]] = None
+
+    # ---------- Tiến độ ----------
+    def set_total(self, name: str, total: int):
+        with self._lock:
+            self.progress[f"{name}_total"] = total
+        self._changed()
+
+    def add_total(self, name: str, count: int = 1):
+        with self._lock:
+            key = f"{name}_total"
+            self.progress[key] = self.progress.get(key, 0) + count
+        self._changed()
+
+    def advance(self, name: str, count: int = 1):
+        with self._lock:
+            self.progress[name] = self.progress.get(name, 0) + count
+        self._changed()
+
+    # ---------- Hủy ----------
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled(self.id)
+
+    # ---------- Báo cáo ----------
+    def eta_seconds(self, name: str) -> Optional[float]:
+        """Ước lượng thời gian còn lại dựa trên tốc độ xử lý `name` từ lúc bắt đầu"""
+        if self.status != RUNNING or not self.started_at:
+            return None
+        done = self.progress.get(name, 0)
+        total = self.progress.get(f"{name}_total", 0)
+        if done <= 0 or total <= done:
+            return None
+        rate = done / max(time.time() - self.started_at, 1e-6)
+        return round((total - done) / rate, 1)
+
+    def to_dict(self, eta_of: Optional[str] = None) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "key": self.key,
+            "status": self.status,
+            "progress": dict(self.progress),
+            "eta_seconds": self.eta_seconds(eta_of) if eta_of else None,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    def _changed(self):
+        if self._on_change:
+            self._on_change(self)
+
+
+class JobQueue:
+    """
+    Worker pool cho các job chạy lâu (ingest sheet, purge, ...).
+
+    - `key` dùng để gộp job trùng: job cùng key đang chờ thì được thay tham số
+      (coalesce), job cùng key đang chạy thì bị hủy và job mới chỉ được xếp hàng
+      khi job cũ đã thực sự dừng (hai job cùng key không bao giờ chạy chồng nhau).
+    - `cleanup(params)` (tùy chọn) được gọi đúng một lần cho mỗi bộ tham số: khi job
+      xong / lỗi / bị hủy (kể cả hủy lúc còn chờ hay lúc shutdown) hoặc khi bị job mới gộp thay.
+    - Trạng thái job được ghi ra Redis để mọi worker process đều đọc được. Việc ghi chạy trên
+      một thread publish riêng (theo thứ tự), nên `submit` gọi từ route async không chặn event loop.
+    - Gộp job theo `key` chỉ có tác dụng trong một process. `cancel` job của process khác
+      đặt cờ `job:{kind}:{id}:cancel` trên Redis; process đang chạy job đọc cờ ở lần publish
+      kế tiếp (khi tiến độ thay đổi) và hủy job.
+    """
+
+    def __init__(self, kind: str, max_workers: int = 2, eta_of: Optional[str] = None,
+                 publish_interval: float = 1.0):
+        self.kind = kind
+        self.eta_of = eta_of
+        self.publish_interval = publish_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"job-{kind}")
+        self._jobs: Dict[str, Job] = {}
+        self._by_key: Dict[str, Job] = {}
+        self._handlers: Dict[str, Callable[[Job], Any]] = {}
+        # job_id đang chạy -> job thay thế, chờ job đó dừng mới đưa vào executor
+        self._successors: Dict[str, Job] = {}
+        self._cleanups: Dict[str, Callable[[Dict[str, Any]], None]] = {}
+        self._lock = threading.Lock()
+        self._last_publish: Dict[str, float] = {}
+        self._publisher = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"job-{kind}-publish")
+
+    def submit(self, handler: Callable[[Job], Any], params: Dict[str, Any],
+               key: Optional[str] = None,
+               cleanup: Optional[Callable[[Dict[str, Any]], None]] = None) -> Job:
+        replaced = None
+        with self._lock:
+            self._prune()
+            existing = self._by_key.get(key) if key else None
+            if existing and existing.status == PENDING:
+                # Job cùng key chưa chạy -> gộp, dùng tham số mới nhất
+                replaced = (existing.params, self._cleanups.pop(existing.id, None))
+                existing.params = params
+                self._handlers[existing.id] = handler
+                if cleanup:
+                    self._cleanups[existing.id] = cleanup
+                coalesced = existing
+            else:
+                coalesced = None
+                job = Job(self.kind, key, params)
+                job._on_change = self._publish
+                self._jobs[job.id] = job
+                self._handlers[job.id] = handler
+                if cleanup:
+                    self._cleanups[job.id] = cleanup
+                if key:
+                    self._by_key[key] = job
+                wait_for = existing if existing and existing.status == RUNNING else None
+                if wait_for:
+                    # Job cùng key đang chạy -> hủy; job mới chạy sau khi job cũ dừng hẳn (xem _finish)
+                    wait_for.cancel()
+                    self._successors[wait_for.id] = job
+
+        if replaced and replaced[1]:
+            self._cleanup(replaced[1], replaced[0])
+        # Ghi Redis ngoài lock
+        if coalesced:
+            self._publish(coalesced, force=True)
+            return coalesced
+        self._publish(job, force=True)
+        if not wait_for:
+            self._executor.submit(self._run, job)
+        return job
+
+    def _run(self, job: Job):
+        with self._lock:
+            if not job.cancelled:
+                job.status = RUNNING
+                job.started_at = time.time()
+        if job.cancelled:
+            self._finish(job, CANCELLED)
+            return
+        self._publish(job, force=True)
+        try:
+            job.result = self._handlers[job.id](job)
+            self._finish(job, CANCELLED if job.cancelled else DONE)
+        except JobCancelled:
+            self._finish(job, CANCELLED)
+        except Exception as e:
+            print(f"❌ Job {job.kind}:{job.id} lỗi: {e}")
+            traceback.print_exc()
+            job.error = str(e)
+            self._finish(job, FAILED)
+
+    def _finish(self, job: Job, status: str):
+        with self._lock:
+            if job.finished_at:
+                # Đã kết thúc (shutdown và worker cùng hủy một job đang chờ)
+                return
+            job.status = status
+            job.finished_at = time.time()
+            self._handlers.pop(job.id, None)
+            if job.key and self._by_key.get(job.key) is job:
+                del self._by_key[job.key]
+            successor = self._successors.pop(job.id, None)
+            cleanup = self._cleanups.pop(job.id, None)
+        if cleanup:
+            self._cleanup(cleanup, job.params)
+        self._publish(job, force=True)
+        if successor:
+            try:
+                self._executor.submit(self._run, successor)
+            except RuntimeError:
+                # Executor đã shutdown
+                self._finish(successor, CANCELLED)
+
+    def _cleanup(self, cleanup: Callable[[Dict[str, Any]], None], params: Dict[str, Any]):
+        try:
+            cleanup(params)
+        except Exception as e:
+            print(f"❌ Lỗi dọn dẹp job {self.kind}: {e}")
+            traceback.print_exc()
+
+    def _prune(self):
+        cutoff = time.time() - JOB_KEEP_SECONDS
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+            self._last_publish.pop(job_id, None)
+
+    def _publish(self, job: Job, force: bool = False):
+        # Giới hạn số lần ghi Redis khi tiến độ cập nhật liên tục
+        now = time.time()
+        if not force and now - self._last_publish.get(job.id, 0) < self.publish_interval:
+            return
+        self._last_publish[job.id] = now
+        # Chụp trạng thái ngay, ghi Redis trên thread publish
+        self._publisher.submit(self._write_status, job, job.to_dict(self.eta_of))
+
+    def _status_key(self, job_id: str) -> str:
+        return f"job:{self.kind}:{job_id}"
+
+    def _write_status(self, job: Job, status: Dict[str, Any]):
+        try:
+            cache_set(self._status_key(job.id), status, ttl=JOB_STATUS_TTL)
+            if status["status"] in (PENDING, RUNNING) and cache_get(f"{self._status_key(job.id)}:cancel"):
+                # Bị hủy từ worker process khác
+                job.cancel()
+        except Exception as e:
+            print(f"❌ Lỗi ghi trạng thái job {self.kind}:{job.id}: {e}")
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        if job:
+            return job.to_dict(self.eta_of)
+        # Job do worker process khác chạy
+        return cache_get(self._status_key(job_id))
+
+    def cancel(self, job_id: str) -> bool:
+        job = self._jobs.get(job_id)
+        if job:
+            if job.status not in (PENDING, RUNNING):
+                return False
+            job.cancel()
+            return True
+        # Job do worker process khác chạy -> đặt cờ hủy cho process đó
+        status = cache_get(self._status_key(job_id))
+        if not status or status.get("status") not in (PENDING, RUNNING):
+            return False
+        return bool(cache_set(f"{self._status_key(job_id)}:cancel", 1, ttl=JOB_STATUS_TTL))
+
+    def shutdown(self, wait: bool = False):
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status in (PENDING, RUNNING):
+                    job.cancel()
+            self._successors.clear()
+        # Job còn trong hàng đợi executor sẽ không bao giờ chạy -> tự kết thúc để cleanup được gọi
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        for job in [j for j in list(self._jobs.values()) if j.status == PENDING]:
+            self._finish(job, CANCELLED)
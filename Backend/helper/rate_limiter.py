@@ -0,0 +1,49 @@
+"""
+Rate Limiter - Token bucket bất đồng bộ cho các lệnh gọi API platform
+"""
+import asyncio
+import time
+from typing import Optional
+
+
+class RateLimiter:
+    """
+    Tối đa `rate` lệnh / giây, cho phép dồn `burst` lệnh.
+
+    - `acquire()` chờ đến khi có token.
+    - `pause(seconds)` khi platform trả 429 / vượt quota: mọi lệnh sau cùng chờ.
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = max(rate, 0.01)
+        self.capacity = float(burst or max(1, int(rate)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        # `_updated` có thể nằm ở tương lai (mốc hết tạm dừng) -> không cộng token âm / trước hạn
+        self._tokens = min(self.capacity, self._tokens + max(0.0, now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    # Tính token lại từ lúc hết tạm dừng, không từ trước khi dừng
+                    self._updated = max(self._updated, self._paused_until)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        # Không tích token trong lúc tạm dừng
+        self._tokens = 0
+        self._updated = self._paused_until
@@ -1,14 +1,18 @@
+import asyncio
 import json
 import traceback
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 from models.chat import ChatSession, Message, CustomerInfo
 from llm.llm import RAGModel
-from config.redis_cache import cache_set
+from config.session_cache import session_cache
+from helper.handover_scheduler import async_sync_handover
+from services.message_buffer_service import message_buffer
 from google.oauth2.service_account import Credentials
 from models.knowledge_base import KnowledgeBase
 import gspread
-from config.database import SessionLocal
+from config.database import AsyncSessionLocal, SessionLocal
+from sqlalchemy import select
 import os
 
 client = None
@@ -141,10 +145,21 @@ def add_customer(customer_data: dict, db: Session):
 async def extract_customer_info_background(session_id: int, db, manager):
     """Background task để thu thập thông tin khách hàng"""
     try:
-        
-        
         rag = RAGModel(db_session=db)
-        extracted_info = rag.extract_customer_info_realtime(session_id, limit_messages=15)
+        field_configs = await rag.async_get_field_configs()
+        # Query / LLM / Google Sheets đều chặn -> chạy trong thread, `db` chỉ được dùng ở đó
+        customer_update = await asyncio.to_thread(_extract_and_save_customer_info, rag, session_id, db, field_configs)
+        if customer_update:
+            await manager.broadcast_to_admins(customer_update)
+            print(f"📡 Đã gửi customer_info_update cho session {session_id}")
+    except Exception as extract_error:
+        print(f"Lỗi khi trích xuất thông tin background: {extract_error}")
+
+
+def _extract_and_save_customer_info(rag, session_id: int, db, field_configs):
+    """Trích xuất + merge thông tin khách vào customer_info; trả về message customer_info_update nếu có thay đổi"""
+    try:
+        extracted_info = rag.extract_customer_info_realtime(session_id, limit_messages=15, field_configs=field_configs)
         
         print("EXTRACTED JSON RESULT:", extracted_info)
         if extracted_info:
@@ -211,62 +226,56 @@ async def extract_customer_info_background(session_id: int, db, manager):
                 
                 # ✅ Gửi WebSocket nếu có thông tin cần cập nhật
                 if should_set_alert and final_customer_data:
-                    customer_update = {
+                    return {
                         "chat_session_id": session_id,
                         "customer_data": final_customer_data,
                         "type": "customer_info_update"
                     }
-                    await manager.broadcast_to_admins(customer_update)
-                    print(f"📡 Đã gửi customer_info_update cho session {session_id}")
                 
                 
     except Exception as extract_error:
+        db.rollback()
         print(f"Lỗi khi trích xuất thông tin background: {extract_error}")
+    return None
 
 
-async def save_message_to_db_async(data: dict, sender_name: str, image_url: list, db: Session):
+async def save_message_to_db_async(data: dict, sender_name: str, image_url: list):
+    """Lưu tin nhắn qua message buffer (ghi theo lô), trả về id đã lưu"""
     try:
-        message = Message(
-            chat_session_id=data.get("chat_session_id"),
-            sender_type=data.get("sender_type"),
-            content=data.get("content"),
-            sender_name=sender_name,
-            image=json.dumps(image_url) if image_url else None
-        )
-        db.add(message)
-        db.commit()
-        print(f"✅ Đã lưu tin nhắn ID: {message.id}")
+        message_id = await message_buffer.save({
+            "id": data.get("id"),
+            "chat_session_id": data.get("chat_session_id"),
+            "sender_type": data.get("sender_type"),
+            "content": data.get("content"),
+            "sender_name": sender_name,
+            "image": json.dumps(image_url) if image_url else None
+        })
+        print(f"✅ Đã lưu tin nhắn ID: {message_id}")
+        return message_id
         
     except Exception as e:
         print(f"❌ Lỗi lưu tin nhắn: {e}")
         traceback.print_exc()
-        db.rollback()
+        return None
 
 
-async def update_session_admin_async(chat_session_id: int, sender_name: str, db: Session):
-    """Cập nhật session khi admin reply bất đồng bộ"""
+async def update_session_admin_async(chat_session_id: int, sender_name: str):
+    """Cập nhật session khi admin reply bất đồng bộ (AsyncSession: chờ DB không chặn event loop)"""
     try:
-        db_session = db.query(ChatSession).filter(ChatSession.id == chat_session_id).first()
-        if db_session:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(ChatSession).where(ChatSession.id == chat_session_id))
+            db_session = result.scalars().first()
+            if not db_session:
+                return
             db_session.status = "false"
             db_session.time = datetime.now() + timedelta(hours=1)
             db_session.previous_receiver = db_session.current_receiver
             db_session.current_receiver = sender_name
-            db.commit()
+            await db.commit()
             
-            # Cập nhật cache
-            session_cache_key = f"session:{chat_session_id}"
-            session_data = {
-                'id': db_session.id,
-                'name': db_session.name,
-                'status': db_session.status,
-                'channel': db_session.channel,
-                'page_id': db_session.page_id,
-                'current_receiver': db_session.current_receiver,
-                'previous_receiver': db_session.previous_receiver,
-                'time': db_session.time.isoformat() if db_session.time else None
-            }
-            cache_set(session_cache_key, session_data, ttl=300)
+            # Ghi xuyên cache
+            await session_cache.async_put(db_session)
+            await async_sync_handover(db_session)
             
     except Exception as e:
         print(f"❌ Lỗi cập nhật session: {e}")
@@ -7,14 +7,14 @@ from sqlalchemy.orm import Session
 from config.get_embedding import get_embedding_gemini
 import google.generativeai as genai
 from typing import List, Dict
-from config.database import SessionLocal
-from sqlalchemy import desc
+from config.database import SessionLocal, AsyncSessionLocal
+from sqlalchemy import desc, select
 from models.llm import LLM
 from models.chat import Message
 from dotenv import load_dotenv
 from models.chat import ChatSession, CustomerInfo
 from models.field_config import FieldConfig
-from config.redis_cache import cache_get, cache_set, cache_delete
+from config.redis_cache import async_cache_get_or_set, cache_delete, cache_get_or_set
 # Load biến môi trường
 load_dotenv()
 class RAGModel:
@@ -46,6 +46,27 @@ class RAGModel:
         
         print(f"DEBUG: Found {len(messages)} messages")
         
+        # Không đóng db_session nữa vì được quản lý từ bên ngoài
+        return self._format_history(messages)
+
+    async def async_get_recent_histories(self, chat_session_id: int, limit: int = 10, search_limit: int = 5):
+        """
+        Bản async (AsyncSession) của get_latest_messages cho hot path trên event loop.
+        Một query lấy `limit` tin, trả về (history cho prompt, history `search_limit` tin cho build_search_key).
+        """
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(Message)
+                .where(Message.chat_session_id == chat_session_id)
+                .order_by(desc(Message.created_at))
+                .limit(limit)
+            )
+            messages = result.scalars().all()
+        return self._format_history(messages), self._format_history(messages[:search_limit])
+
+    @staticmethod
+    def _format_history(messages) -> str:
+        """messages: mới nhất trước -> hội thoại theo thứ tự thời gian"""
         results = [
             {
                 "id": m.id,
@@ -56,8 +77,6 @@ class RAGModel:
             for m in reversed(messages) 
         ]
 
-        print(f"DEBUG: Results after processing: {results}")
-
         # return results
         conversation = []
         for msg in results:
@@ -66,14 +85,13 @@ class RAGModel:
         
         conversation_text = "\n".join(conversation)
         print(f"DEBUG: Final conversation text: '{conversation_text}'")
-        
-        # Không đóng db_session nữa vì được quản lý từ bên ngoài
         return conversation_text
     
     
     
-    def build_search_key(self, chat_session_id, question):
-        history = self.get_latest_messages(chat_session_id=chat_session_id, limit=5)
+    def build_search_key(self, chat_session_id, question, history: str = None):
+        if history is None:
+            history = self.get_latest_messages(chat_session_id=chat_session_id, limit=5)
         prompt = f"""
         Hội thoại trước đó:
         {history}
@@ -120,43 +138,57 @@ class RAGModel:
             raise Exception(f"Lỗi khi tìm kiếm: {str(e)}")
     
     
+    FIELD_CONFIGS_CACHE_KEY = "field_configs:required_optional"
+
+    @staticmethod
+    def _split_field_configs(field_configs) -> dict:
+        required_fields = {}
+        optional_fields = {}
+
+        for config in field_configs:
+            field_name = config.excel_column_name
+            if config.is_required:
+                required_fields[field_name] = field_name
+            else:
+                optional_fields[field_name] = field_name
+
+        return {
+            'required_fields': required_fields,
+            'optional_fields': optional_fields
+        }
+
     def get_field_configs(self):
-        """Lấy cấu hình fields từ bảng field_config với Redis cache"""
-        cache_key = "field_configs:required_optional"
-        
-        # Thử lấy từ cache trước
-        cached_result = cache_get(cache_key)
-        if cached_result is not None:
-            print("DEBUG: Lấy field configs từ cache")
-            return cached_result.get('required_fields', {}), cached_result.get('optional_fields', {})
-        
-        try:
+        """
+        Lấy cấu hình fields từ bảng field_config với Redis cache.
+        Chỉ gọi ngoài event loop; coroutine dùng `async_get_field_configs` rồi truyền `field_configs`.
+        """
+        def load():
             print("DEBUG: Lấy field configs từ database")
             field_configs = self.db_session.query(FieldConfig).order_by(FieldConfig.excel_column_letter).all()
-            
-            required_fields = {}
-            optional_fields = {}
-            
-            for config in field_configs:
-                field_name = config.excel_column_name
-                if config.is_required:
-                    required_fields[field_name] = field_name
-                else:
-                    optional_fields[field_name] = field_name
-            
-            # Cache kết quả với TTL 24 giờ (86400 giây)
-            cache_data = {
-                'required_fields': required_fields,
-                'optional_fields': optional_fields
-            }
-            cache_set(cache_key, cache_data, ttl=86400)
-            print(f"DEBUG: Đã cache field configs với {len(required_fields)} required và {len(optional_fields)} optional fields")
-                    
-            return required_fields, optional_fields
+            return self._split_field_configs(field_configs)
+        
+        try:
+            # Cache 24 giờ, chỉ một request nạp lại khi key hết hạn
+            cached_result = cache_get_or_set(self.FIELD_CONFIGS_CACHE_KEY, load, ttl=86400)
+            return cached_result.get('required_fields', {}), cached_result.get('optional_fields', {})
         except Exception as e:
             print(f"Lỗi khi lấy field configs: {str(e)}")
             # Trả về dict rỗng nếu có lỗi
             return {}, {}
+
+    async def async_get_field_configs(self):
+        """Bản async của get_field_configs: chờ cache / DB không chặn event loop"""
+        async def load():
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(select(FieldConfig).order_by(FieldConfig.excel_column_letter))
+                return self._split_field_configs(result.scalars().all())
+
+        try:
+            cached_result = await async_cache_get_or_set(self.FIELD_CONFIGS_CACHE_KEY, load, ttl=86400)
+            return cached_result.get('required_fields', {}), cached_result.get('optional_fields', {})
+        except Exception as e:
+            print(f"Lỗi khi lấy field configs: {str(e)}")
+            return {}, {}
     
     def get_customer_infor(self, chat_session_id: int) -> dict:
         try:
@@ -178,22 +210,25 @@ class RAGModel:
             print(f"Lỗi khi lấy thông tin khách hàng: {str(e)}")
             return {}
     
-    def generate_response(self, query: str, chat_session_id: int) -> dict:
+    def generate_response(self, query: str, chat_session_id: int, history: str = None, search_history: str = None,
+                          field_configs=None) -> dict:
+        """`field_configs`: kết quả async_get_field_configs khi gọi từ coroutine"""
         try:
-            history = self.get_latest_messages(chat_session_id=chat_session_id, limit=10)
+            if history is None:
+                history = self.get_latest_messages(chat_session_id=chat_session_id, limit=10)
             customer_info = self.get_customer_infor(chat_session_id)
             
             if not query or query.strip() == "":
                 return {"text": "Nội dung câu hỏi trống, vui lòng nhập lại.", "links": []}
             
-            search = self.build_search_key(chat_session_id, query)
+            search = self.build_search_key(chat_session_id, query, search_history)
             print(f"Search: {search}")
             
             # Lấy ngữ cảnh
             knowledge = self.search_similar_documents(search, 10)
             
             # Lấy cấu hình fields động
-            required_fields, optional_fields = self.get_field_configs()
+            required_fields, optional_fields = field_configs or self.get_field_configs()
             
         
             
@@ -422,14 +457,14 @@ class RAGModel:
     
     
 
-    def extract_customer_info_realtime(self, chat_session_id: int, limit_messages: int):
+    def extract_customer_info_realtime(self, chat_session_id: int, limit_messages: int, field_configs=None):
         try:
             history = self.get_latest_messages(chat_session_id=chat_session_id, limit=limit_messages)
             
             print("HISTORY FOR EXTRACTION:", history)
             
             # Lấy cấu hình fields động
-            required_fields, optional_fields = self.get_field_configs()
+            required_fields, optional_fields = field_configs or self.get_field_configs()
             all_fields = {**required_fields, **optional_fields}
             
             # Nếu không có field configs, trả về JSON rỗng
@@ -473,7 +508,10 @@ class RAGModel:
                 Ví dụ format trả về (chỉ chứa các trường từ cấu hình):
                 {example_json_str}
                 """
-                
+
+            # Phần đọc DB đã xong: kết thúc transaction để trả connection về pool trong lúc chờ LLM
+            self.db_session.commit()
+
             response = self.model.generate_content(prompt)
             cleaned = re.sub(r"```json|```", "", response.text).strip()
             
@@ -486,7 +524,6 @@ class RAGModel:
     @staticmethod
     def clear_field_configs_cache():
         """Xóa cache field configs khi có thay đổi cấu hình"""
-        cache_key = "field_configs:required_optional"
-        success = cache_delete(cache_key)
+        success = cache_delete(RAGModel.FIELD_CONFIGS_CACHE_KEY)
         print(f"DEBUG: {'Thành công' if success else 'Thất bại'} xóa cache field configs")
         return success
\ No newline at end of file
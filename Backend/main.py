@@ -1,11 +1,11 @@
-from fastapi import FastAPI, Request
-from config.database import create_tables
+from fastapi import FastAPI, HTTPException, Request
+from config.migrations import run_migrations
 from datetime import datetime
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
-from models import user, company, llm, chat, facebook_page, field_config, telegram_page, tag
+from models import user, company, llm, chat, facebook_page, field_config, telegram_page, tag, campaign
 # from llm.llm import RAGModel
 from llm.gpt import RAGModel
 # from routers import messenger_router
@@ -21,6 +21,18 @@ from routers import tag_router
 from routers import zalotest
 from routers import zalo_router
 from routers import robots
+from services.ingestion_job_service import ingestion_queue
+from services.purge_service import purge_queue
+from services.campaign_service import campaign_dispatcher
+from config.redis_cache import redis_cache
+from middleware.jwt import authentication
+from controllers.chat_controller import manager as chat_manager
+from helper.handover_scheduler import HandoverScheduler
+from services.message_buffer_service import message_buffer
+from helper.background import background
+from config.database import async_engine, get_pool_stats
+from services.dashboard_rollup_service import rollup_scheduler
+from services.message_archive_service import partition_maintenance
 
 from dotenv import load_dotenv
 import os
@@ -28,7 +40,6 @@ import os
 load_dotenv()  
 
 app = FastAPI()
-create_tables()
 
 app.include_router(user_router.router)
 app.include_router(company_router.router)
@@ -65,9 +76,111 @@ app.mount("/upload", StaticFiles(directory=UPLOAD_DIR), name="upload")
 
 
 
+handover_scheduler = HandoverScheduler(manager=chat_manager)
+
+
+@app.on_event("startup")
+def apply_migrations():
+    # Chạy trước các startup khác; không còn create_all lúc import module
+    run_migrations()
+
+
+@app.on_event("startup")
+async def start_handover_scheduler():
+    handover_scheduler.start()
+
+
+@app.on_event("startup")
+async def start_message_buffer():
+    message_buffer.start()
+
+
+@app.on_event("startup")
+async def start_background_runtime():
+    background.start()
+
+
+@app.on_event("startup")
+async def start_rollup_scheduler():
+    rollup_scheduler.start()
+
+
+@app.on_event("startup")
+async def start_partition_maintenance():
+    partition_maintenance.start()
+
+
+@app.on_event("startup")
+async def start_campaign_dispatcher():
+    # Nhận lại các campaign đang gửi dở (worker trước tắt giữa chừng)
+    campaign_dispatcher.start(manager=chat_manager)
+
+
+@app.on_event("shutdown")
+async def stop_handover_scheduler():
+    await handover_scheduler.stop()
+
+
+@app.on_event("shutdown")
+async def stop_rollup_scheduler():
+    await rollup_scheduler.stop()
+
+
+@app.on_event("shutdown")
+async def stop_partition_maintenance():
+    await partition_maintenance.stop()
+
+
+@app.on_event("shutdown")
+async def stop_campaign_dispatcher():
+    await campaign_dispatcher.stop()
+
+
+@app.on_event("shutdown")
+async def drain_background_tasks():
+    await background.stop()
+
+
+@app.on_event("shutdown")
+async def drain_message_buffer():
+    await message_buffer.stop()
+
+
+@app.on_event("shutdown")
+def shutdown_background_jobs():
+    ingestion_queue.shutdown()
+    purge_queue.shutdown()
+
+
+@app.on_event("shutdown")
+async def close_redis_pool():
+    await redis_cache.async_close()
+
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    await async_engine.dispose()
+
+
 # rag = RAGModel()
 # print(rag.generate_response("Biết Messi không"))
 
 @app.get("/")
 def read_root():
-    return {"message": "Hello FastAPI"}
\ No newline at end of file
+    return {"message": "Hello FastAPI"}
+
+
+@app.get("/cache/stats")
+async def cache_stats(request: Request):
+    user = await authentication(request)
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return redis_cache.get_stats()
+
+
+@app.get("/db/pool-stats")
+async def pool_stats(request: Request):
+    user = await authentication(request)
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return {**get_pool_stats(), "background_tasks": background.stats()}
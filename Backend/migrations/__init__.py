@@ -0,0 +1,3 @@
+"""
+Các migration đánh số của database, chạy bằng config.migrations.run_migrations()
+"""
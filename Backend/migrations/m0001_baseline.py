@@ -0,0 +1,12 @@
+"""
+Baseline: tạo các bảng theo model hiện tại (bảng đã có thì bỏ qua)
+"""
+from config.database import Base
+from models import chat, company, facebook_page, field_config, knowledge_base, llm, tag, telegram_page, user, zalo  # noqa: F401
+
+VERSION = 1
+DESCRIPTION = "baseline schema (create_all)"
+
+
+def upgrade(conn):
+    Base.metadata.create_all(bind=conn)
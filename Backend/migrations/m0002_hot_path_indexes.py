@@ -0,0 +1,24 @@
+"""
+Index cho các access path nóng, build CONCURRENTLY để không khóa ghi trên bảng đang chạy
+"""
+from config.migrations import create_index_concurrently
+
+VERSION = 2
+DESCRIPTION = "hot-path indexes (messages, chat_sessions.name, customer_info, chat_session_tag)"
+TRANSACTIONAL = False
+
+INDEXES = [
+    # Lịch sử / get_latest_messages: WHERE chat_session_id ORDER BY created_at, id
+    ("ix_messages_session_created_id", "messages", "chat_session_id, created_at, id"),
+    # Dashboard, inbox: lọc / sắp theo thời gian
+    ("ix_messages_created_at", "messages", "created_at"),
+    # send_message_page_service tra session theo tên (F-/T-/Z-...)
+    ("ix_chat_sessions_name", "chat_sessions", "name"),
+    ("ix_customer_info_chat_session_id", "customer_info", "chat_session_id"),
+    ("ix_chat_session_tag_tag_id", "chat_session_tag", "tag_id"),
+]
+
+
+def upgrade(conn):
+    for name, table, columns in INDEXES:
+        create_index_concurrently(conn, name, table, columns)
@@ -0,0 +1,169 @@
+"""
+Bảng inbox_summary cho /chat/admin/history: tin cuối, số tin chưa đọc, tag của từng session.
+Trigger giữ bảng đúng với mọi đường ghi (buffer, ORM, xóa tin, đổi tag).
+"""
+from sqlalchemy import text
+
+from config.migrations import create_index_concurrently
+
+VERSION = 3
+DESCRIPTION = "inbox_summary table, triggers and backfill"
+# Tạo trigger khóa bảng messages trong thời gian ngắn; backfill chạy sau, không giữ khóa đó
+TRANSACTIONAL = False
+
+_TABLE = """
+CREATE TABLE IF NOT EXISTS inbox_summary (
+    chat_session_id INTEGER PRIMARY KEY REFERENCES chat_sessions(id) ON DELETE CASCADE,
+    last_message_id INTEGER,
+    last_sender_type VARCHAR,
+    last_sender_name VARCHAR,
+    last_content TEXT,
+    last_message_at TIMESTAMP,
+    unread_count INTEGER NOT NULL DEFAULT 0,
+    tag_ids INTEGER[] NOT NULL DEFAULT '{}',
+    updated_at TIMESTAMP DEFAULT now()
+)
+"""
+
+# Tin mới: thay tin cuối nếu mới hơn; customer +1 chưa đọc, admin trả lời thì về 0
+_ON_MESSAGE_INSERT = """
+CREATE OR REPLACE FUNCTION inbox_on_message_insert() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO inbox_summary AS s (
+        chat_session_id, last_message_id, last_sender_type, last_sender_name,
+        last_content, last_message_at, unread_count, updated_at
+    )
+    VALUES (
+        NEW.chat_session_id, NEW.id, NEW.sender_type, NEW.sender_name,
+        NEW.content, NEW.created_at, CASE WHEN NEW.sender_type = 'customer' THEN 1 ELSE 0 END, now()
+    )
+    ON CONFLICT (chat_session_id) DO UPDATE SET
+        last_message_id = CASE WHEN s.last_message_at IS NULL OR EXCLUDED.last_message_at >= s.last_message_at
+                               THEN EXCLUDED.last_message_id ELSE s.last_message_id END,
+        last_sender_type = CASE WHEN s.last_message_at IS NULL OR EXCLUDED.last_message_at >= s.last_message_at
+                                THEN EXCLUDED.last_sender_type ELSE s.last_sender_type END,
+        last_sender_name = CASE WHEN s.last_message_at IS NULL OR EXCLUDED.last_message_at >= s.last_message_at
+                                THEN EXCLUDED.last_sender_name ELSE s.last_sender_name END,
+        last_content = CASE WHEN s.last_message_at IS NULL OR EXCLUDED.last_message_at >= s.last_message_at
+                            THEN EXCLUDED.last_content ELSE s.last_content END,
+        last_message_at = GREATEST(s.last_message_at, EXCLUDED.last_message_at),
+        unread_count = CASE NEW.sender_type
+                           WHEN 'admin' THEN 0
+                           WHEN 'customer' THEN s.unread_count + 1
+                           ELSE s.unread_count END,
+        updated_at = now();
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+# Xóa tin (từng tin hay hàng loạt): tính lại tin cuối cho các session bị ảnh hưởng
+_ON_MESSAGE_DELETE = """
+CREATE OR REPLACE FUNCTION inbox_on_message_delete() RETURNS trigger AS $$
+BEGIN
+    UPDATE inbox_summary s SET
+        last_message_id = m.id,
+        last_sender_type = m.sender_type,
+        last_sender_name = m.sender_name,
+        last_content = m.content,
+        last_message_at = m.created_at,
+        updated_at = now()
+    FROM (SELECT DISTINCT chat_session_id FROM old_rows) AS affected
+    LEFT JOIN LATERAL (
+        SELECT id, sender_type, sender_name, content, created_at
+        FROM messages
+        WHERE chat_session_id = affected.chat_session_id
+        ORDER BY created_at DESC, id DESC
+        LIMIT 1
+    ) AS m ON true
+    WHERE s.chat_session_id = affected.chat_session_id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+# Đổi tag: ghi lại toàn bộ tag_ids của các session bị ảnh hưởng
+_REFRESH_TAGS = """
+CREATE OR REPLACE FUNCTION inbox_refresh_tags(session_ids INTEGER[]) RETURNS void AS $$
+    INSERT INTO inbox_summary AS s (chat_session_id, tag_ids, updated_at)
+    SELECT cs.id,
+           ARRAY(SELECT tag_id FROM chat_session_tag t WHERE t.chat_session_id = cs.id ORDER BY tag_id),
+           now()
+    FROM chat_sessions cs
+    WHERE cs.id = ANY(session_ids)
+    ON CONFLICT (chat_session_id) DO UPDATE SET tag_ids = EXCLUDED.tag_ids, updated_at = now();
+$$ LANGUAGE sql
+"""
+
+_ON_TAG_CHANGE = """
+CREATE OR REPLACE FUNCTION inbox_on_tag_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM inbox_refresh_tags(ARRAY(SELECT DISTINCT chat_session_id FROM new_rows));
+    ELSE
+        PERFORM inbox_refresh_tags(ARRAY(SELECT DISTINCT chat_session_id FROM old_rows));
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS inbox_message_insert ON messages",
+    """CREATE TRIGGER inbox_message_insert AFTER INSERT ON messages
+       FOR EACH ROW EXECUTE FUNCTION inbox_on_message_insert()""",
+    "DROP TRIGGER IF EXISTS inbox_message_delete ON messages",
+    """CREATE TRIGGER inbox_message_delete AFTER DELETE ON messages
+       REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION inbox_on_message_delete()""",
+    "DROP TRIGGER IF EXISTS inbox_tag_insert ON chat_session_tag",
+    """CREATE TRIGGER inbox_tag_insert AFTER INSERT ON chat_session_tag
+       REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION inbox_on_tag_change()""",
+    "DROP TRIGGER IF EXISTS inbox_tag_delete ON chat_session_tag",
+    """CREATE TRIGGER inbox_tag_delete AFTER DELETE ON chat_session_tag
+       REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION inbox_on_tag_change()""",
+]
+
+# Backfill: session nào trigger đã ghi trước thì giữ nguyên (dữ liệu đó mới hơn)
+_BACKFILL = [
+    """
+    INSERT INTO inbox_summary (
+        chat_session_id, last_message_id, last_sender_type, last_sender_name, last_content, last_message_at
+    )
+    SELECT DISTINCT ON (m.chat_session_id)
+        m.chat_session_id, m.id, m.sender_type, m.sender_name, m.content, m.created_at
+    FROM messages m
+    JOIN chat_sessions cs ON cs.id = m.chat_session_id
+    ORDER BY m.chat_session_id, m.created_at DESC, m.id DESC
+    ON CONFLICT (chat_session_id) DO NOTHING
+    """,
+    """
+    UPDATE inbox_summary s SET unread_count = (
+        SELECT count(*) FROM messages m
+        WHERE m.chat_session_id = s.chat_session_id
+          AND m.sender_type = 'customer'
+          AND m.created_at > COALESCE((
+              SELECT max(a.created_at) FROM messages a
+              WHERE a.chat_session_id = s.chat_session_id AND a.sender_type = 'admin'
+          ), '-infinity')
+    )
+    """,
+    """
+    UPDATE inbox_summary s SET tag_ids = t.tag_ids
+    FROM (
+        SELECT chat_session_id, array_agg(tag_id ORDER BY tag_id) AS tag_ids
+        FROM chat_session_tag GROUP BY chat_session_id
+    ) AS t
+    WHERE s.chat_session_id = t.chat_session_id
+    """,
+]
+
+
+def upgrade(conn):
+    conn.execute(text(_TABLE))
+    for sql in (_ON_MESSAGE_INSERT, _ON_MESSAGE_DELETE, _REFRESH_TAGS, _ON_TAG_CHANGE, *_TRIGGERS):
+        conn.execute(text(sql))
+    for sql in _BACKFILL:
+        conn.execute(text(sql))
+    create_index_concurrently(conn, "ix_inbox_summary_last_message", "inbox_summary",
+                              "last_message_at DESC, chat_session_id DESC")
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_inbox_summary_tag_ids ON inbox_summary USING gin (tag_ids)"))
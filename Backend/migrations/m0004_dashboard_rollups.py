@@ -0,0 +1,52 @@
+"""
+Bảng rollup cho dashboard: tin nhắn theo ngày / kênh, session hoạt động theo ngày, khách theo tháng
+"""
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+from services.dashboard_rollup_service import rebuild_rollups
+
+VERSION = 4
+DESCRIPTION = "dashboard rollup tables and backfill"
+
+_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS channel_daily_stats (
+        day DATE NOT NULL,
+        channel VARCHAR NOT NULL,
+        messages INTEGER NOT NULL DEFAULT 0,
+        customer_messages INTEGER NOT NULL DEFAULT 0,
+        bot_messages INTEGER NOT NULL DEFAULT 0,
+        staff_messages INTEGER NOT NULL DEFAULT 0,
+        customers INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT now(),
+        PRIMARY KEY (day, channel)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS channel_daily_sessions (
+        day DATE NOT NULL,
+        chat_session_id INTEGER NOT NULL,
+        channel VARCHAR NOT NULL,
+        PRIMARY KEY (day, chat_session_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS channel_monthly_customers (
+        month DATE NOT NULL,
+        channel VARCHAR NOT NULL,
+        customers INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT now(),
+        PRIMARY KEY (month, channel)
+    )
+    """,
+]
+
+
+def upgrade(conn):
+    for sql in _TABLES:
+        conn.execute(text(sql))
+    first = conn.execute(text("SELECT MIN(created_at)::date FROM messages")).scalar()
+    if first:
+        rebuild_rollups(conn, first, date.today() + timedelta(days=1))
@@ -0,0 +1,92 @@
+"""
+Chuyển messages sang bảng partition theo tháng (RANGE created_at).
+
+Copy toàn bộ dữ liệu trong một transaction, khóa ghi messages trong lúc copy
+(đọc vẫn chạy); tin nhắn đang chờ trong message buffer sẽ được ghi sau khi xong.
+"""
+from datetime import date
+
+from sqlalchemy import text
+
+from migrations.m0003_inbox_summary import _TRIGGERS as INBOX_TRIGGERS
+from services.message_archive_service import add_months, month_start
+
+VERSION = 5
+DESCRIPTION = "monthly range partitioning of messages + message_archives"
+
+_BEFORE_COPY = [
+    "LOCK TABLE messages IN EXCLUSIVE MODE",
+    "UPDATE messages SET created_at = now() WHERE created_at IS NULL",
+    """
+    CREATE TABLE messages_partitioned (
+        id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+        chat_session_id INTEGER REFERENCES chat_sessions(id),
+        sender_name VARCHAR,
+        sender_type VARCHAR,
+        image VARCHAR,
+        content TEXT,
+        created_at TIMESTAMP NOT NULL DEFAULT now(),
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at)
+    """,
+    # Tin có created_at ngoài mọi partition tháng (hoặc tin nạp lại từ archive) rơi vào đây
+    "CREATE TABLE messages_default PARTITION OF messages_partitioned DEFAULT",
+]
+
+_SWAP = [
+    "ALTER TABLE messages RENAME TO messages_legacy",
+    "ALTER TABLE messages_partitioned RENAME TO messages",
+    # Chuyển sequence sang bảng mới trước khi xóa bảng cũ (pg_get_serial_sequence vẫn trả đúng)
+    "ALTER SEQUENCE messages_id_seq OWNED BY messages.id",
+    "DROP TABLE messages_legacy",
+    "CREATE INDEX ix_messages_session_created_id ON messages (chat_session_id, created_at, id)",
+    "CREATE INDEX ix_messages_created_at ON messages (created_at)",
+    "CREATE INDEX ix_messages_id ON messages (id)",
+]
+
+_ARCHIVES = """
+CREATE TABLE IF NOT EXISTS message_archives (
+    id SERIAL PRIMARY KEY,
+    partition_name VARCHAR NOT NULL UNIQUE,
+    range_start DATE NOT NULL,
+    range_end DATE NOT NULL,
+    path VARCHAR NOT NULL,
+    row_count INTEGER NOT NULL,
+    session_ids INTEGER[] NOT NULL DEFAULT '{}',
+    archived_at TIMESTAMP NOT NULL DEFAULT now()
+)
+"""
+
+
+def _is_partitioned(conn) -> bool:
+    return bool(conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = 'messages'"
+    )).first())
+
+
+def upgrade(conn):
+    conn.execute(text(_ARCHIVES))
+    if _is_partitioned(conn):
+        return
+
+    for sql in _BEFORE_COPY:
+        conn.execute(text(sql))
+
+    first = conn.execute(text("SELECT MIN(created_at)::date FROM messages")).scalar() or date.today()
+    month, last = month_start(first), add_months(month_start(date.today()), 2)
+    while month <= last:
+        conn.execute(text(
+            f"CREATE TABLE messages_p{month:%Y%m} PARTITION OF messages_partitioned "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+        ))
+        month = add_months(month, 1)
+
+    conn.execute(text("""
+        INSERT INTO messages_partitioned (id, chat_session_id, sender_name, sender_type, image, content, created_at)
+        SELECT id, chat_session_id, sender_name, sender_type, image, content, created_at FROM messages
+    """))
+
+    for sql in _SWAP:
+        conn.execute(text(sql))
+    for sql in INBOX_TRIGGERS:
+        conn.execute(text(sql))
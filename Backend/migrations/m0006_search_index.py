@@ -0,0 +1,48 @@
+"""
+Tìm kiếm toàn văn cho admin: cấu hình text search bỏ dấu tiếng Việt (unaccent) + GIN index
+trên messages.content và customer_info.customer_data
+"""
+from sqlalchemy import text
+
+from config.migrations import create_index_concurrently, create_partitioned_index_concurrently
+
+VERSION = 6
+DESCRIPTION = "unaccent text search config + GIN full-text indexes"
+TRANSACTIONAL = False
+
+_SETUP = [
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    # simple (không stemming) + unaccent: "áo khoác" và "ao khoac" cho cùng lexeme
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'vn_unaccent') THEN
+            CREATE TEXT SEARCH CONFIGURATION vn_unaccent (COPY = simple);
+            ALTER TEXT SEARCH CONFIGURATION vn_unaccent
+                ALTER MAPPING FOR asciiword, asciihword, hword_asciipart, word, hword, hword_part
+                WITH unaccent, simple;
+        END IF;
+    END
+    $$
+    """,
+    # Chỉ lấy giá trị (không lấy key) của customer_data để index / highlight
+    """
+    CREATE OR REPLACE FUNCTION customer_search_text(data JSON) RETURNS TEXT AS $$
+        SELECT COALESCE(string_agg(value, ' '), '')
+        FROM json_each_text(CASE WHEN json_typeof(data) = 'object' THEN data ELSE '{}'::json END)
+    $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE
+    """,
+]
+
+
+def upgrade(conn):
+    for sql in _SETUP:
+        conn.execute(text(sql))
+    create_partitioned_index_concurrently(
+        conn, "ix_messages_content_fts", "messages",
+        "to_tsvector('vn_unaccent', COALESCE(content, ''))", using="gin",
+    )
+    create_index_concurrently(
+        conn, "ix_customer_info_fts", "customer_info",
+        "to_tsvector('vn_unaccent', customer_search_text(customer_data))", using="gin",
+    )
@@ -0,0 +1,53 @@
+"""
+Bảng campaigns / campaign_recipients cho gửi tin hàng loạt
+"""
+from sqlalchemy import text
+
+VERSION = 7
+DESCRIPTION = "campaigns and campaign_recipients"
+
+_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS campaigns (
+        id SERIAL PRIMARY KEY,
+        content TEXT,
+        image TEXT,
+        status VARCHAR NOT NULL DEFAULT 'running',
+        total INTEGER NOT NULL DEFAULT 0,
+        sent INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        skipped INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT now(),
+        finished_at TIMESTAMP,
+        heartbeat_at TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_campaigns_id ON campaigns (id)",
+    """
+    CREATE TABLE IF NOT EXISTS campaign_recipients (
+        id SERIAL PRIMARY KEY,
+        campaign_id INTEGER NOT NULL REFERENCES campaigns(id) ON DELETE CASCADE,
+        chat_session_id INTEGER NOT NULL REFERENCES chat_sessions(id) ON DELETE CASCADE,
+        message_id INTEGER,
+        channel VARCHAR,
+        recipient VARCHAR,
+        page_id VARCHAR,
+        status VARCHAR NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        sent_at TIMESTAMP
+    )
+    """,
+    # Xóa session cascade sang đây
+    "CREATE INDEX IF NOT EXISTS ix_campaign_recipients_chat_session_id ON campaign_recipients (chat_session_id)",
+    # Dispatcher chỉ đọc các dòng còn pending, theo id
+    """
+    CREATE INDEX IF NOT EXISTS ix_campaign_recipients_pending
+    ON campaign_recipients (campaign_id, id) WHERE status = 'pending'
+    """,
+]
+
+
+def upgrade(conn):
+    for sql in _TABLES:
+        conn.execute(text(sql))
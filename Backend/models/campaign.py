@@ -0,0 +1,39 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index, func
+from config.database import Base
+
+
+class Campaign(Base):
+    """Một lần gửi tin hàng loạt từ /chat/send_message"""
+    __tablename__ = "campaigns"
+    id = Column(Integer, primary_key=True, index=True)
+    content = Column(Text)
+    image = Column(Text)                       # JSON list URL ảnh, giống messages.image
+    status = Column(String, nullable=False, default="running", server_default="running")  # running / done / cancelled
+    total = Column(Integer, nullable=False, default=0, server_default="0")
+    sent = Column(Integer, nullable=False, default=0, server_default="0")
+    failed = Column(Integer, nullable=False, default=0, server_default="0")
+    skipped = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime, default=datetime.now, server_default=func.now())
+    finished_at = Column(DateTime)
+    # Worker đang gửi cập nhật định kỳ; quá hạn thì worker khác nhận tiếp
+    heartbeat_at = Column(DateTime)
+
+
+class CampaignRecipient(Base):
+    __tablename__ = "campaign_recipients"
+    id = Column(Integer, primary_key=True)
+    campaign_id = Column(Integer, ForeignKey("campaigns.id", ondelete="CASCADE"), nullable=False)
+    chat_session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=False, index=True)
+    message_id = Column(Integer)
+    channel = Column(String)
+    recipient = Column(String)                 # id người nhận trên platform (name bỏ prefix "F-", "T-", "Z-")
+    page_id = Column(String)
+    status = Column(String, nullable=False, default="pending", server_default="pending")  # pending / sent / failed / skipped / cancelled
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    error = Column(Text)
+    sent_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_campaign_recipients_pending", "campaign_id", "id", postgresql_where=(status == "pending")),
+    )
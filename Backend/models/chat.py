@@ -2,7 +2,8 @@ from sqlalchemy import JSON, Column, Integer, String, ForeignKey, Table, Text, D
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from config.database import Base
-from sqlalchemy import Column, Boolean
+from sqlalchemy import Column, Boolean, Index, func
+from sqlalchemy.dialects.postgresql import ARRAY
 
 # class ChatSession(Base):
 #     __tablename__ = "chat_sessions"
@@ -28,7 +29,7 @@ from sqlalchemy import Column, Boolean
 class ChatSessionTag(Base):
     __tablename__ = "chat_session_tag"
     chat_session_id = Column(Integer, ForeignKey("chat_sessions.id"), primary_key=True)
-    tag_id = Column(Integer, ForeignKey("tag.id"), primary_key=True)
+    tag_id = Column(Integer, ForeignKey("tag.id"), primary_key=True, index=True)
     
     chat_session = relationship("ChatSession", back_populates="chat_session_tags")
     tag = relationship("Tag", back_populates="chat_session_tags")
@@ -43,7 +44,7 @@ class ChatSession(Base):
     channel = Column(String, default="web")
     page_id = Column(String)
     url_channel = Column(String)
-    name = Column(String)
+    name = Column(String, index=True)
     current_receiver = Column(String, default="Bot")
     previous_receiver = Column(String)
     created_at = Column(DateTime, default=datetime.now)
@@ -62,15 +63,38 @@ class Message(Base):
     sender_type = Column(String)   # customer / bot / staff
     image = Column(String)
     content = Column(Text)
-    created_at = Column(DateTime, default=datetime.now) 
+    created_at = Column(DateTime, default=datetime.now, index=True) 
     sender_name = Column(String)
     session = relationship("ChatSession", back_populates="messages")
+
+    # Lịch sử theo session: keyset (created_at, id) và get_latest_messages
+    __table_args__ = (
+        Index("ix_messages_session_created_id", "chat_session_id", "created_at", "id"),
+    )
  
 class CustomerInfo(Base):
     __tablename__ = "customer_info"
     id = Column(Integer, primary_key=True, index=True)
-    chat_session_id = Column(Integer, ForeignKey("chat_sessions.id")) 
+    chat_session_id = Column(Integer, ForeignKey("chat_sessions.id"), index=True) 
     created_at = Column(DateTime, default=datetime.now)
     session = relationship("ChatSession", back_populates="customer_info")
     customer_data = Column(JSON, nullable=True, default={})
-     
\ No newline at end of file
+     
+
+class InboxSummary(Base):
+    """Một dòng / session cho inbox admin, trigger trong DB cập nhật khi ghi messages / chat_session_tag"""
+    __tablename__ = "inbox_summary"
+    chat_session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), primary_key=True)
+    last_message_id = Column(Integer)
+    last_sender_type = Column(String)
+    last_sender_name = Column(String)
+    last_content = Column(Text)
+    last_message_at = Column(DateTime)
+    unread_count = Column(Integer, nullable=False, default=0, server_default="0")
+    tag_ids = Column(ARRAY(Integer), nullable=False, default=list, server_default="{}")
+    updated_at = Column(DateTime, default=datetime.now, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_inbox_summary_last_message", last_message_at.desc(), chat_session_id.desc()),
+        Index("ix_inbox_summary_tag_ids", tag_ids, postgresql_using="gin"),
+    )
@@ -4,13 +4,16 @@ import json
 from models.field_config import FieldConfig
 from models.chat import CustomerInfo
 from sqlalchemy.orm import Session
-from config.database import SessionLocal, get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from config.database import SessionLocal, get_db, get_async_db
+from helper.background import background
 import asyncio
 router = APIRouter()
 from llm.llm import RAGModel
 from middleware.jwt import authentication_cookie, authentication
 import requests
 from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
 
 from config.websocket_manager import ConnectionManager
 
@@ -18,17 +21,26 @@ from controllers.chat_controller import (
     create_session_controller,
     handle_send_message,
     get_history_chat_controller,
+    count_history_chat_controller,
+    rehydrate_history_controller,
     chat_platform,
     get_all_history_chat_controller,
+    search_conversations_controller,
     update_chat_session_controller,
     customer_chat,
     admin_chat,
     delete_chat_session_controller,
     delete_message_controller,
+    get_purge_job_controller,
+    cancel_purge_job_controller,
     check_session_controller,
     update_tag_chat_session_controller,
     get_all_customer_controller,
+    export_customers_controller,
     sendMessage_controller,
+    get_campaign_controller,
+    list_campaigns_controller,
+    cancel_campaign_controller,
     get_dashboard_summary_controller,
 )
 
@@ -46,13 +58,27 @@ async def check_session(sessionId, db: Session = Depends(get_db)):
     return check_session_controller(sessionId, db)
 
 @router.get("/history/{chat_session_id}")
-def get_history_chat(
+async def get_history_chat(
     chat_session_id: int, 
+    response: Response,
     page: int = 1, 
     limit: int = 10, 
-    db: Session = Depends(get_db)
+    before_id: Optional[int] = Query(None, description="Lấy các tin trước tin này (cuộn lên)"),
+    after_id: Optional[int] = Query(None, description="Lấy các tin sau tin này (tin mới)"),
+    include_total: bool = Query(False, description="Trả tổng số tin qua header X-Total-Count"),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    return get_history_chat_controller(chat_session_id, page, limit, db)
+    if include_total:
+        response.headers["X-Total-Count"] = str(await count_history_chat_controller(chat_session_id, db))
+    return await get_history_chat_controller(chat_session_id, page, limit, db, before_id, after_id)
+
+@router.post("/history/{chat_session_id}/rehydrate")
+async def rehydrate_history(chat_session_id: int, request: Request):
+    """Nạp lại tin nhắn đã archive của session (admin)"""
+    user = await authentication(request)
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return await rehydrate_history_controller(chat_session_id)
 
 @router.put("/alert/{session_id}")
 def update_alert_status(session_id: int, alert_data: dict, db: Session = Depends(get_db)):
@@ -83,8 +109,34 @@ async def admin_ws(websocket: WebSocket, db: Session = Depends(get_db)):
     await admin_chat(websocket, user, db)
 
 @router.get("/admin/history")
-def get_history_chat(db: Session = Depends(get_db)):
-    return get_all_history_chat_controller(db)
+def get_history_chat(
+    page: Optional[int] = Query(None, ge=1, description="Trang (cần limit)"),
+    limit: Optional[int] = Query(None, ge=1, le=200, description="Số session mỗi trang, bỏ trống = tất cả"),
+    channel: Optional[str] = Query(None, description="Lọc theo channel"),
+    tag_id: Optional[int] = Query(None, description="Lọc theo tag"),
+    status: Optional[str] = Query(None, description="Lọc theo status (true = bot, false = admin)"),
+    alert: Optional[str] = Query(None, description="Lọc theo alert"),
+    db: Session = Depends(get_db)
+):
+    filters = {"page": page, "limit": limit, "channel": channel, "tag_id": tag_id, "status": status, "alert": alert}
+    return get_all_history_chat_controller(db, filters)
+
+@router.get("/admin/search")
+async def search_conversations(
+    request: Request,
+    q: str = Query(..., min_length=1, description="Từ khóa (có dấu hoặc không dấu, hỗ trợ \"cụm từ\" và -loại trừ)"),
+    limit: int = Query(20, ge=1, le=50),
+    cursor: Optional[str] = Query(None, description="next_cursor của trang trước"),
+    db: Session = Depends(get_db),
+):
+    """Tìm kiếm toàn văn trong tin nhắn và thông tin khách (admin)"""
+    user = await authentication(request)
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    try:
+        return await asyncio.to_thread(search_conversations_controller, q, limit, cursor, db)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/admin/count_by_channel")
 def count_messages_by_channel(db: Session = Depends(get_db)):
@@ -92,12 +144,35 @@ def count_messages_by_channel(db: Session = Depends(get_db)):
 
 @router.get("/admin/customers")
 def get_customer_chat(
+    response: Response,
     channel: Optional[str] = Query(None, description="Lọc theo channel"),
     tag_id: Optional[int] = Query(None, description="Lọc theo tag"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Số session mỗi trang, bỏ trống = tất cả"),
+    cursor: Optional[int] = Query(None, description="X-Next-Cursor của trang trước"),
     db: Session = Depends(get_db)
 ):
+    data = {"channel": channel, "tag_id": tag_id, "limit": limit, "cursor": cursor}
+    if not limit:
+        return get_all_customer_controller(data, db)
+    customers, next_cursor = get_all_customer_controller(data, db)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return customers
+
+@router.get("/admin/customers/export")
+def export_customers(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    channel: Optional[str] = Query(None, description="Lọc theo channel"),
+    tag_id: Optional[int] = Query(None, description="Lọc theo tag"),
+):
+    """Tải toàn bộ khách (NDJSON / CSV), ghi dần theo từng khối khi đọc từ DB"""
     data = {"channel": channel, "tag_id": tag_id}
-    return get_all_customer_controller(data, db)
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        export_customers_controller(data, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="customers.{format}"'},
+    )
 
     
 # FB
@@ -121,18 +196,16 @@ async def receive_message(request: Request):
     print("📨 Facebook webhook body:", body)
     
     
-    asyncio.create_task(process_facebook_message(body))
+    background.spawn_with_session(process_facebook_message, body)
     
     print("Đã trả về phản hồi 200 OK cho Facebook")
     
     return Response(status_code=200)
 
-async def process_facebook_message(body: dict):
+async def process_facebook_message(body: dict, db: Session):
     try:
-        db = SessionLocal()
         print("🔄 Bắt đầu xử lý tin nhắn Facebook...")
         await chat_platform("fb", body, db)
-        db.close()
         print("✅ Hoàn thành xử lý tin nhắn Facebook")
     except Exception as e:
         print(f"❌ Lỗi xử lý tin nhắn Facebook: {e}")
@@ -167,10 +240,11 @@ def send_zalo_message(user_id: str, message: str):
     
 # ZALO
 @router.post("/zalo/webhook") 
-async def zalo(request: Request, db: Session = Depends(get_db)): 
+async def zalo(request: Request): 
     data = await request.json()
     
-    asyncio.create_task(process_zalo_message(data, db))
+    # Request đóng session của nó ngay khi trả 200 -> task nền dùng session riêng
+    background.spawn_with_session(process_zalo_message, data)
     
     return Response(status_code=200)  
     
@@ -216,7 +290,29 @@ async def delete_messages(chatId: int, request: Request, db: Session = Depends(g
     ids = body.get("ids", [])          # danh sách id messages
     return delete_message_controller(chatId, ids, db)
 
+@router.get("/purge_jobs/{job_id}")
+def get_purge_job(job_id: str):
+    """Tiến độ job xóa session: sessions, messages, ETA"""
+    return get_purge_job_controller(job_id)
+
+@router.delete("/purge_jobs/{job_id}")
+def cancel_purge_job(job_id: str):
+    return cancel_purge_job_controller(job_id)
+
 @router.post("/send_message")
 async def send_message(request: Request, db: Session = Depends(get_db)):
     data = await request.json()
-    return await sendMessage_controller(data, db)
\ No newline at end of file
+    return await sendMessage_controller(data, db)
+
+@router.get("/campaigns")
+async def list_campaigns(limit: int = Query(20, ge=1, le=100)):
+    return await list_campaigns_controller(limit)
+
+@router.get("/campaigns/{campaign_id}")
+async def get_campaign(campaign_id: int):
+    """Tiến độ campaign: số đã gửi / lỗi / bỏ qua, lỗi gần nhất"""
+    return await get_campaign_controller(campaign_id)
+
+@router.delete("/campaigns/{campaign_id}")
+async def cancel_campaign(campaign_id: int):
+    return await cancel_campaign_controller(campaign_id)
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Query, Request, Depends
+from fastapi import APIRouter, Query, Request, Depends, File, Form, UploadFile
 from sqlalchemy.orm import Session
 from config.database import get_db
 from controllers import knowledge_base_controller
@@ -20,7 +20,7 @@ async def update_kb(kb_id: int, request: Request, db: Session = Depends(get_db))
     return knowledge_base_controller.update_kb_controller(kb_id, data, db)
 
 @router.get("/search")
-async def search_kb(query: str = Query(...), db: Session = Depends(get_db)):
+def search_kb(query: str = Query(...), db: Session = Depends(get_db)):
     return knowledge_base_controller.search_kb_controller(query, db)
 
 @router.post("/test-sheet")
@@ -36,4 +36,21 @@ async def test_sheet_processing(request: Request):
     if not sheet_id:
         return {"success": False, "message": "sheet_id is required"}
     
-    return knowledge_base_controller.test_sheet_processing_controller(sheet_id, kb_id)
\ No newline at end of file
+    return knowledge_base_controller.test_sheet_processing_controller(sheet_id, kb_id)
+
+@router.post("/upload")
+def upload_kb_file(file: UploadFile = File(...), kb_id: int = Form(1)):
+    """
+    Upload file CSV/XLSX làm nguồn knowledge base (không cần Google Sheet).
+    File được đọc từng hàng trong job nền, trả về job để theo dõi tiến độ.
+    """
+    return knowledge_base_controller.upload_kb_file_controller(file.file, file.filename, kb_id)
+
+@router.get("/jobs/{job_id}")
+def get_ingestion_job(job_id: str):
+    """Tiến độ job ingest: rows, embeddings, ETA"""
+    return knowledge_base_controller.get_ingestion_job_controller(job_id)
+
+@router.delete("/jobs/{job_id}")
+def cancel_ingestion_job(job_id: str):
+    return knowledge_base_controller.cancel_ingestion_job_controller(job_id)
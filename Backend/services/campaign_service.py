@@ -0,0 +1,512 @@
+"""
+Campaign Service - Gửi tin hàng loạt cho /chat/send_message
+
+- Tin nhắn của cả campaign được ghi bằng một câu INSERT (kèm danh sách người nhận).
+- Dispatcher gửi song song theo "lane" (platform + page / bot token), mỗi lane có giới hạn tốc độ
+  và số request đồng thời riêng; 429 / vượt quota thì cả lane tạm dừng rồi thử lại.
+- Tiến độ ghi theo lô vào campaign_recipients / campaigns; admin nhận một sự kiện tổng hợp mỗi lô.
+"""
+import asyncio
+import json
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import text
+
+from config.database import engine
+from config.redis_cache import redis_cache
+from config.save_base64_image import save_base64_image
+from helper.rate_limiter import RateLimiter
+
+# Số request / giây cho mỗi lane
+CAMPAIGN_RATES = {
+    "facebook": float(os.getenv("CAMPAIGN_RATE_FACEBOOK", 10)),
+    "telegram": float(os.getenv("CAMPAIGN_RATE_TELEGRAM", 25)),
+    "zalo": float(os.getenv("CAMPAIGN_RATE_ZALO", 5)),
+}
+CAMPAIGN_LANE_CONCURRENCY = int(os.getenv("CAMPAIGN_LANE_CONCURRENCY", 4))
+CAMPAIGN_SEND_WORKERS = int(os.getenv("CAMPAIGN_SEND_WORKERS", 16))
+CAMPAIGN_PAGE_SIZE = int(os.getenv("CAMPAIGN_PAGE_SIZE", 500))
+CAMPAIGN_FLUSH_SECONDS = float(os.getenv("CAMPAIGN_FLUSH_SECONDS", 2))
+CAMPAIGN_MAX_ATTEMPTS = int(os.getenv("CAMPAIGN_MAX_ATTEMPTS", 3))
+# Campaign "running" không có heartbeat quá chừng này giây -> worker khác nhận gửi tiếp
+CAMPAIGN_STALE_SECONDS = int(os.getenv("CAMPAIGN_STALE_SECONDS", 120))
+CAMPAIGN_RESUME_SECONDS = float(os.getenv("CAMPAIGN_RESUME_SECONDS", 60))
+# Số tin mỗi sự kiện "campaign_messages" gửi cho admin
+CAMPAIGN_NOTIFY_BATCH = int(os.getenv("CAMPAIGN_NOTIFY_BATCH", 500))
+PLATFORM_TIMEOUT = 15
+
+# Channel không nằm trong danh sách này thì tin vẫn được lưu nhưng không gửi (skipped)
+DISPATCH_CHANNELS = ["facebook", "telegram", "zalo", "web"]
+
+# Mã lỗi rate limit của Graph API
+_FACEBOOK_THROTTLE_CODES = {4, 17, 32, 613}
+
+_CREATE_CAMPAIGN = text("""
+    INSERT INTO campaigns (content, image, status, heartbeat_at)
+    VALUES (:content, :image, 'running', now())
+    RETURNING id
+""")
+
+# Một câu: tra session, ghi tin nhắn, ghi người nhận (session không tồn tại thì bỏ qua như trước)
+_INSERT_MESSAGES = text("""
+    WITH sessions AS (
+        SELECT id, name, channel, page_id, status FROM chat_sessions WHERE id = ANY(:ids)
+    ),
+    inserted AS (
+        INSERT INTO messages (chat_session_id, sender_type, content, image, created_at)
+        SELECT id, 'bot', :content, :image, :now FROM sessions
+        RETURNING id, chat_session_id
+    ),
+    recipients AS (
+        INSERT INTO campaign_recipients (campaign_id, chat_session_id, message_id, channel, recipient, page_id, status)
+        SELECT :campaign_id, s.id, i.id, s.channel, substr(s.name, 3), s.page_id,
+               CASE WHEN s.channel = ANY(:channels) THEN 'pending' ELSE 'skipped' END
+        FROM inserted i
+        JOIN sessions s ON s.id = i.chat_session_id
+        RETURNING chat_session_id, message_id, status
+    )
+    SELECT r.message_id AS id, r.chat_session_id, r.status AS delivery,
+           s.name AS session_name, s.status AS session_status
+    FROM recipients r
+    JOIN sessions s ON s.id = r.chat_session_id
+    ORDER BY r.message_id
+""")
+
+_PENDING_PAGE = text("""
+    SELECT r.id, r.chat_session_id, r.message_id, r.channel, r.recipient, r.page_id,
+           s.name AS session_name, s.status AS session_status
+    FROM campaign_recipients r
+    JOIN chat_sessions s ON s.id = r.chat_session_id
+    WHERE r.campaign_id = :campaign_id AND r.status = 'pending' AND r.id > :after
+    ORDER BY r.id
+    LIMIT :limit
+""")
+
+# Ghi kết quả một lô + cộng dồn bộ đếm + heartbeat trong một câu
+_WRITE_PROGRESS = text("""
+    WITH updated AS (
+        UPDATE campaign_recipients r SET
+            status = u.status,
+            error = u.error,
+            attempts = u.attempts,
+            sent_at = CASE WHEN u.status = 'sent' THEN now() END
+        FROM unnest(
+            CAST(:ids AS INTEGER[]), CAST(:statuses AS VARCHAR[]),
+            CAST(:errors AS TEXT[]), CAST(:attempts AS INTEGER[])
+        ) AS u(id, status, error, attempts)
+        WHERE r.id = u.id AND r.status = 'pending'
+        RETURNING r.status
+    )
+    UPDATE campaigns c SET
+        sent = c.sent + (SELECT COUNT(*) FROM updated WHERE status = 'sent'),
+        failed = c.failed + (SELECT COUNT(*) FROM updated WHERE status = 'failed'),
+        heartbeat_at = now(),
+        status = CASE WHEN :final AND c.status = 'running' THEN 'done' ELSE c.status END,
+        finished_at = CASE WHEN :final AND c.status = 'running' THEN now() ELSE c.finished_at END
+    WHERE c.id = :campaign_id
+    RETURNING c.id, c.status, c.total, c.sent, c.failed, c.skipped
+""")
+
+_CLAIM_STALE = text("""
+    UPDATE campaigns SET heartbeat_at = now()
+    WHERE id IN (
+        SELECT id FROM campaigns
+        WHERE status = 'running'
+          AND (heartbeat_at IS NULL OR heartbeat_at < now() - make_interval(secs => :stale))
+        ORDER BY id
+        LIMIT 10
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id
+""")
+
+
+# ---------- Tạo / xem / hủy campaign ----------
+def create_campaign(data: dict, content: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Lưu ảnh một lần, ghi campaign + toàn bộ tin nhắn trong một transaction"""
+    image_url = []
+    if data.get("image"):
+        try:
+            image_url = save_base64_image(data.get("image"))
+        except Exception as e:
+            print("Error saving images:", e)
+            traceback.print_exc()
+    image = json.dumps(image_url) if image_url else None
+    ids = list(dict.fromkeys(int(i) for i in data.get("customers", []) or []))
+
+    with engine.begin() as conn:
+        campaign_id = conn.execute(_CREATE_CAMPAIGN, {"content": content, "image": image}).scalar()
+        rows = conn.execute(_INSERT_MESSAGES, {
+            "ids": ids, "content": content, "image": image, "now": datetime.now(),
+            "campaign_id": campaign_id, "channels": DISPATCH_CHANNELS,
+        }).fetchall()
+        skipped = sum(1 for row in rows if row.delivery == "skipped")
+        conn.execute(
+            text("UPDATE campaigns SET total = :total, skipped = :skipped WHERE id = :id"),
+            {"total": len(rows), "skipped": skipped, "id": campaign_id},
+        )
+
+    if rows:
+        redis_cache.delete_many(*[f"history_count:{row.chat_session_id}" for row in rows])
+
+    messages = [{
+        "id": row.id,
+        "chat_session_id": row.chat_session_id,
+        "sender_type": "bot",
+        "sender_name": None,
+        "content": content,
+        "image": image_url,
+        "session_name": row.session_name,
+        "session_status": row.session_status,
+    } for row in rows]
+    campaign = {"id": campaign_id, "status": "running", "total": len(rows), "sent": 0, "failed": 0, "skipped": skipped}
+    return campaign, messages
+
+
+def get_campaign(campaign_id: int) -> Optional[Dict[str, Any]]:
+    with engine.connect() as conn:
+        row = conn.execute(text("""
+            SELECT id, content, status, total, sent, failed, skipped, created_at, finished_at, heartbeat_at
+            FROM campaigns WHERE id = :id
+        """), {"id": campaign_id}).first()
+        if not row:
+            return None
+        by_status = dict(conn.execute(text("""
+            SELECT status, COUNT(*) FROM campaign_recipients WHERE campaign_id = :id GROUP BY status
+        """), {"id": campaign_id}).fetchall())
+        errors = conn.execute(text("""
+            SELECT chat_session_id, channel, error FROM campaign_recipients
+            WHERE campaign_id = :id AND status = 'failed'
+            ORDER BY id DESC LIMIT 20
+        """), {"id": campaign_id}).fetchall()
+    campaign = dict(row._mapping)
+    campaign["recipients"] = by_status
+    campaign["pending"] = by_status.get("pending", 0)
+    campaign["recent_errors"] = [dict(e._mapping) for e in errors]
+    return campaign
+
+
+def list_campaigns(limit: int = 20) -> List[Dict[str, Any]]:
+    with engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT id, content, status, total, sent, failed, skipped, created_at, finished_at
+            FROM campaigns ORDER BY id DESC LIMIT :limit
+        """), {"limit": limit}).fetchall()
+    return [dict(row._mapping) for row in rows]
+
+
+def cancel_campaign(campaign_id: int) -> bool:
+    """Dừng campaign đang gửi; người nhận chưa gửi chuyển sang cancelled"""
+    with engine.begin() as conn:
+        row = conn.execute(text("""
+            UPDATE campaigns SET status = 'cancelled', finished_at = now()
+            WHERE id = :id AND status = 'running' RETURNING id
+        """), {"id": campaign_id}).first()
+        if row:
+            conn.execute(text("""
+                UPDATE campaign_recipients SET status = 'cancelled'
+                WHERE campaign_id = :id AND status = 'pending'
+            """), {"id": campaign_id})
+    return bool(row)
+
+
+# ---------- Gửi platform (chạy trong thread pool) ----------
+class _Throttled(Exception):
+    """Platform báo vượt giới hạn; `retry_after` giây sau mới gửi tiếp"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"throttled {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _check(response: requests.Response, channel: str):
+    try:
+        body = response.json()
+    except ValueError:
+        body = {}
+    if response.status_code == 429:
+        retry_after = response.headers.get("Retry-After") or body.get("parameters", {}).get("retry_after") or 5
+        raise _Throttled(float(retry_after))
+    if channel == "facebook" and response.status_code >= 400:
+        if body.get("error", {}).get("code") in _FACEBOOK_THROTTLE_CODES:
+            raise _Throttled(60)
+    if response.status_code >= 400:
+        raise RuntimeError(f"{channel} {response.status_code}: {response.text[:300]}")
+    # Zalo trả 200 kèm mã lỗi trong body
+    if channel == "zalo" and body.get("error", 0) != 0:
+        raise RuntimeError(f"zalo {body.get('error')}: {body.get('message')}")
+
+
+def _send_facebook(http, token, page_id, recipient, content, images):
+    for url in images:
+        payload = {"recipient": {"id": recipient},
+                   "message": {"attachment": {"type": "image", "payload": {"url": url, "is_reusable": True}}}}
+        _check(http.post("https://graph.facebook.com/v23.0/me/messages",
+                         params={"access_token": token}, json=payload, timeout=PLATFORM_TIMEOUT), "facebook")
+    if content:
+        payload = {"recipient": {"id": recipient}, "message": {"text": content}}
+        _check(http.post(f"https://graph.facebook.com/v23.0/{page_id}/messages",
+                         params={"access_token": token}, json=payload, timeout=PLATFORM_TIMEOUT), "facebook")
+
+
+def _send_telegram(http, token, page_id, recipient, content, images):
+    for url in images:
+        _check(http.post(f"https://api.telegram.org/bot{token}/sendPhoto",
+                         json={"chat_id": recipient, "photo": url}, timeout=PLATFORM_TIMEOUT), "telegram")
+    if content:
+        _check(http.post(f"https://api.telegram.org/bot{token}/sendMessage",
+                         json={"chat_id": recipient, "text": content}, timeout=PLATFORM_TIMEOUT), "telegram")
+
+
+def _send_zalo(http, token, page_id, recipient, content, images):
+    message = {"text": content}
+    if images:
+        # Zalo chỉ nhận 1 ảnh / tin
+        message["attachment"] = {"type": "template", "payload": {
+            "template_type": "media", "elements": [{"media_type": "image", "url": images[0]}],
+        }}
+    _check(http.post("https://openapi.zalo.me/v3.0/oa/message/cs", headers={"access_token": token},
+                     json={"recipient": {"user_id": recipient}, "message": message},
+                     timeout=PLATFORM_TIMEOUT), "zalo")
+
+
+_SENDERS = {"facebook": _send_facebook, "telegram": _send_telegram, "zalo": _send_zalo}
+
+
+def _load_tokens() -> Dict[str, Any]:
+    with engine.connect() as conn:
+        return {
+            "facebook": dict(conn.execute(text("SELECT page_id, access_token FROM facebook_pages")).fetchall()),
+            "telegram": conn.execute(text("SELECT bot_token FROM telegram_bot WHERE id = 1")).scalar(),
+            "zalo": conn.execute(text("SELECT access_token FROM zalo_bot WHERE id = 1")).scalar(),
+        }
+
+
+def _load_campaign(campaign_id: int):
+    with engine.connect() as conn:
+        return conn.execute(
+            text("SELECT id, content, image, status FROM campaigns WHERE id = :id"), {"id": campaign_id}
+        ).first()
+
+
+def _pending_page(campaign_id: int, after: int) -> List[Any]:
+    with engine.connect() as conn:
+        return conn.execute(_PENDING_PAGE, {"campaign_id": campaign_id, "after": after,
+                                            "limit": CAMPAIGN_PAGE_SIZE}).fetchall()
+
+
+def _write_progress(campaign_id: int, results: List[Tuple], final: bool) -> Optional[Dict[str, Any]]:
+    ids, statuses, errors, attempts = (list(column) for column in zip(*results)) if results else ([], [], [], [])
+    with engine.begin() as conn:
+        row = conn.execute(_WRITE_PROGRESS, {
+            "campaign_id": campaign_id, "ids": ids, "statuses": statuses,
+            "errors": errors, "attempts": attempts, "final": final,
+        }).first()
+    return dict(row._mapping) if row else None
+
+
+def _claim_stale_campaigns() -> List[int]:
+    with engine.begin() as conn:
+        return conn.execute(_CLAIM_STALE, {"stale": CAMPAIGN_STALE_SECONDS}).scalars().all()
+
+
+class _Lane:
+    """Một platform + token: giới hạn tốc độ, số request đồng thời và connection pool riêng"""
+
+    def __init__(self, channel: str, token: str, page_id: Optional[str] = None):
+        self.channel = channel
+        self.token = token
+        self.page_id = page_id
+        self.limiter = RateLimiter(CAMPAIGN_RATES[channel])
+        self.semaphore = asyncio.Semaphore(CAMPAIGN_LANE_CONCURRENCY)
+        self.http = requests.Session()
+        self.http.mount("https://", HTTPAdapter(pool_maxsize=CAMPAIGN_LANE_CONCURRENCY))
+
+    def send(self, recipient: str, content: str, images: List[str]):
+        _SENDERS[self.channel](self.http, self.token, self.page_id, recipient, content, images)
+
+
+class _Progress:
+    """Kết quả chờ ghi xuống DB theo lô"""
+
+    def __init__(self, campaign_id: int):
+        self.campaign_id = campaign_id
+        self.results: List[Tuple] = []
+        self.cancelled = False
+
+    def add(self, recipient_id: int, status: str, error: Optional[str], attempts: int):
+        self.results.append((recipient_id, status, error, attempts))
+
+    def take(self) -> List[Tuple]:
+        results, self.results = self.results, []
+        return results
+
+
+class CampaignDispatcher:
+    """
+    Chạy các campaign trên event loop của worker hiện tại.
+    Worker tắt giữa chừng: campaign vẫn "running", heartbeat quá hạn thì worker khác nhận gửi tiếp
+    (tin đã gửi nhưng chưa kịp ghi kết quả có thể bị gửi lại).
+    """
+
+    def __init__(self):
+        self.manager = None
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._resume_task: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=CAMPAIGN_SEND_WORKERS, thread_name_prefix="campaign")
+
+    def start(self, manager=None):
+        self.manager = manager
+        if self._resume_task is None:
+            self._resume_task = asyncio.create_task(self._resume_loop())
+
+    async def stop(self):
+        tasks = [t for t in (self._resume_task, *self._tasks.values()) if t]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._resume_task = None
+        self._tasks.clear()
+        self._executor.shutdown(wait=False)
+
+    def dispatch(self, campaign_id: int):
+        if campaign_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run_campaign(campaign_id))
+        self._tasks[campaign_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(campaign_id, None))
+
+    async def _resume_loop(self):
+        while True:
+            try:
+                for campaign_id in await asyncio.to_thread(_claim_stale_campaigns):
+                    print(f"📣 Tiếp tục gửi campaign {campaign_id}")
+                    self.dispatch(campaign_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Lỗi nhận campaign dở dang: {e}")
+                traceback.print_exc()
+            await asyncio.sleep(CAMPAIGN_RESUME_SECONDS)
+
+    async def _notify_admins(self, summary: Optional[Dict[str, Any]]):
+        if self.manager and summary:
+            try:
+                await self.manager.broadcast_to_admins({"type": "campaign_progress", **summary})
+            except Exception as e:
+                print(f"⚠️ Lỗi gửi tiến độ campaign cho admin: {e}")
+
+    async def _flush(self, progress: _Progress, final: bool = False):
+        summary = await asyncio.to_thread(_write_progress, progress.campaign_id, progress.take(), final)
+        if summary and summary["status"] == "cancelled":
+            progress.cancelled = True
+        await self._notify_admins(summary)
+
+    async def _flush_loop(self, progress: _Progress):
+        while True:
+            await asyncio.sleep(CAMPAIGN_FLUSH_SECONDS)
+            try:
+                await self._flush(progress)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Lỗi ghi tiến độ campaign {progress.campaign_id}: {e}")
+                traceback.print_exc()
+
+    async def _run_campaign(self, campaign_id: int):
+        campaign = await asyncio.to_thread(_load_campaign, campaign_id)
+        if not campaign or campaign.status != "running":
+            return
+        tokens = await asyncio.to_thread(_load_tokens)
+        images = json.loads(campaign.image) if campaign.image else []
+        lanes: Dict[Tuple, Optional[_Lane]] = {}
+        progress = _Progress(campaign_id)
+        flusher = asyncio.create_task(self._flush_loop(progress))
+        finished = False
+        try:
+            after = 0
+            while not progress.cancelled:
+                rows = await asyncio.to_thread(_pending_page, campaign_id, after)
+                if not rows:
+                    finished = True
+                    break
+                after = rows[-1].id
+                await asyncio.gather(*(
+                    self._deliver(self._lane(lanes, tokens, row), row, campaign.content, images, progress)
+                    for row in rows
+                ))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Lỗi gửi campaign {campaign_id}: {e}")
+            traceback.print_exc()
+        finally:
+            flusher.cancel()
+            try:
+                await self._flush(progress, final=finished and not progress.cancelled)
+            except Exception as e:
+                print(f"❌ Lỗi ghi tiến độ campaign {campaign_id}: {e}")
+            for lane in lanes.values():
+                if lane:
+                    lane.http.close()
+
+    @staticmethod
+    def _lane(lanes: Dict[Tuple, Optional[_Lane]], tokens: Dict[str, Any], row) -> Optional[_Lane]:
+        if row.channel == "web":
+            return None
+        key = (row.channel, row.page_id if row.channel == "facebook" else None)
+        if key not in lanes:
+            token = tokens["facebook"].get(row.page_id) if row.channel == "facebook" else tokens.get(row.channel)
+            lanes[key] = _Lane(row.channel, token, row.page_id) if token else None
+        return lanes[key]
+
+    async def _deliver(self, lane: Optional[_Lane], row, content: str, images: List[str], progress: _Progress):
+        if progress.cancelled:
+            return
+        if row.channel == "web":
+            # Khách web nhận qua websocket (không có thì xem tin trong lịch sử khi mở lại)
+            if self.manager:
+                await self.manager.send_to_customer(row.chat_session_id, {
+                    "id": row.message_id,
+                    "chat_session_id": row.chat_session_id,
+                    "sender_type": "bot",
+                    "sender_name": None,
+                    "content": content,
+                    "image": images,
+                    "session_name": row.session_name,
+                    "session_status": row.session_status,
+                })
+            progress.add(row.id, "sent", None, 1)
+            return
+        if lane is None:
+            progress.add(row.id, "failed", f"Không có token {row.channel} cho page {row.page_id}", 0)
+            return
+
+        error = None
+        async with lane.semaphore:
+            for attempt in range(1, CAMPAIGN_MAX_ATTEMPTS + 1):
+                if progress.cancelled:
+                    return
+                await lane.limiter.acquire()
+                try:
+                    await asyncio.get_running_loop().run_in_executor(
+                        self._executor, lane.send, row.recipient, content, images
+                    )
+                    progress.add(row.id, "sent", None, attempt)
+                    return
+                except _Throttled as e:
+                    lane.limiter.pause(e.retry_after)
+                    error = str(e)
+                except Exception as e:
+                    progress.add(row.id, "failed", str(e)[:500], attempt)
+                    return
+        progress.add(row.id, "failed", error, CAMPAIGN_MAX_ATTEMPTS)
+
+
+campaign_dispatcher = CampaignDispatcher()
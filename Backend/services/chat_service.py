@@ -1,7 +1,9 @@
+import os
 import random
 import asyncio
 import base64
 import io
+import csv
 from typing import Any, Dict
 from sqlalchemy.orm import Session
 from helper.linkdrive import normalize_drive_links
@@ -9,8 +11,8 @@ from models.chat import ChatSession, Message, CustomerInfo
 from models.facebook_page import FacebookPage
 from models.telegram_page import TelegramBot
 from models.zalo import ZaloBot 
-from config.database import SessionLocal
-from sqlalchemy import text
+from config.database import SessionLocal, AsyncSessionLocal, background_engine
+from sqlalchemy import func, select, text, tuple_
 from llm.llm import RAGModel
 from datetime import datetime, timedelta
 from fastapi import WebSocket
@@ -19,8 +21,14 @@ import json
 import requests
 import traceback
 from config.save_base64_image import save_base64_image
-from config.redis_cache import cache_get, cache_set, cache_delete
+from config.session_cache import SessionLookup, session_cache
+from helper.handover_scheduler import sync_handover
 from helper.task import save_message_to_db_async, update_session_admin_async
+from helper.background import background
+from config.id_allocator import allocate_message_id
+from config.redis_cache import redis_cache
+from services.dashboard_rollup_service import get_dashboard_rollups
+from services.purge_service import delete_messages_now, delete_sessions_now
 import time
 
 def create_session_service(db):
@@ -93,39 +101,9 @@ def send_message_service(data: dict, user, db):
     
     response_messages = []  
     
-    # Cache session với Redis
+    # Session từ cache (miss -> nạp từ database)
     chat_session_id = data.get("chat_session_id")
-    session_cache_key = f"session:{chat_session_id}"
-    
-    # Kiểm tra cache trước
-    cached_session = cache_get(session_cache_key)
-    if cached_session:
-        # Tạo session object từ cache
-        session = ChatSession(
-            id=cached_session['id'],
-            name=cached_session['name'],
-            status=cached_session['status'],
-            channel=cached_session['channel'],
-            page_id=cached_session.get('page_id'),
-            current_receiver=cached_session.get('current_receiver'),
-            previous_receiver=cached_session.get('previous_receiver'),
-            time=datetime.fromisoformat(cached_session['time']) if cached_session.get('time') else None
-        )
-    else:
-        # Lấy từ database và cache lại
-        session = db.query(ChatSession).filter(ChatSession.id == chat_session_id).first()
-        if session:
-            session_data = {
-                'id': session.id,
-                'name': session.name,
-                'status': session.status,
-                'channel': session.channel,
-                'page_id': session.page_id,
-                'current_receiver': session.current_receiver,
-                'previous_receiver': session.previous_receiver,
-                'time': session.time.isoformat() if session.time else None
-            }
-            cache_set(session_cache_key, session_data, ttl=300)  # Cache 5 phút
+    session = session_cache.get(chat_session_id, db)
     
     
     
@@ -150,21 +128,9 @@ def send_message_service(data: dict, user, db):
         
         db.commit()
         
-        # Cập nhật cache
-        session_data = {
-            'id': db_session.id,
-            'name': db_session.name,
-            'status': db_session.status,
-            'channel': db_session.channel,
-            'page_id': db_session.page_id,
-            'current_receiver': db_session.current_receiver,
-            'previous_receiver': db_session.previous_receiver,
-            'time': db_session.time.isoformat() if db_session.time else None
-        }
-        cache_set(session_cache_key, session_data, ttl=300)
-        
-        # Cập nhật session object cho response
-        session = db_session
+        # Ghi xuyên cache + hẹn giờ trả session cho bot
+        session = session_cache.put(db_session)
+        sync_handover(db_session)
         
         response_messages[0] = {
             "id": message.id,
@@ -255,86 +221,70 @@ async def send_message_fast_service(data: dict, user, db):
             print("❌ Error saving images:", e) 
             traceback.print_exc()
     
-    session_data = None
     response_messages = []
-    # Lấy session từ cache hoặc database  
-    session_cache_key = f"session:{chat_session_id}"
-    cached_session = cache_get(session_cache_key)
+    # Lấy session + quyền trả lời từ cache trong một round trip, miss thì nạp từ database
+    lookup = await session_cache.async_lookup(session_id=chat_session_id)
+    session = lookup.state or await session_cache.async_load(chat_session_id)
     
-    if not cached_session :
-        
-        session = db.query(ChatSession).filter(ChatSession.id == chat_session_id).first()
-        
-        session_data = {
-            'id': session.id,
-            'name': session.name,
-            'status': session.status,
-            'channel': session.channel,
-            'page_id': session.page_id,
-            'current_receiver': session.current_receiver,
-            'previous_receiver': session.previous_receiver,
-            'time': session.time.isoformat() if session.time else None
-        }
-        
-        cache_set(session_cache_key, session_data, ttl=300)
-        
-
-            
-    
-    else:
-        session_data  = cached_session
+    # Cấp id thật trước khi lưu -> tin broadcast đi đã có id cuối cùng
+    message_id = await allocate_message_id()
         
     user_message = {
-        "id": None,
+        "id": message_id,
         "chat_session_id": chat_session_id,
         "sender_type": data.get("sender_type"),
         "sender_name": sender_name,
         "content": data.get("content"),
         "image": image_url,
-        "session_name": session_data["name"],
-        "session_status": session_data["status"]
+        "session_name": session.name,
+        "session_status": session.status
     }
     
     response_messages.append(user_message)
     
     # Lưu tin nhắn vào database
-    task1 = asyncio.create_task(save_message_to_db_async(data, sender_name, image_url, db))
+    background.spawn(save_message_to_db_async({**data, "id": message_id}, sender_name, image_url))
     
     # Xử lý admin message
     if data.get("sender_type") == "admin":
         # Cập nhật session status
-        task2 = asyncio.create_task(update_session_admin_async(chat_session_id, sender_name, db))
+        background.spawn(update_session_admin_async(chat_session_id, sender_name))
         
         response_messages[0] = {
-            "id": None,
+            "id": message_id,
             "chat_session_id": chat_session_id,
             "sender_type": data.get("sender_type"),
             "sender_name": sender_name,
             "content": data.get("content"),
             "image": image_url,
-            "session_name": session_data["name"],
+            "session_name": session.name,
             "session_status": "false",
             "current_receiver": sender_name,
-            "previous_receiver": session_data["previous_receiver"],
+            "previous_receiver": session.previous_receiver,
             "time": (datetime.now() + timedelta(hours=1)).isoformat()
         }
 
         
-        name_to_send = session_data["name"][2:]
+        name_to_send = session.name[2:]
             
-        if session_data["channel"] == "facebook":
-            send_fb(session_data["page_id"], name_to_send, response_messages[0], data.get("image"), db)
-        elif session_data["channel"] == "telegram":
-            send_telegram(name_to_send, response_messages[0], db)
-        elif session_data["channel"] == "zalo":
-            send_zalo(name_to_send, response_messages[0], data.get("image"), db)
+        if session.channel == "facebook":
+            await asyncio.to_thread(send_fb, session.page_id, name_to_send, response_messages[0], data.get("image"), db)
+        elif session.channel == "telegram":
+            await asyncio.to_thread(send_telegram, name_to_send, response_messages[0], db)
+        elif session.channel == "zalo":
+            await asyncio.to_thread(send_zalo, name_to_send, response_messages[0], data.get("image"), db)
             
         return response_messages
     
     # Xử lý bot reply
-    elif check_repply_cached(chat_session_id, db):
+    elif await check_repply_cached_async(chat_session_id, db, lookup):
         rag = RAGModel(db_session=db)
-        bot_response = rag.generate_response(data.get("content"), session_data["id"])
+        history, search_history = await rag.async_get_recent_histories(session.id)
+        field_configs = await rag.async_get_field_configs()
+        # Embedding (cache Redis sync), vector search và LLM đều chặn -> chạy ngoài event loop
+        bot_response = await asyncio.to_thread(
+            rag.generate_response, data.get("content"), session.id, history, search_history, field_configs
+        )
         
         print(f"Bot response: {bot_response}")
         
@@ -349,27 +299,29 @@ async def send_message_fast_service(data: dict, user, db):
             bot_links = []
             
         bot_links = normalize_drive_links(bot_links)
+        bot_message_id = await allocate_message_id()
         response_messages.append({
-            "id": None,
+            "id": bot_message_id,
             "chat_session_id": chat_session_id,
             "sender_type": "bot",
             "sender_name": sender_name,
             "content": bot_text,
             "image": bot_links,
-            "session_name": session_data["name"],
-            "session_status": session_data["status"],
-            "current_receiver": session_data["current_receiver"],
-            "previous_receiver": session_data["previous_receiver"]
+            "session_name": session.name,
+            "session_status": session.status,
+            "current_receiver": session.current_receiver,
+            "previous_receiver": session.previous_receiver
         })
         
         # Lưu tin nhắn bot vào database
         bot_data = {
+            "id": bot_message_id,
             "chat_session_id": chat_session_id,
             "sender_type": "bot",
             "content": bot_text,
             "image" : bot_links
         }
-        task3 = asyncio.create_task(save_message_to_db_async(bot_data, None, bot_links, db))
+        background.spawn(save_message_to_db_async(bot_data, None, bot_links))
         
     
     return response_messages
@@ -392,10 +344,25 @@ async def send_to_platform_async(session, data, sender_name, db: Session):
     except Exception as e:
         print(f"❌ Lỗi gửi tin nhắn platform: {e}")
 
+def _save_bot_message(chat_session_id: int, bot_text: str, db: Session):
+    """Lưu tin bot bằng session sync (gọi qua asyncio.to_thread)"""
+    message_bot = Message(
+        chat_session_id=chat_session_id,
+        sender_type="bot",
+        content=bot_text
+    )
+    db.add(message_bot)
+    db.commit()
+    db.refresh(message_bot)
+    return message_bot
+
 async def generate_and_send_bot_response_async(data: dict, chat_session_id: int, session, db: Session):
     try:
         rag = RAGModel(db_session=db)
-        bot_response = rag.generate_response(data.get("content"), session.id)
+        field_configs = await rag.async_get_field_configs()
+        bot_response = await asyncio.to_thread(
+            rag.generate_response, data.get("content"), session.id, field_configs=field_configs
+        )
         
         # Xử lý response - có thể là dict hoặc string (fallback)
         if isinstance(bot_response, dict):
@@ -405,14 +372,7 @@ async def generate_and_send_bot_response_async(data: dict, chat_session_id: int,
             bot_text = str(bot_response)
             bot_links = []
         
-        message_bot = Message(
-            chat_session_id=chat_session_id,
-            sender_type="bot",
-            content=bot_text
-        )
-        db.add(message_bot)
-        db.commit()
-        db.refresh(message_bot)
+        message_bot = await asyncio.to_thread(_save_bot_message, chat_session_id, bot_text, db)
         
         # Tạo bot message để gửi qua websocket
         bot_message = {
@@ -441,38 +401,95 @@ async def generate_and_send_bot_response_async(data: dict, chat_session_id: int,
     except Exception as e:
         print(f"❌ Lỗi tạo bot response: {e}")
         traceback.print_exc()
-        db.rollback()
+        await asyncio.to_thread(db.rollback)
 
-def get_history_chat_service(chat_session_id: int, page: int = 1, limit: int = 10, db=None):
-    offset = (page - 1) * limit
-    
-    total_messages = (
-        db.query(Message)
-        .filter(Message.chat_session_id == chat_session_id)
-        .count()
-    )
+HISTORY_COUNT_TTL = int(os.getenv("HISTORY_COUNT_TTL", 30))
 
-    messages = (
-        db.query(Message)
-        .filter(Message.chat_session_id == chat_session_id)
-        .order_by(Message.created_at.desc())
-        .offset(offset)
-        .limit(limit)
-        .all()
-    )
-    
-    messages = list(reversed(messages))
-    
-    for msg in messages:
-        try:
-            msg.image = json.loads(msg.image) if msg.image else []
-        except Exception:
-            msg.image = []
+# Chỉ lấy các cột cần trả về, không dựng object ORM
+_HISTORY_COLUMNS = (
+    Message.id, Message.chat_session_id, Message.sender_type, Message.sender_name,
+    Message.content, Message.image, Message.created_at,
+)
 
-    return messages
-def get_all_history_chat_service(db):
+
+def _history_row(row) -> dict:
+    item = dict(row)
     try:
-        query = text("""
+        item["image"] = json.loads(item["image"]) if item["image"] else []
+    except Exception:
+        item["image"] = []
+    return item
+
+
+async def get_history_chat_service(chat_session_id: int, page: int = 1, limit: int = 10, db=None,
+                                   before_id: int = None, after_id: int = None):
+    """
+    Lịch sử tin nhắn theo thứ tự thời gian, `db` là AsyncSession (get_async_db).
+    - `before_id`: `limit` tin ngay trước tin `before_id` (cuộn lên).
+    - `after_id`: `limit` tin ngay sau tin `after_id` (tin mới).
+    - Không có cursor: phân trang page/limit như cũ.
+    Keyset theo (created_at, id), dùng index ix_messages_session_created_id.
+    Điều kiện created_at riêng theo mốc để planner bỏ qua các partition tháng không liên quan.
+    """
+    position = tuple_(Message.created_at, Message.id)
+    stmt = select(*_HISTORY_COLUMNS).where(Message.chat_session_id == chat_session_id)
+
+    if after_id is not None:
+        anchor = select(Message.created_at).where(Message.id == after_id).scalar_subquery()
+        stmt = stmt.where(Message.created_at >= anchor, position > tuple_(anchor, after_id)).order_by(Message.created_at, Message.id).limit(limit)
+        rows = (await db.execute(stmt)).mappings().all()
+        return [_history_row(row) for row in rows]
+
+    if before_id is not None:
+        anchor = select(Message.created_at).where(Message.id == before_id).scalar_subquery()
+        stmt = stmt.where(Message.created_at <= anchor, position < tuple_(anchor, before_id))
+    else:
+        stmt = stmt.offset((page - 1) * limit)
+
+    stmt = stmt.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit)
+    rows = (await db.execute(stmt)).mappings().all()
+    return [_history_row(row) for row in reversed(rows)]
+
+
+async def count_history_chat_service(chat_session_id: int, db) -> int:
+    """Tổng số tin của session, cache ngắn hạn để không COUNT(*) mỗi lần tải trang"""
+    async def load():
+        result = await db.execute(
+            select(func.count()).select_from(Message).where(Message.chat_session_id == chat_session_id)
+        )
+        return result.scalar_one()
+
+    return await redis_cache.async_get_or_set(f"history_count:{chat_session_id}", load, ttl=HISTORY_COUNT_TTL)
+
+def get_all_history_chat_service(db, page: int = None, limit: int = None, channel: str = None,
+                                 tag_id: int = None, status: str = None, alert: str = None):
+    """
+    Inbox admin, đọc từ inbox_summary (trigger cập nhật khi ghi tin / đổi tag).
+    Không truyền page/limit thì trả toàn bộ như trước.
+    """
+    try:
+        conditions = ["s.last_message_at IS NOT NULL"]
+        params = {}
+        if channel:
+            conditions.append("cs.channel = :channel")
+            params["channel"] = channel
+        if tag_id is not None:
+            conditions.append("s.tag_ids @> ARRAY[CAST(:tag_id AS INTEGER)]")
+            params["tag_id"] = tag_id
+        if status:
+            conditions.append("cs.status = :status")
+            params["status"] = status
+        if alert:
+            conditions.append("cs.alert = :alert")
+            params["alert"] = alert
+
+        pagination = ""
+        if limit:
+            pagination = "LIMIT :limit OFFSET :offset"
+            params["limit"] = limit
+            params["offset"] = ((page or 1) - 1) * limit
+
+        query = text(f"""
                 SELECT 
                     cs.id AS session_id,
                     cs.status,
@@ -484,39 +501,32 @@ def get_all_history_chat_service(db):
                     cs.time,
                     cs.current_receiver,
                     cs.previous_receiver,
-                    m.sender_type,
-                    m.content,
-                    m.sender_name, 
-                    m.created_at AS created_at,
-                    COALESCE(JSON_AGG(t.name) FILTER (WHERE t.name IS NOT NULL), '[]') AS tag_names,
-                    COALESCE(JSON_AGG(t.id) FILTER (WHERE t.id IS NOT NULL), '[]') AS tag_ids
-                FROM chat_sessions cs
-                LEFT JOIN customer_info ci ON cs.id = ci.chat_session_id
-                JOIN messages m ON cs.id = m.chat_session_id
-                JOIN (
-                    SELECT
-                        chat_session_id,
-                        MAX(created_at) AS latest_time
-                    FROM messages
-                    GROUP BY chat_session_id
-                ) AS latest ON cs.id = latest.chat_session_id AND m.created_at = latest.latest_time
-                LEFT JOIN chat_session_tag cst ON cs.id = cst.chat_session_id
-                LEFT JOIN tag t ON t.id = cst.tag_id
-                GROUP BY 
-                    cs.id, cs.status, cs.channel, ci.customer_data::text,
-                    cs.name, cs.time, cs.alert, cs.current_receiver, cs.previous_receiver,
-                    m.sender_type, m.content, m.sender_name, m.created_at
-                ORDER BY m.created_at DESC;
+                    s.last_sender_type AS sender_type,
+                    s.last_content AS content,
+                    s.last_sender_name AS sender_name, 
+                    s.last_message_at AS created_at,
+                    s.last_message_id,
+                    s.unread_count,
+                    COALESCE((SELECT JSON_AGG(t.name ORDER BY t.id) FROM tag t WHERE t.id = ANY(s.tag_ids)), '[]') AS tag_names,
+                    TO_JSON(s.tag_ids) AS tag_ids
+                FROM inbox_summary s
+                JOIN chat_sessions cs ON cs.id = s.chat_session_id
+                LEFT JOIN LATERAL (
+                    SELECT customer_data FROM customer_info
+                    WHERE chat_session_id = cs.id
+                    ORDER BY id
+                    LIMIT 1
+                ) AS ci ON true
+                WHERE {" AND ".join(conditions)}
+                ORDER BY s.last_message_at DESC, s.chat_session_id DESC
+                {pagination}
         """)
         
-        result = db.execute(query).fetchall()
+        result = db.execute(query, params).fetchall()
         conversations = []
         for row in result:
             row_dict = dict(row._mapping)
-            try:
-                row_dict["image"] = json.loads(row_dict["image"]) if row_dict.get("image") else []
-            except Exception:
-                row_dict["image"] = []  
+            row_dict["image"] = []
             conversations.append(row_dict)
             
         return conversations
@@ -526,98 +536,101 @@ def get_all_history_chat_service(db):
     finally: 
         db.close()
 
-def get_all_customer_service(data: dict, db):
-    channel = data.get("channel")
-    tag_id = data.get("tag_id")
-
-    query = """
-        SELECT DISTINCT
-            cs.id AS session_id,
-            cs.channel,
-            cs.name,
-            cs.page_id
-        FROM chat_sessions cs
-    """
+CUSTOMER_EXPORT_BATCH = int(os.getenv("CUSTOMER_EXPORT_BATCH", 1000))
+CUSTOMER_COLUMNS = ("session_id", "channel", "name", "page_id")
 
+def _customer_query(channel: str = None, tag_id: int = None, cursor: int = None, limit: int = None):
+    """Lọc tag bằng EXISTS (không cần DISTINCT); keyset theo cs.id giảm dần"""
     conditions = []
     params = {}
-
     if tag_id:
-        query += " INNER JOIN chat_session_tag cst ON cs.id = cst.chat_session_id"
-        conditions.append("cst.tag_id = :tag_id")
+        conditions.append(
+            "EXISTS (SELECT 1 FROM chat_session_tag cst WHERE cst.chat_session_id = cs.id AND cst.tag_id = :tag_id)"
+        )
         params["tag_id"] = tag_id
-
     if channel:
         conditions.append("cs.channel = :channel")
         params["channel"] = channel
+    if cursor:
+        conditions.append("cs.id < :cursor")
+        params["cursor"] = cursor
 
+    query = """
+        SELECT
+            cs.id AS session_id,
+            cs.channel,
+            cs.name,
+            cs.page_id
+        FROM chat_sessions cs
+    """
     if conditions:
         query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY cs.id DESC"
+    if limit:
+        query += " LIMIT :limit"
+        params["limit"] = limit
+    return text(query), params
 
-    query += " ORDER BY cs.id DESC;"
+def get_all_customer_service(data: dict, db):
+    """
+    Không truyền limit thì trả toàn bộ như trước.
+    Có limit: trả (trang, next_cursor); trang sau gọi lại với cursor = next_cursor.
+    """
+    limit = data.get("limit")
+    stmt, params = _customer_query(
+        data.get("channel"), data.get("tag_id"), data.get("cursor"), limit + 1 if limit else None
+    )
+    rows = [dict(row) for row in db.execute(stmt, params).mappings()]
+    if not limit:
+        return rows
+    next_cursor = rows[limit - 1]["session_id"] if len(rows) > limit else None
+    return rows[:limit], next_cursor
 
-    stmt = text(query)
-    result = db.execute(stmt, params).mappings().all()
+def export_customers_service(data: dict, fmt: str = "ndjson"):
+    """
+    Generator trả từng khối dòng NDJSON / CSV, đọc bằng server-side cursor
+    (bộ nhớ không phụ thuộc số session). Dùng pool background vì kết nối bị giữ suốt lúc tải.
+    """
+    stmt, params = _customer_query(data.get("channel"), data.get("tag_id"))
+    with background_engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=CUSTOMER_EXPORT_BATCH).execute(stmt, params)
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(CUSTOMER_COLUMNS)
+            for batch in result.partitions():
+                writer.writerows(batch)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.getvalue():
+                yield buffer.getvalue()
+        else:
+            for batch in result.mappings().partitions():
+                yield "".join(json.dumps(dict(row), ensure_ascii=False, default=str) + "\n" for row in batch)
 
-    # result lúc này là list[RowMapping] → có thể convert sang list[dict]
-    return [dict(row) for row in result]
+def check_repply_cached(id: int, db, lookup: SessionLookup = None):
+    """
+    Bot có được trả lời không: chỉ cần đọc status của session.
+    Việc trả session về cho bot khi hết hạn do HandoverScheduler đảm nhận.
+    """
+    try:
+        if lookup is None:
+            lookup = session_cache.lookup(session_id=id)
+        state = lookup.state or session_cache.load(id, db)
+        return bool(state) and state.status == "true"
+    except Exception as e:
+        print(e)
+        traceback.print_exc()
+        return False
 
-def check_repply_cached(id: int, db):
-    """Check repply với Redis cache"""
+async def check_repply_cached_async(id: int, db, lookup: SessionLookup = None):
+    """Bản async của check_repply_cached: Redis qua pool async, không chặn event loop"""
     try:
-        # Kiểm tra cache trước
-        repply_cache_key = f"check_repply:{id}"
-        cached_result = cache_get(repply_cache_key)
-        
-        if cached_result is not None:
-            return cached_result['can_reply']
-        
-        # Lấy session từ cache hoặc database
-        session_cache_key = f"session:{id}"
-        cached_session = cache_get(session_cache_key)
-        
-        if cached_session:
-            session_status = cached_session['status']
-            session_time = datetime.fromisoformat(cached_session['time']) if cached_session.get('time') else None
-        else:
-            session = db.query(ChatSession).filter(ChatSession.id == id).first()
-            if not session:
-                return False
-            session_status = session.status
-            session_time = session.time
-        
-        can_reply = False
-        
-        # Logic check repply
-        if session_time and datetime.now() > session_time and session_status == "false":
-            # Cập nhật database
-            session = db.query(ChatSession).filter(ChatSession.id == id).first()
-            session.status = "true"
-            session.time = None
-            db.commit()
-            db.refresh(session)
-            
-            # Cập nhật cache session
-            session_data = {
-                'id': session.id,
-                'name': session.name,
-                'status': session.status,
-                'channel': session.channel,
-                'page_id': session.page_id,
-                'current_receiver': session.current_receiver,
-                'previous_receiver': session.previous_receiver,
-                'time': session.time.isoformat() if session.time else None
-            }
-            cache_set(session_cache_key, session_data, ttl=300)
-            can_reply = True
-        elif session_status == "true":
-            can_reply = True
-        
-        # Cache kết quả check_repply trong 300 giây
-        cache_set(repply_cache_key, {'can_reply': can_reply}, ttl=300)
-        
-        return can_reply
-        
+        if lookup is None:
+            lookup = await session_cache.async_lookup(session_id=id)
+        state = lookup.state or await session_cache.async_load(id)
+        return bool(state) and state.status == "true"
     except Exception as e:
         print(e)
         traceback.print_exc()
@@ -648,64 +661,6 @@ def check_repply(id : int, db):
 
 
 
-def sendMessage(data: dict, content: str, db):
-    image_url = []
-    if data.get("image"):  # Đổi từ "images" thành "image" để nhất quán với FE
-        try:
-            print("có image")
-            image_url = save_base64_image(data.get("image"))
-        except Exception as e:
-            print("Error saving images:", e)
-            traceback.print_exc()
-    
-    response_messages = []
-    
-    chat_session_ids = data.get("customers", [])
-    for session_id in chat_session_ids:
-        session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
-        if not session:
-            continue
-
-        # Tạo message object trước
-        message = Message(
-            chat_session_id=session_id,
-            sender_type="bot",
-            content=content,
-            image=json.dumps(image_url) if image_url else None
-        )
-        db.add(message)
-        db.commit()
-        db.refresh(message)
-
-        # Gửi tin nhắn đến platform sau khi tạo message
-        if session.channel == "facebook":
-            name_to_send = session.name[2:]
-            send_fb(session.page_id, name_to_send, message, image_url, db)
-        elif session.channel == "telegram":
-            name_to_send = session.name[2:]
-            send_telegram(name_to_send, message, db)
-        elif session.channel == "zalo":
-            name_to_send = session.name[2:]
-            send_zalo(name_to_send, message, image_url, db)
-        
-        response_messages.append({
-            "id": message.id,
-            "chat_session_id": message.chat_session_id,
-            "sender_type": message.sender_type,
-            "sender_name": message.sender_name,
-            "content": message.content,
-            "image": json.loads(message.image) if message.image else [],
-            "session_name": session.name,
-            "session_status" : session.status
-        })
-       
-    return response_messages
-       
-
-
-
-
-
 def convert_file_to_facebook_attachment_id(file_data, access_token):
     """
     Chuyển đổi file ảnh thành attachment_id của Facebook
@@ -1249,7 +1204,7 @@ def send_text_only(url, headers, chat_id, content_text):
     else:
         print(f"❌ Lỗi gửi tin nhắn text: {response.status_code} - {response.text}")
       
-def send_message_page_service(data: dict, db):
+async def send_message_page_service(data: dict, db):
     prefix = None
     if data["platform"] == "facebook":
         prefix = "F"
@@ -1262,66 +1217,48 @@ def send_message_page_service(data: dict, db):
     
     session_name = f"{prefix}-{data['sender_id']}"
     
-    # Tạo cache key cho session dựa trên name
-    session_name_cache_key = f"session_by_name:{session_name}"
+    # Kiểm tra cache trước: name -> id -> session trong một round trip
+    lookup = await session_cache.async_lookup(name=session_name)
     
-    # Kiểm tra cache trước
-    cached_session_id = cache_get(session_name_cache_key)
-    
-    session_data = None
-    
-    if cached_session_id:
-        # Lấy session data từ cache theo ID
-        session_cache_key = f"session:{cached_session_id}"
-        session_data = cache_get(session_cache_key)
+    session_data = lookup.state
     
     # Nếu không có trong cache, query từ database
     if not session_data:
-        session = db.query(ChatSession).filter(ChatSession.name == session_name).first()
-        
-        url_channel = None
-        
-        if not session:
-            # Tạo session mới
-            session = ChatSession(
-                name=session_name,
-                channel=data["platform"],
-                page_id = data.get("page_id", ""),
-                url_channel = url_channel
-            )
+        async with AsyncSessionLocal() as adb:
+            result = await adb.execute(select(ChatSession).where(ChatSession.name == session_name))
+            session = result.scalars().first()
             
-            db.add(session)
-            db.commit()
-            db.refresh(session)
-        
-        # Cache session data
-        session_data = {
-            'id': session.id,
-            'name': session.name,
-            'status': session.status,
-            'channel': session.channel,
-            'page_id': session.page_id,
-            'current_receiver': session.current_receiver,
-            'previous_receiver': session.previous_receiver,
-            'time': session.time.isoformat() if session.time else None
-        }
+            url_channel = None
+            
+            if not session:
+                # Tạo session mới
+                session = ChatSession(
+                    name=session_name,
+                    channel=data["platform"],
+                    page_id = data.get("page_id", ""),
+                    url_channel = url_channel
+                )
+                
+                adb.add(session)
+                await adb.commit()
+                await adb.refresh(session)
         
         # Cache session theo ID và name
-        session_cache_key = f"session:{session.id}"
-        cache_set(session_cache_key, session_data, ttl=300)
-        cache_set(session_name_cache_key, session.id, ttl=300)
+        session_data = await session_cache.async_put(session)
+        lookup = SessionLookup(session.id, session_data, None)
     
     response_messages = []
     
-    # Tạo response message trước (với id=None)
+    # Tạo response message trước (id cấp sẵn, lưu DB chạy nền)
+    message_id = await allocate_message_id()
     customer_message = {
-        "id": None,
-        "chat_session_id": session_data['id'],
+        "id": message_id,
+        "chat_session_id": session_data.id,
         "sender_type": "customer",
         "sender_name": None,
         "content": data["message"],
-        "session_name": session_data['name'],
-        "session_status": session_data['status'],
+        "session_name": session_data.name,
+        "session_status": session_data.status,
         "platform": data["platform"]
     }
     
@@ -1329,17 +1266,22 @@ def send_message_page_service(data: dict, db):
     
     # Lưu tin nhắn vào database bất đồng bộ
     message_data = {
-        "chat_session_id": session_data['id'],
+        "id": message_id,
+        "chat_session_id": session_data.id,
         "sender_type": "customer",
         "content": data["message"]
     }
-    task1 = asyncio.create_task(save_message_to_db_async(message_data, None, [], db))
+    background.spawn(save_message_to_db_async(message_data, None, []))
     
     # Xử lý bot reply
-    if check_repply_cached(session_data['id'], db):
+    if await check_repply_cached_async(session_data.id, db, lookup):
         rag = RAGModel(db_session=db)
+        history, search_history = await rag.async_get_recent_histories(session_data.id)
+        field_configs = await rag.async_get_field_configs()
 
-        bot_response = rag.generate_response(data["message"], session_data['id'])
+        bot_response = await asyncio.to_thread(
+            rag.generate_response, data["message"], session_data.id, history, search_history, field_configs
+        )
         
         # Xử lý response - có thể là dict hoặc string (fallback)
         if isinstance(bot_response, dict):
@@ -1349,36 +1291,39 @@ def send_message_page_service(data: dict, db):
             bot_text = str(bot_response)
             bot_links = []
         
+        bot_message_id = await allocate_message_id()
         bot_message = {
-            "id": None,
-            "chat_session_id": session_data['id'],
+            "id": bot_message_id,
+            "chat_session_id": session_data.id,
             "sender_type": "bot",
             "sender_name": None,
             "content": bot_text,
             "links": bot_links,
-            "session_name": session_data['name'],
+            "session_name": session_data.name,
             "platform": data["platform"],
-            "session_status": session_data['status']
+            "session_status": session_data.status
         }
         
         response_messages.append(bot_message)
 
         # Lưu tin nhắn bot vào database bất đồng bộ
         bot_data = {
-            "chat_session_id": session_data['id'],
+            "id": bot_message_id,
+            "chat_session_id": session_data.id,
             "sender_type": "bot",
             "content": bot_text
         }
-        task2 = asyncio.create_task(save_message_to_db_async(bot_data, None, [], db))
+        background.spawn(save_message_to_db_async(bot_data, None, []))
 
-        # Gửi trả lời dựa trên platform tương ứng (gửi cả links nếu có)
+        # Gửi trả lời dựa trên platform tương ứng (gửi cả links nếu có).
+        # HTTP + query token bằng `db` (session sync) chạy trong thread, không chặn event loop
         try:
             if data["platform"] == "facebook":
-                send_fb(data.get("page_id"), data["sender_id"], bot_message, bot_links, db)
+                await asyncio.to_thread(send_fb, data.get("page_id"), data["sender_id"], bot_message, bot_links, db)
             elif data["platform"] == "telegram":
-                send_telegram(data["sender_id"], bot_message, db)
+                await asyncio.to_thread(send_telegram, data["sender_id"], bot_message, db)
             elif data["platform"] == "zalo":
-                send_zalo(data["sender_id"], bot_message, bot_links, db)
+                await asyncio.to_thread(send_zalo, data["sender_id"], bot_message, bot_links, db)
             else:
                 # Unknown platform — just log
                 print(f"⚠️ Unknown platform for outgoing reply: {data.get('platform')}")
@@ -1392,24 +1337,10 @@ def send_message_page_service(data: dict, db):
 
 def clear_session_cache(session_id: int):
     """Clear cache cho session và check_repply"""
-    session_cache_key = f"session:{session_id}"
-    repply_cache_key = f"check_repply:{session_id}"
-    cache_delete(session_cache_key)
-    cache_delete(repply_cache_key)
+    session_cache.invalidate(session_id)
 
-def update_session_cache(session, ttl=300):
-    session_cache_key = f"session:{session.id}"
-    session_data = {
-        'id': session.id,
-        'name': session.name,
-        'status': session.status,
-        'channel': session.channel,
-        'page_id': session.page_id,
-        'current_receiver': session.current_receiver,
-        'previous_receiver': session.previous_receiver,
-        'time': session.time.isoformat() if session.time else None
-    }
-    cache_set(session_cache_key, session_data, ttl=ttl)
+def update_session_cache(session):
+    session_cache.put(session)
 
 def update_chat_session(id: int, data: dict, user, db: Session):
     try:
@@ -1435,8 +1366,9 @@ def update_chat_session(id: int, data: dict, user, db: Session):
         db.commit()
         db.refresh(chatSession)
         
-        # Clear cache sau khi update
-        clear_session_cache(id)
+        # Ghi xuyên cache sau khi update
+        session_cache.put(chatSession)
+        sync_handover(chatSession)
         
         return {
             "chat_session_id": chatSession.id,
@@ -1469,119 +1401,26 @@ def update_tag_chat_session(id: int, data: dict, db):
     finally:
         db.close()
 
+def _clean_ids(ids) -> list[int]:
+    return sorted({int(i) for i in ids or []})
+
 def delete_chat_session(ids: list[int], db):
-    sessions = db.query(ChatSession).filter(ChatSession.id.in_(ids)).all()
-    if not sessions:
+    """Xóa theo tập: tin nhắn, customer_info, tag rồi session; cache xóa một lần cho cả danh sách"""
+    ids = _clean_ids(ids)
+    if not ids:
         return 0
-    
-    # Clear cache cho từng session trước khi xóa
-    for s in sessions:
-        clear_session_cache(s.id)
-        db.delete(s)
-    db.commit()
-    return len(sessions)
+    return delete_sessions_now(db, ids)
 
 def delete_message(chatId: int, ids: list[int], db):
-    print("chatId", chatId)
-    print("data", ids)
-    messages = db.query(Message).filter(
-        Message.id.in_(ids),
-        Message.chat_session_id == chatId
-    ).all()
-    
-    if not messages:
+    ids = _clean_ids(ids)
+    if not ids:
         return 0
-        
-    for m in messages:
-        db.delete(m)
-    db.commit()
-    return len(messages)
+    return delete_messages_now(db, chatId, ids)
 
 def get_dashboard_summary(db: Session) -> Dict[str, Any]:
+    """Đọc từ bảng rollup (RollupScheduler cập nhật định kỳ), không quét bảng messages"""
     try:
-        # 1️⃣ Tổng số tin nhắn theo kênh (barData + pieData)
-        bar_query = text("""
-            SELECT 
-                cs.channel AS channel,
-                COUNT(m.id) AS messages
-            FROM messages m
-            JOIN chat_sessions cs ON cs.id = m.chat_session_id
-            GROUP BY cs.channel
-            ORDER BY messages DESC;
-        """)
-        bar_rows = db.execute(bar_query).fetchall()
-        bar_data = [{"channel": r.channel, "messages": r.messages} for r in bar_rows]
-        pie_data = [{"name": r.channel, "value": r.messages} for r in bar_rows]
-
-        # 2️⃣ So sánh tin nhắn giữa 2 tháng gần nhất (lineData)
-        line_query = text("""
-            SELECT 
-                cs.channel,
-                TO_CHAR(DATE_TRUNC('month', m.created_at), 'YYYY-MM') AS month,
-                COUNT(m.id) AS messages
-            FROM messages m
-            JOIN chat_sessions cs ON cs.id = m.chat_session_id
-            WHERE m.created_at >= DATE_TRUNC('month', NOW() - INTERVAL '1 month')
-            GROUP BY cs.channel, DATE_TRUNC('month', m.created_at)
-            ORDER BY month;
-        """)
-        line_rows = db.execute(line_query).fetchall()
-
-        line_data_dict = {}
-        current_month = datetime.now().strftime("%Y-%m")
-
-        for row in line_rows:
-            month_label = (
-                "Tháng hiện tại" if row.month == current_month else "Tháng trước"
-            )
-            if month_label not in line_data_dict:
-                line_data_dict[month_label] = {"month": month_label}
-            line_data_dict[month_label][row.channel] = row.messages
-
-        line_data = list(line_data_dict.values())
-
-        # 3️⃣ Bảng chi tiết: khách hàng, tin nhắn, % thay đổi (tableData)
-        table_query = text("""
-            WITH month_stats AS (
-                SELECT 
-                    cs.channel,
-                    DATE_TRUNC('month', m.created_at) AS month,
-                    COUNT(DISTINCT ci.id) AS customers,
-                    COUNT(m.id) AS messages
-                FROM messages m
-                JOIN chat_sessions cs ON cs.id = m.chat_session_id
-                LEFT JOIN customer_info ci ON cs.id = ci.chat_session_id
-                GROUP BY cs.channel, DATE_TRUNC('month', m.created_at)
-            )
-            SELECT 
-                curr.channel,
-                curr.customers,
-                curr.messages,
-                ROUND(((curr.messages - prev.messages)::numeric / NULLIF(prev.messages, 0)) * 100, 2) AS change
-            FROM month_stats curr
-            LEFT JOIN month_stats prev 
-                ON curr.channel = prev.channel 
-                AND curr.month = DATE_TRUNC('month', NOW())
-                AND prev.month = DATE_TRUNC('month', NOW() - INTERVAL '1 month');
-        """)
-        table_rows = db.execute(table_query).fetchall()
-        table_data = [
-            {
-                "channel": r.channel,
-                "customers": r.customers,
-                "messages": r.messages,
-                "change": float(r.change or 0),
-            }
-            for r in table_rows
-        ]
-
-        # ✅ Trả về dữ liệu tổng hợp
-        return {
-            "barData": bar_data,
-            "pieData": pie_data,
-            "lineData": line_data,
-            "tableData": table_data,
-        }
+        return get_dashboard_rollups(db)
 
     except Exception as e:
         print(f"Error generating dashboard summary: {e}")
@@ -0,0 +1,233 @@
+"""
+Dashboard Rollup Service - Bảng tổng hợp theo ngày / kênh cho /chat/admin/count_by_channel
+"""
+import asyncio
+import os
+import traceback
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import text
+
+from config.database import engine
+
+# Số ngày gần nhất được tính lại mỗi lần chạy (tin đến muộn / ghi bất đồng bộ vẫn được đếm)
+ROLLUP_WINDOW_DAYS = int(os.getenv("ROLLUP_WINDOW_DAYS", 2))
+ROLLUP_INTERVAL_SECONDS = float(os.getenv("ROLLUP_INTERVAL_SECONDS", 60))
+ROLLUP_LOCK_ID = 72_0451
+
+# Đếm theo ngày + kênh: tổng tin, tin khách / bot / admin, số session có thông tin khách
+_DAILY_SQL = text("""
+    INSERT INTO channel_daily_stats (
+        day, channel, messages, customer_messages, bot_messages, staff_messages, customers, updated_at
+    )
+    SELECT
+        m.created_at::date AS day,
+        cs.channel,
+        COUNT(*),
+        COUNT(*) FILTER (WHERE m.sender_type = 'customer'),
+        COUNT(*) FILTER (WHERE m.sender_type = 'bot'),
+        COUNT(*) FILTER (WHERE m.sender_type = 'admin'),
+        COUNT(DISTINCT m.chat_session_id) FILTER (
+            WHERE EXISTS (SELECT 1 FROM customer_info ci WHERE ci.chat_session_id = m.chat_session_id)
+        ),
+        now()
+    FROM messages m
+    JOIN chat_sessions cs ON cs.id = m.chat_session_id
+    WHERE m.created_at >= :start AND m.created_at < :end
+    GROUP BY m.created_at::date, cs.channel
+""")
+
+# Session hoạt động theo ngày: để đếm khách distinct theo tháng mà không quét lại messages
+_SESSIONS_SQL = text("""
+    INSERT INTO channel_daily_sessions (day, chat_session_id, channel)
+    SELECT DISTINCT m.created_at::date, m.chat_session_id, cs.channel
+    FROM messages m
+    JOIN chat_sessions cs ON cs.id = m.chat_session_id
+    WHERE m.created_at >= :start AND m.created_at < :end
+""")
+
+_MONTHLY_SQL = text("""
+    INSERT INTO channel_monthly_customers (month, channel, customers, updated_at)
+    SELECT DATE_TRUNC('month', s.day)::date, s.channel, COUNT(DISTINCT s.chat_session_id), now()
+    FROM channel_daily_sessions s
+    WHERE s.day >= :month_start AND s.day < :month_end
+      AND EXISTS (SELECT 1 FROM customer_info ci WHERE ci.chat_session_id = s.chat_session_id)
+    GROUP BY DATE_TRUNC('month', s.day), s.channel
+""")
+
+
+# Ngày thuộc partition đã archive: messages chỉ còn vài dòng rehydrate, đếm lại sẽ xóa mất số liệu cũ
+_LIVE_DAYS_SQL = text("""
+    SELECT d FROM unnest(CAST(:days AS DATE[])) AS d
+    WHERE NOT EXISTS (
+        SELECT 1 FROM message_archives a WHERE d >= a.range_start AND d < a.range_end
+    )
+    ORDER BY d
+""")
+
+
+def _month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def _next_month(day: date) -> date:
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _rebuild_days(conn, start: date, end: date):
+    window = {"start": start, "end": end}
+    conn.execute(text("DELETE FROM channel_daily_stats WHERE day >= :start AND day < :end"), window)
+    conn.execute(_DAILY_SQL, window)
+    conn.execute(text("DELETE FROM channel_daily_sessions WHERE day >= :start AND day < :end"), window)
+    conn.execute(_SESSIONS_SQL, window)
+
+
+def _rebuild_months(conn, month_start: date, month_end: date):
+    months = {"month_start": month_start, "month_end": month_end}
+    conn.execute(
+        text("DELETE FROM channel_monthly_customers WHERE month >= :month_start AND month < :month_end"),
+        months,
+    )
+    conn.execute(_MONTHLY_SQL, months)
+
+
+def rebuild_rollups(conn, start: date, end: date):
+    """
+    Tính lại rollup cho các ngày [start, end) và các tháng chứa chúng, trong transaction của `conn`.
+    Idempotent: xóa rồi ghi lại, chạy lại bao nhiêu lần cũng ra cùng kết quả.
+    """
+    _rebuild_days(conn, start, end)
+    _rebuild_months(conn, _month_start(start), _next_month(end - timedelta(days=1)))
+
+
+def refresh_recent_rollups(days: int = ROLLUP_WINDOW_DAYS) -> bool:
+    """Tính lại `days` ngày gần nhất; worker khác đang chạy thì bỏ qua (trả về False)"""
+    today = date.today()
+    with engine.begin() as conn:
+        locked = conn.execute(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": ROLLUP_LOCK_ID}).scalar()
+        if not locked:
+            return False
+        rebuild_rollups(conn, today - timedelta(days=days - 1), today + timedelta(days=1))
+    return True
+
+
+def refresh_rollups_for_days(days) -> None:
+    """
+    Tính lại các ngày cụ thể (sau khi xóa tin nhắn).
+    Chờ khóa rollup (không bỏ qua như scheduler) để không ghi chồng cùng (ngày, kênh);
+    ngày liền nhau tính một lần, mỗi tháng bị ảnh hưởng chỉ tính lại một lần.
+    Ngày đã archive được giữ nguyên số liệu (rollup lúc đó vẫn tính cả tin đã xóa).
+    """
+    days = sorted(set(days))
+    if not days:
+        return
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": ROLLUP_LOCK_ID})
+        days = conn.execute(_LIVE_DAYS_SQL, {"days": days}).scalars().all()
+        if not days:
+            return
+        ranges = []
+        for day in days:
+            if ranges and ranges[-1][1] == day:
+                ranges[-1][1] = day + timedelta(days=1)
+            else:
+                ranges.append([day, day + timedelta(days=1)])
+        for start, end in ranges:
+            _rebuild_days(conn, start, end)
+        for month in sorted({_month_start(day) for day in days}):
+            _rebuild_months(conn, month, _next_month(month))
+
+
+def get_dashboard_rollups(db) -> Dict[str, Any]:
+    """Dữ liệu dashboard chỉ đọc từ bảng rollup (vài chục / trăm dòng)"""
+    bar_rows = db.execute(text("""
+        SELECT channel, SUM(messages)::bigint AS messages
+        FROM channel_daily_stats
+        GROUP BY channel
+        ORDER BY messages DESC
+    """)).fetchall()
+    bar_data = [{"channel": r.channel, "messages": r.messages} for r in bar_rows]
+    pie_data = [{"name": r.channel, "value": r.messages} for r in bar_rows]
+
+    current_month = _month_start(date.today())
+    previous_month = _month_start(current_month - timedelta(days=1))
+    month_rows = db.execute(text("""
+        SELECT
+            d.channel,
+            DATE_TRUNC('month', d.day)::date AS month,
+            SUM(d.messages)::bigint AS messages
+        FROM channel_daily_stats d
+        GROUP BY d.channel, DATE_TRUNC('month', d.day)
+    """)).fetchall()
+    customers = {
+        (r.channel, r.month): r.customers
+        for r in db.execute(text("SELECT channel, month, customers FROM channel_monthly_customers")).fetchall()
+    }
+    messages = {(r.channel, r.month): r.messages for r in month_rows}
+
+    line_data_dict = {}
+    for (channel, month), count in sorted(messages.items(), key=lambda item: item[0][1]):
+        if month not in (current_month, previous_month):
+            continue
+        month_label = "Tháng hiện tại" if month == current_month else "Tháng trước"
+        line_data_dict.setdefault(month_label, {"month": month_label})[channel] = count
+    line_data = list(line_data_dict.values())
+
+    # Giữ nguyên dạng cũ: một dòng / (kênh, tháng), % thay đổi chỉ có ở tháng hiện tại
+    table_data = []
+    for (channel, month), count in messages.items():
+        change = 0.0
+        previous = messages.get((channel, previous_month))
+        if month == current_month and previous:
+            change = round((count - previous) / previous * 100, 2)
+        table_data.append({
+            "channel": channel,
+            "customers": customers.get((channel, month), 0),
+            "messages": count,
+            "change": change,
+        })
+
+    return {
+        "barData": bar_data,
+        "pieData": pie_data,
+        "lineData": line_data,
+        "tableData": table_data,
+    }
+
+
+class RollupScheduler:
+    """Vòng lặp nền: tính lại rollup các ngày gần nhất mỗi `interval` giây"""
+
+    def __init__(self, interval: float = ROLLUP_INTERVAL_SECONDS):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.last_run: Optional[datetime] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                if await asyncio.to_thread(refresh_recent_rollups):
+                    self.last_run = datetime.now()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Lỗi cập nhật dashboard rollup: {e}")
+                traceback.print_exc()
+            await asyncio.sleep(self.interval)
+
+
+rollup_scheduler = RollupScheduler()
@@ -0,0 +1,71 @@
+"""
+Ingestion Job Service - Xếp hàng job ingest Google Sheet vào knowledge base
+"""
+import os
+import shutil
+import tempfile
+from typing import Any, BinaryIO, Dict, Optional
+from config.sheet import get_sheet, get_table_file
+from config.table_file import SUPPORTED_EXTENSIONS, file_extension
+from helper.job_queue import Job, JobQueue
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2))
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR", tempfile.gettempdir())
+
+ingestion_queue = JobQueue("ingest", max_workers=INGEST_WORKERS, eta_of="embeddings")
+
+
+def _kb_key(kb_id: int) -> str:
+    # Mỗi lần ingest xóa hết chunk cũ rồi ghi lại -> mọi job (sheet / file) của cùng KB phải chạy tuần tự
+    return f"kb:{kb_id}"
+
+
+def _run_sheet_ingestion(job: Job):
+    return get_sheet(job.params["sheet_id"], job.params["kb_id"], job=job)
+
+
+def enqueue_sheet_ingestion(sheet_id: str, kb_id: int) -> Dict[str, Any]:
+    """Xếp hàng ingest sheet; job cùng KB được gộp hoặc thay thế"""
+    job = ingestion_queue.submit(
+        _run_sheet_ingestion,
+        {"sheet_id": sheet_id, "kb_id": kb_id},
+        key=_kb_key(kb_id),
+    )
+    return job.to_dict(ingestion_queue.eta_of)
+
+
+def _run_file_ingestion(job: Job):
+    return get_table_file(job.params["path"], job.params["filename"], job.params["kb_id"], job=job)
+
+
+def _remove_upload(params: Dict[str, Any]):
+    """Xóa file tạm; JobQueue gọi cả khi job bị hủy lúc còn chờ, bị gộp thay hoặc bị bỏ lúc shutdown"""
+    if os.path.exists(params["path"]):
+        os.remove(params["path"])
+
+
+def enqueue_file_ingestion(fileobj: BinaryIO, filename: str, kb_id: int) -> Dict[str, Any]:
+    """Lưu file upload ra đĩa (copy theo block) rồi xếp hàng ingest CSV/XLSX"""
+    ext = file_extension(filename)
+    if ext not in SUPPORTED_EXTENSIONS:
+        raise ValueError(f"Chỉ hỗ trợ file {', '.join(sorted(SUPPORTED_EXTENSIONS))}")
+
+    fd, path = tempfile.mkstemp(suffix=ext, prefix="kb_upload_", dir=UPLOAD_TMP_DIR)
+    with os.fdopen(fd, "wb") as out:
+        shutil.copyfileobj(fileobj, out, length=1024 * 1024)
+
+    job = ingestion_queue.submit(
+        _run_file_ingestion,
+        {"path": path, "filename": filename, "kb_id": kb_id},
+        key=_kb_key(kb_id),
+        cleanup=_remove_upload,
+    )
+    return job.to_dict(ingestion_queue.eta_of)
+
+
+def get_ingestion_job(job_id: str) -> Optional[Dict[str, Any]]:
+    return ingestion_queue.get(job_id)
+
+
+def cancel_ingestion_job(job_id: str) -> bool:
+    return ingestion_queue.cancel(job_id)
@@ -1,13 +1,25 @@
 from sqlalchemy.orm import Session
 from models.knowledge_base import KnowledgeBase
 from config.database import SessionLocal
-from config.sheet import get_sheet
+from services.ingestion_job_service import enqueue_sheet_ingestion
 from llm.llm import RAGModel
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def _enqueue_sheet(kb: KnowledgeBase):
+    """Xếp hàng ingest Google Sheet nếu source là sheet ID, trả về trạng thái job"""
+    if kb.source and len(kb.source) > 20:  # Google Sheet ID thường dài > 20 ký tự
+        try:
+            job = enqueue_sheet_ingestion(kb.source, kb.id)
+            logger.info(f"Đã xếp hàng ingest Google Sheet, job {job['job_id']}")
+            return job
+        except Exception as e:
+            logger.error(f"Lỗi khi xếp hàng xử lý Google Sheet: {str(e)}")
+    return None
+
+
 def get_all_kb_service(db: Session):
     kbs = db.query(KnowledgeBase).first()
     return kbs
@@ -17,7 +29,7 @@ def get_all_kb_service(db: Session):
 def update_kb_service(kb_id: int, data: dict, db: Session):
     kb = db.query(KnowledgeBase).filter(KnowledgeBase.id == kb_id).first()
     if not kb:
-        return None
+        return None, None
     kb.title = data.get("title", kb.title)
     kb.content = data.get("content", kb.content)
     kb.source = data.get("source", kb.source)
@@ -28,19 +40,7 @@ def update_kb_service(kb_id: int, data: dict, db: Session):
     db.commit()
     db.refresh(kb)
     
-    # Xử lý Google Sheet nếu source là sheet ID
-    if kb.source and len(kb.source) > 20:  # Google Sheet ID thường dài > 20 ký tự
-        try:
-            result = get_sheet(kb.source, kb.id)
-            if not result["success"]:
-                logger.error(f"Lỗi xử lý Google Sheet: {result['message']}")
-                # Có thể return error hoặc tiếp tục tùy yêu cầu
-            else:
-                logger.info(f"Đã xử lý thành công Google Sheet: {result['message']}")
-        except Exception as e:
-            logger.error(f"Lỗi không mong muốn khi xử lý Google Sheet: {str(e)}")
-
-    return kb
+    return kb, _enqueue_sheet(kb)
 
 
 def create_kb_service(data: dict, db: Session):
@@ -59,19 +59,7 @@ def create_kb_service(data: dict, db: Session):
     db.commit()
     db.refresh(kb)
     
-    # Xử lý Google Sheet nếu source là sheet ID
-    if kb.source and len(kb.source) > 20:  # Google Sheet ID thường dài > 20 ký tự
-        try:
-            result = get_sheet(kb.source, kb.id)
-            if not result["success"]:
-                logger.error(f"Lỗi xử lý Google Sheet: {result['message']}")
-                # Có thể raise exception hoặc return error tùy yêu cầu
-            else:
-                logger.info(f"Đã xử lý thành công Google Sheet: {result['message']}")
-        except Exception as e:
-            logger.error(f"Lỗi không mong muốn khi xử lý Google Sheet: {str(e)}")
-    
-    return kb
+    return kb, _enqueue_sheet(kb)
 
 
 def search_kb_service(query: str, db: Session):
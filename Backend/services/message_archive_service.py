@@ -0,0 +1,242 @@
+"""
+Message Archive Service - Partition theo tháng cho bảng messages, archive partition cũ ra file nén
+"""
+import asyncio
+import csv
+import gzip
+import io
+import os
+import re
+import traceback
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+
+from config.database import engine
+
+ARCHIVE_DIR = os.getenv("MESSAGE_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "archive"))
+# Partition có toàn bộ dữ liệu cũ hơn chừng này tháng sẽ được archive
+ARCHIVE_AFTER_MONTHS = int(os.getenv("MESSAGE_ARCHIVE_AFTER_MONTHS", 12))
+PARTITION_MONTHS_AHEAD = int(os.getenv("MESSAGE_PARTITION_MONTHS_AHEAD", 2))
+PARTITION_MAINTENANCE_SECONDS = float(os.getenv("MESSAGE_PARTITION_MAINTENANCE_SECONDS", 6 * 3600))
+ARCHIVE_LOCK_ID = 72_0461
+
+# Thứ tự cột cố định cho COPY ra / vào file archive
+COLUMNS = ("id", "chat_session_id", "sender_name", "sender_type", "image", "content", "created_at")
+_COLUMN_LIST = ", ".join(COLUMNS)
+_PARTITION_NAME = re.compile(r"^messages_p(\d{4})(\d{2})$")
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"messages_p{month:%Y%m}"
+
+
+def create_partition(conn, month: date):
+    """Tạo partition cho tháng `month` nếu chưa có"""
+    start = month_start(month)
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF messages "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{add_months(start, 1).isoformat()}')"
+    ))
+
+
+def list_partitions(conn) -> List[Dict]:
+    """Các partition tháng đang gắn vào messages (bỏ qua partition default)"""
+    rows = conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'messages'
+    """)).fetchall()
+    partitions = []
+    for (name,) in rows:
+        match = _PARTITION_NAME.match(name)
+        if match:
+            start = date(int(match.group(1)), int(match.group(2)), 1)
+            partitions.append({"name": name, "start": start, "end": add_months(start, 1)})
+    return sorted(partitions, key=lambda p: p["start"])
+
+
+def ensure_partitions(months_ahead: int = PARTITION_MONTHS_AHEAD):
+    """Luôn có sẵn partition cho tháng hiện tại và `months_ahead` tháng tới"""
+    current = month_start(date.today())
+    with engine.begin() as conn:
+        for offset in range(months_ahead + 1):
+            create_partition(conn, add_months(current, offset))
+
+
+def _archive_path(name: str) -> str:
+    return os.path.join(ARCHIVE_DIR, f"{name}.csv.gz")
+
+
+def archive_partition(partition: Dict) -> Optional[Dict]:
+    """
+    COPY partition ra file CSV nén gzip, kiểm tra số dòng, ghi vào message_archives
+    rồi detach + drop partition. Trả về thông tin archive (None nếu đã archive trước đó).
+    """
+    name = partition["name"]
+    path = _archive_path(name)
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute("SELECT 1 FROM message_archives WHERE partition_name = %s", (name,))
+        if cursor.fetchone():
+            return None
+
+        cursor.execute(f"SELECT COUNT(*) FROM {name}")
+        expected = cursor.fetchone()[0]
+
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, "wb") as archive:
+            cursor.copy_expert(f"COPY (SELECT {_COLUMN_LIST} FROM {name} ORDER BY id) TO STDOUT WITH (FORMAT csv)", archive)
+        with gzip.open(tmp_path, "rt", encoding="utf-8", newline="") as archive:
+            written = sum(1 for _ in csv.reader(archive))
+        if written != expected:
+            os.remove(tmp_path)
+            raise RuntimeError(f"Archive {name}: ghi {written}/{expected} dòng")
+        os.replace(tmp_path, path)
+
+        cursor.execute(
+            """
+            INSERT INTO message_archives (partition_name, range_start, range_end, path, row_count, session_ids)
+            SELECT %s, %s, %s, %s, %s, COALESCE(array_agg(DISTINCT chat_session_id), '{}') FROM """ + name,
+            (name, partition["start"], partition["end"], path, expected),
+        )
+        cursor.execute(f"ALTER TABLE messages DETACH PARTITION {name}")
+        cursor.execute(f"DROP TABLE {name}")
+        raw.commit()
+        print(f"📦 Đã archive {name}: {expected} tin -> {path}")
+        return {"partition": name, "rows": expected, "path": path}
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+
+
+def archive_old_partitions(after_months: int = ARCHIVE_AFTER_MONTHS) -> List[Dict]:
+    """Archive các partition kết thúc trước mốc `after_months` tháng; worker khác đang chạy thì bỏ qua"""
+    cutoff = add_months(month_start(date.today()), -after_months)
+    archived = []
+    with engine.connect() as conn:
+        locked = conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": ARCHIVE_LOCK_ID}).scalar()
+        if not locked:
+            return archived
+        try:
+            for partition in list_partitions(conn):
+                if partition["end"] <= cutoff:
+                    result = archive_partition(partition)
+                    if result:
+                        archived.append(result)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": ARCHIVE_LOCK_ID})
+            conn.commit()
+    return archived
+
+
+def rehydrate_session(chat_session_id: int) -> Optional[int]:
+    """
+    Nạp lại tin nhắn đã archive của một session vào messages (rơi vào partition default).
+    Tin đã có (trùng id) được bỏ qua; số tin chưa đọc trong inbox giữ nguyên.
+    Session không còn tồn tại -> None.
+    """
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        # Khóa dòng session: không bị xóa giữa chừng (FK của messages)
+        cursor.execute("SELECT 1 FROM chat_sessions WHERE id = %s FOR SHARE", (chat_session_id,))
+        if cursor.fetchone() is None:
+            raw.rollback()
+            return None
+        cursor.execute(
+            "SELECT path FROM message_archives WHERE %s = ANY(session_ids) ORDER BY range_start",
+            (chat_session_id,),
+        )
+        paths = [row[0] for row in cursor.fetchall()]
+        if not paths:
+            return 0
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        session_column = COLUMNS.index("chat_session_id")
+        for path in paths:
+            with gzip.open(path, "rt", encoding="utf-8", newline="") as archive:
+                for row in csv.reader(archive):
+                    if row[session_column] == str(chat_session_id):
+                        writer.writerow(row)
+        buffer.seek(0)
+
+        cursor.execute("SELECT unread_count FROM inbox_summary WHERE chat_session_id = %s", (chat_session_id,))
+        unread = cursor.fetchone()
+        cursor.execute("CREATE TEMP TABLE rehydrate_messages (LIKE messages INCLUDING DEFAULTS) ON COMMIT DROP")
+        cursor.copy_expert(f"COPY rehydrate_messages ({_COLUMN_LIST}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(f"""
+            INSERT INTO messages ({_COLUMN_LIST})
+            SELECT {_COLUMN_LIST} FROM rehydrate_messages r
+            WHERE NOT EXISTS (SELECT 1 FROM messages m WHERE m.id = r.id AND m.created_at = r.created_at)
+        """)
+        inserted = cursor.rowcount
+        if unread:
+            cursor.execute(
+                "UPDATE inbox_summary SET unread_count = %s WHERE chat_session_id = %s",
+                (unread[0], chat_session_id),
+            )
+        raw.commit()
+        print(f"📤 Đã nạp lại {inserted} tin của session {chat_session_id}")
+        return inserted
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+
+
+class PartitionMaintenance:
+    """Vòng lặp nền: tạo trước partition tháng tới và archive partition cũ"""
+
+    def __init__(self, interval: float = PARTITION_MAINTENANCE_SECONDS):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.last_run: Optional[datetime] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(ensure_partitions)
+                await asyncio.to_thread(archive_old_partitions)
+                self.last_run = datetime.now()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Lỗi bảo trì partition messages: {e}")
+                traceback.print_exc()
+            await asyncio.sleep(self.interval)
+
+
+partition_maintenance = PartitionMaintenance()
@@ -0,0 +1,152 @@
+"""
+Message Buffer Service - Ghi tin nhắn theo lô (write-behind, group commit)
+"""
+import asyncio
+import os
+import traceback
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+
+from config.database import SessionLocal
+from config.id_allocator import message_ids
+from models.chat import Message
+
+MESSAGE_FLUSH_MS = float(os.getenv("MESSAGE_FLUSH_MS", 10))
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", 200))
+MESSAGE_QUEUE_SIZE = int(os.getenv("MESSAGE_QUEUE_SIZE", 10000))
+
+_MESSAGE_COLUMNS = ("id", "chat_session_id", "sender_type", "sender_name", "content", "image", "created_at")
+
+
+def _insert_rows(rows: List[Dict[str, Any]]) -> List[int]:
+    """
+    Một transaction, INSERT nhiều dòng ... RETURNING id (đúng thứ tự đầu vào).
+    Dòng chưa có id (không cấp được trước) ghi bằng câu riêng để sequence tự gán.
+    """
+    db = SessionLocal()
+    try:
+        stmt = insert(Message).returning(Message.id, sort_by_parameter_order=True)
+        ids: List[Optional[int]] = [None] * len(rows)
+        with_id = [i for i, row in enumerate(rows) if row.get("id") is not None]
+        without_id = [i for i, row in enumerate(rows) if row.get("id") is None]
+        for indexes, strip_id in ((with_id, False), (without_id, True)):
+            if not indexes:
+                continue
+            params = [
+                {k: v for k, v in rows[i].items() if k != "id"} if strip_id else rows[i]
+                for i in indexes
+            ]
+            for i, result in zip(indexes, db.execute(stmt, params)):
+                ids[i] = result.id
+        db.commit()
+        return ids
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class MessageWriteBuffer:
+    """
+    Hàng đợi tin nhắn trong bộ nhớ, flush mỗi `flush_ms` mili giây hoặc khi đủ `batch_size` tin.
+
+    - `save()` trả về id thật sau khi batch chứa tin nhắn được commit.
+    - Batch lỗi thì ghi lại từng dòng để một tin nhắn hỏng không kéo cả batch.
+    - `stop()` ngừng nhận và ghi hết phần còn lại (gọi khi shutdown).
+    - Chưa `start()` (script, test tay) thì ghi thẳng từng tin.
+    """
+
+    def __init__(self, flush_ms: float = MESSAGE_FLUSH_MS, batch_size: int = MESSAGE_BATCH_SIZE,
+                 max_queue: int = MESSAGE_QUEUE_SIZE):
+        self.flush_seconds = flush_ms / 1000
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._closing = True
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    @staticmethod
+    def build_row(data: Dict[str, Any]) -> Dict[str, Any]:
+        row = {column: data.get(column) for column in _MESSAGE_COLUMNS}
+        # Thời gian theo lúc nhận tin, không phải lúc flush
+        row["created_at"] = row["created_at"] or datetime.now()
+        return row
+
+    async def save(self, data: Dict[str, Any]) -> int:
+        row = self.build_row(data)
+        # Tin chưa có id thì cấp ở đây; không cấp được (DB / sequence lỗi) vẫn xếp hàng, id gán lúc ghi
+        if row["id"] is None:
+            try:
+                row["id"] = await message_ids.next_id()
+            except Exception as e:
+                print(f"❌ Lỗi cấp id tin nhắn, để DB tự gán khi ghi: {e}")
+        if self._task is None or self._closing:
+            return (await asyncio.to_thread(_insert_rows, [row]))[0]
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((row, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = asyncio.get_running_loop().time() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        rows = [row for row, _ in batch]
+        try:
+            ids = await asyncio.to_thread(_insert_rows, rows)
+            for (_, future), message_id in zip(batch, ids):
+                if not future.done():
+                    future.set_result(message_id)
+            return
+        except Exception as e:
+            print(f"❌ Lỗi ghi batch {len(rows)} tin nhắn, thử ghi từng tin: {e}")
+            traceback.print_exc()
+
+        for row, future in batch:
+            try:
+                message_id = (await asyncio.to_thread(_insert_rows, [row]))[0]
+                if not future.done():
+                    future.set_result(message_id)
+            except Exception as e:
+                print(f"❌ Lỗi lưu tin nhắn: {e}")
+                if not future.done():
+                    future.set_exception(e)
+
+
+message_buffer = MessageWriteBuffer()
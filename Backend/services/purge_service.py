@@ -0,0 +1,171 @@
+"""
+Purge Service - Xóa session / tin nhắn theo tập (DELETE ... = ANY(:ids)), purge lớn chạy nền theo chunk
+"""
+import os
+import traceback
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from config.database import engine
+from config.redis_cache import redis_cache
+from config.session_cache import session_cache
+from helper.job_queue import Job, JobQueue
+from services.dashboard_rollup_service import refresh_rollups_for_days
+
+# Xóa nhiều hơn chừng này session thì chuyển sang job nền
+PURGE_SYNC_LIMIT = int(os.getenv("PURGE_SYNC_LIMIT", 200))
+PURGE_CHUNK_SESSIONS = int(os.getenv("PURGE_CHUNK_SESSIONS", 100))
+PURGE_MESSAGE_BATCH = int(os.getenv("PURGE_MESSAGE_BATCH", 5000))
+PURGE_WORKERS = int(os.getenv("PURGE_WORKERS", 1))
+
+purge_queue = JobQueue("purge", max_workers=PURGE_WORKERS, eta_of="sessions")
+
+# Trả về các ngày bị ảnh hưởng để tính lại rollup dashboard
+_DELETE_SESSION_MESSAGES = text("""
+    WITH deleted AS (
+        DELETE FROM messages WHERE chat_session_id = ANY(:ids) RETURNING created_at
+    )
+    SELECT created_at::date AS day, COUNT(*) AS n FROM deleted GROUP BY 1
+""")
+
+# Bản chia lô cho job nền: mỗi lô một transaction ngắn
+_DELETE_SESSION_MESSAGES_BATCH = text("""
+    WITH batch AS (
+        SELECT id, created_at FROM messages WHERE chat_session_id = ANY(:ids) LIMIT :batch
+    ),
+    deleted AS (
+        DELETE FROM messages m USING batch b
+        WHERE m.id = b.id AND m.created_at = b.created_at
+        RETURNING m.created_at
+    )
+    SELECT created_at::date AS day, COUNT(*) AS n FROM deleted GROUP BY 1
+""")
+
+# Bảng con trước, chat_sessions sau cùng (inbox_summary tự xóa theo ON DELETE CASCADE)
+_DELETE_SESSION_CHILDREN = [
+    text("DELETE FROM customer_info WHERE chat_session_id = ANY(:ids)"),
+    text("DELETE FROM chat_session_tag WHERE chat_session_id = ANY(:ids)"),
+]
+_DELETE_SESSIONS = text("DELETE FROM chat_sessions WHERE id = ANY(:ids) RETURNING id, name")
+# File archive vẫn giữ tin của session đã xóa, chỉ bỏ liên kết để không rehydrate lại
+_UNLINK_ARCHIVES = text("""
+    UPDATE message_archives
+    SET session_ids = ARRAY(SELECT sid FROM unnest(session_ids) AS sid WHERE sid <> ALL(:ids))
+    WHERE session_ids && CAST(:ids AS INTEGER[])
+""")
+
+_DELETE_MESSAGES = text("""
+    WITH deleted AS (
+        DELETE FROM messages WHERE chat_session_id = :chat_id AND id = ANY(:ids) RETURNING created_at
+    )
+    SELECT created_at::date AS day, COUNT(*) AS n FROM deleted GROUP BY 1
+""")
+
+
+def _count_days(rows) -> Tuple[Set[date], int]:
+    days, total = set(), 0
+    for row in rows:
+        days.add(row.day)
+        total += row.n
+    return days, total
+
+
+def _delete_session_rows(conn, ids: List[int]) -> List[Any]:
+    for stmt in _DELETE_SESSION_CHILDREN:
+        conn.execute(stmt, {"ids": ids})
+    conn.execute(_UNLINK_ARCHIVES, {"ids": ids})
+    return conn.execute(_DELETE_SESSIONS, {"ids": ids}).fetchall()
+
+
+def invalidate_session_caches(deleted_sessions: Iterable[Any]):
+    """Xóa cache session + đếm lịch sử của các session đã xóa trong một lệnh DEL"""
+    deleted_sessions = list(deleted_sessions)
+    if not deleted_sessions:
+        return
+    session_cache.invalidate_many([s.id for s in deleted_sessions], [s.name for s in deleted_sessions])
+    redis_cache.delete_many(*[f"history_count:{s.id}" for s in deleted_sessions])
+
+
+def _refresh_rollups_job(job: Job):
+    refresh_rollups_for_days(job.params["days"])
+    return {"days": len(job.params["days"])}
+
+
+def schedule_rollup_refresh(days: Iterable[date]):
+    """Tính lại rollup dashboard cho các ngày có tin bị xóa (chạy nền, không giữ request)"""
+    days = sorted(set(days))
+    if days:
+        purge_queue.submit(_refresh_rollups_job, {"days": days})
+
+
+def delete_sessions_now(db, ids: List[int]) -> int:
+    """Xóa ngay trong transaction của `db` (dùng cho lượng nhỏ)"""
+    days, _ = _count_days(db.execute(_DELETE_SESSION_MESSAGES, {"ids": ids}))
+    deleted = _delete_session_rows(db, ids)
+    db.commit()
+    invalidate_session_caches(deleted)
+    schedule_rollup_refresh(days)
+    return len(deleted)
+
+
+def _run_session_purge(job: Job):
+    """
+    Purge theo chunk session; tin nhắn của mỗi chunk xóa theo lô PURGE_MESSAGE_BATCH dòng.
+    Hủy giữa chừng thì các chunk đã xong vẫn bị xóa, session của chunk dở còn lại (có thể thiếu tin).
+    """
+    ids = job.params["ids"]
+    job.set_total("sessions", len(ids))
+    days: Set[date] = set()
+    deleted_total = 0
+    try:
+        for start in range(0, len(ids), PURGE_CHUNK_SESSIONS):
+            chunk = ids[start:start + PURGE_CHUNK_SESSIONS]
+            while True:
+                job.check_cancelled()
+                with engine.begin() as conn:
+                    batch_days, removed = _count_days(conn.execute(
+                        _DELETE_SESSION_MESSAGES_BATCH, {"ids": chunk, "batch": PURGE_MESSAGE_BATCH}
+                    ))
+                days |= batch_days
+                job.advance("messages", removed)
+                if removed < PURGE_MESSAGE_BATCH:
+                    break
+
+            with engine.begin() as conn:
+                deleted = _delete_session_rows(conn, chunk)
+            invalidate_session_caches(deleted)
+            deleted_total += len(deleted)
+            job.advance("sessions", len(chunk))
+    finally:
+        # Kể cả khi hủy / lỗi: dashboard phải khớp với phần đã xóa
+        if days:
+            try:
+                refresh_rollups_for_days(days)
+            except Exception as e:
+                print(f"❌ Lỗi tính lại rollup sau purge: {e}")
+                traceback.print_exc()
+    return {"deleted": deleted_total, "messages": job.progress.get("messages", 0)}
+
+
+def enqueue_session_purge(ids: List[int]) -> Dict[str, Any]:
+    job = purge_queue.submit(_run_session_purge, {"ids": ids})
+    return job.to_dict(purge_queue.eta_of)
+
+
+def delete_messages_now(db, chat_id: int, ids: List[int]) -> int:
+    days, deleted = _count_days(db.execute(_DELETE_MESSAGES, {"chat_id": chat_id, "ids": ids}))
+    db.commit()
+    if deleted:
+        redis_cache.delete(f"history_count:{chat_id}")
+        schedule_rollup_refresh(days)
+    return deleted
+
+
+def get_purge_job(job_id: str) -> Optional[Dict[str, Any]]:
+    return purge_queue.get(job_id)
+
+
+def cancel_purge_job(job_id: str) -> bool:
+    return purge_queue.cancel(job_id)
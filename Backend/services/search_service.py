@@ -0,0 +1,118 @@
+"""
+Search Service - Tìm kiếm toàn văn (bỏ dấu) trong tin nhắn và thông tin khách cho admin
+"""
+import base64
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from sqlalchemy import text
+
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", 50))
+_HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=20, MinWords=5"
+
+
+def _escape_html(column: str) -> str:
+    """
+    Escape HTML trong SQL trước khi đưa vào ts_headline: ts_headline không escape, snippet được
+    frontend render như HTML nên chỉ <mark> do ta thêm vào là thẻ thật.
+    (Parser full-text bỏ qua entity như &amp; nên từ khóa vẫn khớp như cũ.)
+    """
+    expr = f"replace({column}, '&', '&amp;')"
+    for char, entity in (("<", "&lt;"), (">", "&gt;"), ('"', "&quot;"), ("''", "&#39;")):
+        expr = f"replace({expr}, '{char}', '{entity}')"
+    return expr
+
+
+# Mỗi session một kết quả: tin khớp mới nhất và/hoặc thông tin khách khớp.
+# ts_headline chỉ tính cho các dòng của trang (subquery đã LIMIT), không tính cho mọi dòng khớp.
+_SEARCH_SQL = f"""
+WITH q AS (
+    SELECT websearch_to_tsquery('vn_unaccent', :q) AS query
+),
+message_hits AS (
+    SELECT DISTINCT ON (m.chat_session_id)
+        m.chat_session_id AS session_id, m.id AS message_id, m.sender_type, m.content, m.created_at
+    FROM messages m, q
+    WHERE to_tsvector('vn_unaccent', COALESCE(m.content, '')) @@ q.query
+    ORDER BY m.chat_session_id, m.created_at DESC, m.id DESC
+),
+customer_hits AS (
+    SELECT DISTINCT ON (ci.chat_session_id)
+        ci.chat_session_id AS session_id, customer_search_text(ci.customer_data) AS customer_text
+    FROM customer_info ci, q
+    WHERE to_tsvector('vn_unaccent', customer_search_text(ci.customer_data)) @@ q.query
+    ORDER BY ci.chat_session_id, ci.id
+),
+hits AS (
+    SELECT
+        COALESCE(mh.session_id, ch.session_id) AS session_id,
+        mh.message_id, mh.sender_type, mh.content, mh.created_at AS message_at,
+        ch.customer_text
+    FROM message_hits mh
+    FULL OUTER JOIN customer_hits ch ON ch.session_id = mh.session_id
+),
+ranked AS (
+    SELECT
+        h.*,
+        COALESCE(h.message_at, s.last_message_at, cs.created_at, 'epoch'::timestamp) AS matched_at,
+        cs.name, cs.channel, cs.status, cs.alert
+    FROM hits h
+    JOIN chat_sessions cs ON cs.id = h.session_id
+    LEFT JOIN inbox_summary s ON s.chat_session_id = h.session_id
+)
+SELECT
+    p.session_id, p.name, p.channel, p.status, p.alert, p.matched_at,
+    p.message_id, p.sender_type, p.message_at,
+    CASE WHEN p.content IS NOT NULL
+         THEN ts_headline('vn_unaccent', {_escape_html('p.content')}, q.query, '{_HEADLINE_OPTIONS}') END AS message_snippet,
+    CASE WHEN p.customer_text IS NOT NULL
+         THEN ts_headline('vn_unaccent', {_escape_html('p.customer_text')}, q.query, '{_HEADLINE_OPTIONS}') END AS customer_snippet
+FROM (
+    SELECT * FROM ranked
+    {{keyset}}
+    ORDER BY matched_at DESC, session_id DESC
+    LIMIT :limit
+) AS p, q
+ORDER BY p.matched_at DESC, p.session_id DESC
+"""
+
+
+def encode_cursor(matched_at: datetime, session_id: int) -> str:
+    raw = json.dumps({"at": matched_at.isoformat(), "id": session_id})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """Cursor không hợp lệ -> ValueError"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return datetime.fromisoformat(data["at"]), int(data["id"])
+    except Exception:
+        raise ValueError("cursor không hợp lệ")
+
+
+def search_conversations(db, q: str, limit: int = 20, cursor: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Tìm session có tin nhắn hoặc thông tin khách khớp `q` (cú pháp websearch: "cụm từ", -loại, or).
+    Sắp theo thời điểm khớp mới nhất, phân trang keyset bằng `cursor` của trang trước.
+    """
+    q = (q or "").strip()
+    if not q:
+        return {"items": [], "next_cursor": None}
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+
+    params = {"q": q, "limit": limit + 1}
+    keyset = ""
+    if cursor:
+        params["cursor_at"], params["cursor_id"] = decode_cursor(cursor)
+        keyset = "WHERE (matched_at, session_id) < (:cursor_at, :cursor_id)"
+
+    rows = db.execute(text(_SEARCH_SQL.format(keyset=keyset)), params).fetchall()
+    items = [dict(row._mapping) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor(last["matched_at"], last["session_id"])
+    return {"items": items, "next_cursor": next_cursor}
@@ -8,7 +8,8 @@ from sqlalchemy.orm import Session
 from sqlalchemy import text
 from models.chat import ChatSession, CustomerInfo
 from models.facebook_page import FacebookPage
-from config.redis_cache import cache_get, cache_set, cache_delete
+from config.session_cache import SessionState, session_cache
+from helper.handover_scheduler import sync_handover
 
 
 class SessionService:
@@ -41,32 +42,9 @@ class SessionService:
         
         return self.create_session(channel, page_id)
     
-    def get_session_by_id(self, session_id: int) -> Optional[ChatSession]:
-        """Lấy session theo ID với caching"""
-        # Kiểm tra cache trước
-        session_cache_key = f"session:{session_id}"
-        cached_session = cache_get(session_cache_key)
-        
-        if cached_session:
-            # Tạo session object từ cache
-            session = ChatSession(
-                id=cached_session['id'],
-                name=cached_session['name'],
-                status=cached_session['status'],
-                channel=cached_session['channel'],
-                page_id=cached_session.get('page_id'),
-                current_receiver=cached_session.get('current_receiver'),
-                previous_receiver=cached_session.get('previous_receiver'),
-                time=datetime.fromisoformat(cached_session['time']) if cached_session.get('time') else None
-            )
-            return session
-        
-        # Lấy từ database và cache lại
-        session = self.db.query(ChatSession).filter(ChatSession.id == session_id).first()
-        if session:
-            self.update_session_cache(session)
-        
-        return session
+    def get_session_by_id(self, session_id: int) -> Optional[SessionState]:
+        """Lấy trạng thái session theo ID với caching"""
+        return session_cache.get(session_id, self.db)
     
     def get_session_by_name(self, name: str) -> Optional[ChatSession]:
         """Lấy session theo tên"""
@@ -89,8 +67,9 @@ class SessionService:
             self.db.commit()
             self.db.refresh(session)
             
-            # Cập nhật cache
+            # Cập nhật cache + lịch trả session cho bot
             self.update_session_cache(session)
+            sync_handover(session)
             
             return True
         except Exception as e:
@@ -98,65 +77,19 @@ class SessionService:
             self.db.rollback()
             return False
     
-    def update_session_cache(self, session: ChatSession, ttl: int = 300):
-        """Cập nhật cache cho session"""
-        session_cache_key = f"session:{session.id}"
-        session_data = {
-            'id': session.id,
-            'name': session.name,
-            'status': session.status,
-            'channel': session.channel,
-            'page_id': session.page_id,
-            'current_receiver': session.current_receiver,
-            'previous_receiver': session.previous_receiver,
-            'time': session.time.isoformat() if session.time else None
-        }
-        cache_set(session_cache_key, session_data, ttl=ttl)
+    def update_session_cache(self, session: ChatSession):
+        """Ghi xuyên cache cho session"""
+        session_cache.put(session)
     
     def clear_session_cache(self, session_id: int):
         """Xóa cache của session"""
-        session_cache_key = f"session:{session_id}"
-        repply_cache_key = f"check_repply:{session_id}"
-        cache_delete(session_cache_key)
-        cache_delete(repply_cache_key)
+        session_cache.invalidate(session_id)
     
     def check_can_reply(self, session_id: int) -> bool:
-        """Kiểm tra có thể reply tự động không với Redis cache"""
+        """Kiểm tra có thể reply tự động không (status đọc từ cache, hết hạn do scheduler xử lý)"""
         try:
-            # Kiểm tra cache trước
-            repply_cache_key = f"check_repply:{session_id}"
-            cached_result = cache_get(repply_cache_key)
-            
-            if cached_result is not None:
-                return cached_result['can_reply']
-            
-            # Lấy session
             session = self.get_session_by_id(session_id)
-            if not session:
-                return False
-            
-            can_reply = False
-            
-            # Logic check repply
-            if (session.time and datetime.now() > session.time and 
-                session.status == "false"):
-                # Cập nhật database
-                db_session = self.db.query(ChatSession).filter(ChatSession.id == session_id).first()
-                db_session.status = "true"
-                db_session.time = None
-                self.db.commit()
-                self.db.refresh(db_session)
-                
-                # Cập nhật cache session
-                self.update_session_cache(db_session)
-                can_reply = True
-            elif session.status == "true":
-                can_reply = True
-            
-            # Cache kết quả check_repply
-            cache_set(repply_cache_key, {'can_reply': can_reply}, ttl=300)
-            
-            return can_reply
+            return bool(session) and session.status == "true"
             
         except Exception as e:
             print(f"Error checking reply permission: {e}")
@@ -222,8 +155,9 @@ class SessionService:
             self.db.commit()
             self.db.refresh(session)
             
-            # Xóa cache cũ
-            self.clear_session_cache(session_id)
+            # Ghi xuyên cache + lịch trả session cho bot
+            self.update_session_cache(session)
+            sync_handover(session)
             
             return {
                 "chat_session_id": session.id,
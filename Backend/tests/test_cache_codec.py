@@ -0,0 +1,71 @@
+"""
+Round-trip của CacheCodec với từng codec có sẵn
+"""
+from datetime import datetime
+
+import pytest
+
+from config import cache_codec
+from config.cache_codec import TAG_JSON, TAG_MSGPACK, TAG_ORJSON, CacheCodec
+
+CODECS = [
+    pytest.param(TAG_JSON, id="json"),
+    pytest.param(TAG_MSGPACK, id="msgpack",
+                 marks=pytest.mark.skipif(cache_codec.msgpack is None, reason="chưa cài msgpack")),
+    pytest.param(TAG_ORJSON, id="orjson",
+                 marks=pytest.mark.skipif(cache_codec.orjson is None, reason="chưa cài orjson")),
+]
+
+
+@pytest.mark.parametrize("tag", CODECS)
+def test_structured_values_round_trip(tag):
+    codec = CacheCodec(tag)
+    value = {"name": "F-1", "tags": [1, 2], "nested": {"ok": True, "score": 1.5}, "none": None}
+
+    assert codec.decode(codec.encode(value)) == value
+
+
+@pytest.mark.parametrize("tag", CODECS)
+def test_int_map_keys_round_trip(tag):
+    codec = CacheCodec(tag)
+
+    decoded = codec.decode(codec.encode({1: "a", 2: {3: "b"}}))
+
+    # msgpack giữ key int; json / orjson đổi thành chuỗi như khi cache còn lưu JSON
+    if tag == TAG_MSGPACK:
+        assert decoded == {1: "a", 2: {3: "b"}}
+    else:
+        assert decoded == {"1": "a", "2": {"3": "b"}}
+
+
+@pytest.mark.parametrize("tag", CODECS)
+def test_datetime_encoded_as_iso(tag):
+    codec = CacheCodec(tag)
+    at = datetime(2024, 5, 1, 8, 30)
+
+    assert codec.decode(codec.encode({"at": at})) == {"at": at.isoformat()}
+
+
+def test_str_and_bytes_stored_raw():
+    codec = CacheCodec(TAG_JSON)
+
+    assert codec.decode(codec.encode("xin chào")) == "xin chào"
+    assert codec.decode(codec.encode(b"\x00\x01")) == b"\x00\x01"
+
+
+def test_ndarray_round_trip():
+    np = pytest.importorskip("numpy")
+    codec = CacheCodec(TAG_JSON)
+    embedding = np.arange(8, dtype=np.float32)
+
+    decoded = codec.decode(codec.encode(embedding))
+
+    assert decoded.dtype == np.float32
+    assert np.array_equal(decoded, embedding)
+
+
+def test_legacy_untagged_values():
+    codec = CacheCodec(TAG_JSON)
+
+    assert codec.decode('{"a": 1}') == {"a": 1}
+    assert codec.decode("plain text") == "plain text"
@@ -0,0 +1,17 @@
+"""
+Các query nóng phải dùng đúng index (EXPLAIN trên database đã migrate), giống `python -m config.migrations check`
+"""
+import pytest
+
+try:
+    from config.migrations import HOT_QUERIES, check_index_usage, run_migrations
+except Exception as e:  # thiếu sqlalchemy / driver Postgres
+    pytest.skip(f"Không import được config.migrations: {e}", allow_module_level=True)
+
+
+def test_hot_queries_use_expected_indexes(db_engine):
+    run_migrations(db_engine)
+
+    errors = check_index_usage(db_engine)
+
+    assert not errors, f"{len(errors)}/{len(HOT_QUERIES)} query nóng không dùng index:\n" + "\n\n".join(errors)
@@ -0,0 +1,99 @@
+"""
+IngestionPipeline với embedder / writer giả: chia batch, thứ tự chunk khi ghi, hủy giữa chừng
+"""
+import pytest
+
+try:
+    from config.ingestion_pipeline import IngestionPipeline
+    from helper.job_queue import Job, JobCancelled
+except Exception as e:  # thiếu dependency (sqlalchemy, google-genai, ...) hoặc cấu hình
+    pytest.skip(f"Không import được config.ingestion_pipeline: {e}", allow_module_level=True)
+
+
+class RowChunker:
+    """Mỗi hàng là một chunk, giữ nguyên thứ tự"""
+
+    def chunk_rows(self, title, headers, rows):
+        for row in rows:
+            yield f"{title}:{row['id']}"
+
+
+class FakeEmbedder:
+    def __init__(self, on_batch=None):
+        self.batches = []
+        self.on_batch = on_batch
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        if self.on_batch:
+            self.on_batch(len(self.batches))
+        return [[float(len(text))] for text in texts]
+
+
+class FakeWriter:
+    instances = []
+
+    def __init__(self, kb_id):
+        self.kb_id = kb_id
+        self.written = []
+        self.state = "open"
+        FakeWriter.instances.append(self)
+
+    def write(self, batch):
+        self.written.extend(text for text, _ in batch)
+
+    def commit(self):
+        self.state = "committed"
+
+    def rollback(self):
+        self.state = "rolled_back"
+
+
+@pytest.fixture(autouse=True)
+def reset_writers():
+    FakeWriter.instances = []
+
+
+def make_pipeline(embedder, job=None, batch_size=4):
+    return IngestionPipeline(
+        kb_id=3,
+        job=job,
+        embed_batch_size=batch_size,
+        embedder=embedder,
+        writer_factory=FakeWriter,
+        chunker=RowChunker(),
+    )
+
+
+def test_chunks_embedded_in_batches_and_written_in_order():
+    embedder = FakeEmbedder()
+    rows = [{"id": i} for i in range(10)]
+
+    stats = make_pipeline(embedder).run_rows("sp", ["id"], rows)
+
+    assert [len(batch) for batch in embedder.batches] == [4, 4, 2]
+    [writer] = FakeWriter.instances
+    assert writer.kb_id == 3
+    assert writer.written == [f"sp:{i}" for i in range(10)]
+    assert writer.state == "committed"
+    assert stats == {"sources": 1, "rows": 10, "chunks": 10, "embeddings": 10}
+
+
+def test_cancel_stops_pipeline_and_rolls_back():
+    job = Job("ingest", None, {})
+
+    def cancel_after_first_batch(batch_no):
+        if batch_no == 1:
+            job.cancel()
+
+    embedder = FakeEmbedder(on_batch=cancel_after_first_batch)
+    rows = ({"id": i} for i in range(1000))
+
+    with pytest.raises(JobCancelled):
+        make_pipeline(embedder, job=job).run_rows("sp", ["id"], rows)
+
+    [writer] = FakeWriter.instances
+    assert writer.state == "rolled_back"
+    assert writer.written == []
+    # Dừng sớm: không embed hết 1000 chunk
+    assert sum(len(batch) for batch in embedder.batches) < 1000
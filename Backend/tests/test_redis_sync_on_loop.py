@@ -0,0 +1,143 @@
+"""
+Hot path async không được gọi client Redis sync trên event loop (REDIS_SYNC_ON_LOOP=raise)
+"""
+import asyncio
+import itertools
+import threading
+
+import pytest
+
+try:
+    from config import redis_cache as redis_cache_module
+    from config import session_cache as session_cache_module
+    from config.redis_cache import SyncRedisOnEventLoop, redis_cache
+    from config.session_cache import SessionState, session_key, session_name_key
+    from helper import job_queue as job_queue_module
+    from services import chat_service
+except Exception as e:  # thiếu dependency (sqlalchemy, redis, ...) hoặc cấu hình
+    pytest.skip(f"Không import được app: {e}", allow_module_level=True)
+
+
+class FakeScript:
+    """Giả lập các script đọc của session_cache (GET theo tên, lookup hash) trên dữ liệu của FakeAsyncRedis"""
+
+    def __init__(self, redis, script):
+        assert script in (session_cache_module._GET_SCRIPT, session_cache_module._LOOKUP_SCRIPT), \
+            "chỉ giả lập script đọc"
+        self.redis = redis
+        self.script = script
+
+    async def __call__(self, keys=None, args=None, client=None):
+        if self.script == session_cache_module._GET_SCRIPT:
+            value = self.redis.strings.get(keys[0])
+            return value.encode() if value is not None else None
+        data = self.redis.hashes.get(keys[0], {})
+        flat = [part.encode() for pair in data.items() for part in pair]
+        return [str(args[0]).encode(), flat]
+
+
+class FakeAsyncRedis:
+    def __init__(self):
+        self.hashes = {}
+        self.strings = {}
+
+    def add_session(self, state: SessionState):
+        self.hashes[session_key(state.id)] = state.to_hash()
+        self.strings[session_name_key(state.name)] = str(state.id)
+
+    def register_script(self, script):
+        return FakeScript(self, script)
+
+    async def hgetall(self, key):
+        return {k.encode(): v.encode() for k, v in self.hashes.get(key, {}).items()}
+
+    async def get(self, key):
+        value = self.strings.get(key)
+        return value.encode() if value is not None else None
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """Client async giả; mọi lần đụng tới client sync trên event loop được ghi lại (kể cả khi bị nuốt lỗi)"""
+    fake = FakeAsyncRedis()
+    violations = []
+    check = redis_cache._check_event_loop
+
+    def recording_check():
+        try:
+            check()
+        except SyncRedisOnEventLoop as e:
+            violations.append(e)
+            raise
+
+    monkeypatch.setattr(redis_cache_module, "REDIS_SYNC_ON_LOOP", "raise")
+    monkeypatch.setattr(redis_cache_module, "NEAR_CACHE_SIZE", 0)
+    monkeypatch.setattr(redis_cache, "_check_event_loop", recording_check)
+    monkeypatch.setattr(redis_cache, "_async_client", fake)
+    monkeypatch.setattr(redis_cache, "_async_scripts", {})
+    fake.violations = violations
+    return fake
+
+
+@pytest.fixture
+def no_background(monkeypatch):
+    """Không lưu DB / cấp id thật: hot path chỉ còn phần Redis"""
+    ids = itertools.count(1)
+
+    async def allocate():
+        return next(ids)
+
+    class Background:
+        def spawn(self, coro, name=None):
+            coro.close()
+
+    monkeypatch.setattr(chat_service, "allocate_message_id", allocate)
+    monkeypatch.setattr(chat_service, "background", Background())
+
+
+def test_check_repply_cached_async_uses_async_client(fake_redis):
+    fake_redis.add_session(SessionState(id=7, name="F-123", status="true", channel="facebook"))
+
+    assert asyncio.run(chat_service.check_repply_cached_async(7, None)) is True
+    assert fake_redis.violations == []
+
+
+def test_send_message_page_service_uses_async_client(fake_redis, no_background):
+    # status "false": bot không trả lời -> không gọi LLM
+    fake_redis.add_session(SessionState(id=7, name="F-123", status="false", channel="facebook"))
+    data = {"platform": "facebook", "sender_id": "123", "page_id": "p1", "message": "xin chào"}
+
+    messages = asyncio.run(chat_service.send_message_page_service(data, None))
+
+    assert [m["sender_type"] for m in messages] == ["customer"]
+    assert messages[0]["chat_session_id"] == 7
+    assert fake_redis.violations == []
+
+
+def test_job_submit_from_coroutine_publishes_off_loop(monkeypatch):
+    published = threading.Event()
+    writes = []
+
+    def cache_set(key, value, ttl=None):
+        try:
+            asyncio.get_running_loop()
+            writes.append("loop")
+        except RuntimeError:
+            writes.append("thread")
+        if value["status"] == job_queue_module.DONE:
+            published.set()
+        return True
+
+    monkeypatch.setattr(job_queue_module, "cache_set", cache_set)
+    monkeypatch.setattr(job_queue_module, "cache_get", lambda key: None)
+    queue = job_queue_module.JobQueue("test", max_workers=1)
+
+    async def submit():
+        return queue.submit(lambda job: "ok", {})
+
+    job = asyncio.run(submit())
+
+    assert published.wait(5)
+    assert job.result == "ok"
+    assert writes and set(writes) == {"thread"}
+    queue.shutdown(wait=True)
@@ -227,6 +227,51 @@ const ChatPage = () => {
                 customer_data: !!msg.customer_data
             });
 
+            // ✅ Gửi hàng loạt: một sự kiện chứa tin nhắn của nhiều conversation
+            if (msg.type === 'campaign_messages') {
+                const bySession = new Map((msg.messages || []).map((m) => [m.chat_session_id, m]));
+                setConversations((prev) => {
+                    const updated = prev.map((conv) => {
+                        const m = bySession.get(conv.session_id);
+                        if (!m) return conv;
+                        bySession.delete(conv.session_id);
+                        return {
+                            ...conv,
+                            content: m.content,
+                            created_at: new Date(),
+                            sender_type: m.sender_type,
+                            status: m.session_status,
+                            image: m.image || []
+                        };
+                    });
+                    const added = [...bySession.values()].map((m) => ({
+                        session_id: m.chat_session_id,
+                        content: m.content,
+                        created_at: new Date(),
+                        name: m.session_name,
+                        status: m.session_status,
+                        platform: m.platform || "web"
+                    }));
+                    return [...added, ...updated].sort(
+                        (a, b) => new Date(b.updatedAt || b.created_at) - new Date(a.updatedAt || a.created_at)
+                    );
+                });
+                const current = (msg.messages || []).find(
+                    (m) => m.chat_session_id === selectedConversationRef.current?.session_id
+                );
+                if (current) {
+                    setShouldScrollToBottom(true);
+                    setMessages((prev) => [...prev, current]);
+                }
+                return;
+            }
+
+            // Tiến độ gửi campaign: không phải tin nhắn của conversation nào
+            if (msg.type === 'campaign_progress') {
+                console.log("📣 Campaign progress:", msg);
+                return;
+            }
+
             // ✅ Xử lý sự kiện cập nhật thông tin khách hàng
             if (msg.type === 'customer_info_update') {
 